@@ -4,43 +4,47 @@
 # See https://llvm.org/LICENSE.txt for license information.
 # SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
 
-import os, sys, argparse, shutil, zipfile
+import os, sys, argparse, shutil, zipfile, tempfile, hashlib
 from azure.storage.blob import ContainerClient
 from azure.core.exceptions import ResourceNotFoundError
 from pathlib import Path
 from zipfile import ZipFile
+from e2e_testing.cache import ModelCache, get_cache_budget, get_cache_revalidate
+from e2e_testing.model_store import ModelStore, STORE_DIR
+from e2e_testing.remote_storage import StorageBackend, MirrorBackend, select_backends, set_new_file_mode
+from e2e_testing.single_flight import single_flight
 
 PRIVATE_CONN_STRING = os.environ.get("AZ_PRIVATE_CONNECTION", default="")
 priv_container_name = "onnxprivatestorage"
 
 
 def pre_test_onnx_model_azure_download(name, cache_dir, model_path):
-    # This util helps setting up the e2eshark/onnx/models tests by ensuring
-    # all the models-tests in the testsList have the required model.onnx file
-    # testsList: expected to contain only onnx tests
+    """Downloads the model zip for test `name` to cache_dir (if it isn't cached and up to date), then links the
+    files extracted from it into the directory of model_path. Returns the paths of the linked .onnx files."""
 
     # if cache directory doesn't exist, then make it
     if not os.path.exists(cache_dir):
         os.mkdir(cache_dir)
 
-    # for the testList download all the onnx/models in cache_path
     download_and_setup_onnxmodel(cache_dir, name)
 
     model_dir = str(Path(model_path).parent)
-    # if the the model exists for the test in the test dir, do nothing.
-    # if it doesn't exist in the test directory but exists in cache dir, simply unzip cached model
     dest_file = os.path.join(cache_dir, "model.onnx.zip")
-    print(f"Unzipping - {dest_file}...","\t")
-    # model_file_path_cache may not exist for models which were not correctly downloaded,
-    # skip unzipping such model files, only extract existing models
-    if os.path.exists(dest_file):
-        # Unzip the model in the model test dir
-        with ZipFile(dest_file, "r") as zf:
-            # onnx/model/testname already present in the zip file structure
-            zf.extractall(model_dir)
-            print(f'Unzipping succeded. Look for extracted contents in {model_dir}')
-    else:
+    # the zip may not exist for models which were not correctly downloaded
+    if not os.path.exists(dest_file):
         print(f'Failed: path {dest_file} does not exist!')
+        return []
+    # each unique model is only extracted once, into a store shared by every test-run directory
+    model_store = ModelStore(os.path.join(Path(cache_dir).parent, STORE_DIR))
+    files = model_store.lookup(name, dest_file)
+    if files is None:
+        with single_flight(model_store.index_path(name) + ".lock"):
+            files = model_store.lookup(name, dest_file)
+            if files is None:
+                print(f"Unzipping - {dest_file}...", "\t")
+                files = model_store.add_zip(name, dest_file)
+    linked = model_store.materialize(files, model_dir)
+    return [os.path.abspath(path) for rel_path, path in sorted(linked.items()) if rel_path.endswith(".onnx")]
 
 
 def download_and_setup_onnxmodel(cache_dir, name):
@@ -48,66 +52,169 @@ def download_and_setup_onnxmodel(cache_dir, name):
     # Download failure should not stop tests running entirely.
     # So downloads will be allowed to fail and corressponding
     # tests will fail with No model.onnx file found error
-
-    # Azure Storage Creds for Public Onnx Models
-    account_url = "https://onnxstorage.blob.core.windows.net"
-    container_name = "onnxstorage"
-
-    # Azure Storage Creds for Private Onnx Models - AZURE Login Required for access
-    priv_account_url = "https://onnxprivatestorage.blob.core.windows.net"
-    priv_container_name = "onnxprivatestorage"
-
-    blob_dir = os.path.join("e2eshark/onnx/models/", name)
-    blob_name = os.path.join(blob_dir, "model.onnx.zip")
-    dest_file = os.path.join(cache_dir, "model.onnx.zip")
-    if os.path.exists(dest_file):
-        # model already in cache dir, skip download.
-        # TODO: skip model downloading based on some comparison / update flag
-        return
+    backends = onnx_model_backends()
+    blob_name = onnx_model_blob_name(name)
+    # cache_dir is CACHE_DIR/name, and the manifest lives in CACHE_DIR
+    model_cache = ModelCache(str(Path(cache_dir).parent), get_cache_budget())
+    cache_key = os.path.join(Path(cache_dir).name, "model.onnx.zip")
+    dest_file = model_cache.path(cache_key)
+    remote = None
+    if model_cache.contains(cache_key) and get_cache_revalidate():
+        # model already in cache dir. Revalidate it against the first backend that has it, if any can be reached.
+        # Offline runs skip this (CACHE_REVALIDATE=0), rather than waiting for each backend to time out.
+        remote = next((m for m in (b.get_metadata(blob_name) for b in backends) if m is not None), None)
+    # Sibling tests and concurrent runs sharing the cache need the same zip: the first to take the lock downloads it,
+    # the others wait and then find it in the cache. The lookup happens under the lock so that it can't remove a zip
+    # that another process is about to record.
+    with single_flight(dest_file + ".lock"):
+        if model_cache.lookup(cache_key, remote):
+            return
+        _download_onnx_model(name, blob_name, dest_file, cache_key, model_cache, backends)
+
+
+def _download_onnx_model(name, blob_name, dest_file, cache_key, model_cache, backends):
     # TODO: better organisation of models in tank and cache
     print(f"Begin download for {blob_name} to {dest_file}")
 
-    try_private = False
-    try:
-        download_azure_blob(account_url, container_name, blob_name, dest_file)
-    except Exception as e:
-        try_private = True
-        print(
-            f"Unable to download model from public for {name}.\nError - {type(e).__name__}"
-        )
-
-    if try_private:
-        print("Trying download from private storage")
+    for backend in backends:
         try:
-            download_azure_blob(
-                priv_account_url, priv_container_name, blob_name, dest_file
-            )
+            metadata = backend.download(blob_name, dest_file)
+            break
         except Exception as e:
-            print(f"Unable to download model for {name}.\nError - {type(e).__name__}")
+            print(f"Unable to download model for {name} from {backend.url(blob_name)}.\nError - {type(e).__name__}")
+    else:
+        return
+    model_cache.record(cache_key, etag=metadata["etag"], md5=metadata["md5"])
+    if model_cache.budget_bytes is not None:
+        # drop extracted files of models that were just evicted
+        ModelStore(os.path.join(model_cache.cache_dir, STORE_DIR)).prune()
 
 
-def download_azure_blob(account_url, container_name, blob_name, dest_file):
+def onnx_model_blob_name(name):
+    return os.path.join("e2eshark/onnx/models/", name, "model.onnx.zip")
+
+
+class AzureBlobBackend(StorageBackend):
+    def __init__(self, account_url: str, container_name: str):
+        self.account_url = account_url
+        self.container_name = container_name
+
+    def url(self, key):
+        return f"{self.account_url}/{self.container_name}/{key}"
+
+    def get_metadata(self, key):
+        return get_blob_metadata(self.account_url, self.container_name, key)
+
+    def download(self, key, dest_file):
+        return download_azure_blob(self.account_url, self.container_name, key, dest_file)
+
+
+# Azure Storage for Public Onnx Models
+PUBLIC_ONNX_STORAGE = AzureBlobBackend("https://onnxstorage.blob.core.windows.net", "onnxstorage")
+# Azure Storage for Private Onnx Models - AZURE Login Required for access
+PRIVATE_ONNX_STORAGE = AzureBlobBackend("https://onnxprivatestorage.blob.core.windows.net", priv_container_name)
+
+
+def onnx_model_backends():
+    """the storage backends to try, in order, for onnx model zips (see e2e_testing/remote_storage.py)"""
+    return select_backends([PUBLIC_ONNX_STORAGE, PRIVATE_ONNX_STORAGE])
+
+
+def sync_onnx_models_mirror(mirror_dir, names):
+    """copies the model zips for the given test names from azure into mirror_dir. Returns False if any failed."""
+    counts = {"synced": 0, "uptodate": 0, "failed": 0}
+    for name in names:
+        for remote in [PUBLIC_ONNX_STORAGE, PRIVATE_ONNX_STORAGE]:
+            result = MirrorBackend(mirror_dir, remote).sync(onnx_model_blob_name(name))
+            if result != "failed":
+                break
+        counts[result] += 1
+    print(f"Mirror {mirror_dir}: {counts['synced']} synced, {counts['uptodate']} up to date, {counts['failed']} failed")
+    return counts["failed"] == 0
+
+
+def _get_container_client(account_url, container_name, **kwargs):
     if container_name == priv_container_name:
         if PRIVATE_CONN_STRING == "":
             print(
                 "Please set AZ_PRIVATE_CONNECTION environment variable with connection string for private azure storage account"
             )
-        with ContainerClient.from_connection_string(
+        return ContainerClient.from_connection_string(
             conn_str=PRIVATE_CONN_STRING,
             container_name=container_name,
-        ) as container_client:
+        )
+    return ContainerClient(account_url, container_name, **kwargs)
+
+
+def _metadata_from_properties(properties):
+    content_md5 = properties.content_settings.content_md5 if properties.content_settings else None
+    return {
+        "size": properties.size,
+        "etag": properties.etag,
+        "md5": bytes(content_md5).hex() if content_md5 else None,
+    }
+
+
+def get_blob_metadata(account_url, container_name, blob_name):
+    """returns the size, etag and md5 of a blob, or None if the blob can't be reached (e.g., when offline)"""
+    if container_name == priv_container_name and PRIVATE_CONN_STRING == "":
+        return None
+    try:
+        with _get_container_client(account_url, container_name) as container_client:
+            properties = container_client.get_blob_client(blob_name).get_blob_properties()
+        return _metadata_from_properties(properties)
+    except Exception:
+        return None
+
+
+def download_azure_blob(account_url, container_name, blob_name, dest_file):
+    """downloads a blob to dest_file and returns its metadata (size, etag, md5)"""
+    if container_name == priv_container_name:
+        with _get_container_client(account_url, container_name) as container_client:
             download_stream = container_client.download_blob(blob_name)
-            with open(dest_file, mode="wb") as local_blob:
-                local_blob.write(download_stream.readall())
-    else:
-        with ContainerClient(
-            account_url,
-            container_name,
-            max_chunk_get_size=1024 * 1024 * 32,  # 32 MiB
-            max_single_get_size=1024 * 1024 * 32,  # 32 MiB
-        ) as container_client:
-            download_stream = container_client.download_blob(
-                blob_name, max_concurrency=4
-            )
-            with open(dest_file, mode="wb") as local_blob:
-                local_blob.write(download_stream.readall())
+            return stream_to_file(download_stream, dest_file)
+    with _get_container_client(
+        account_url,
+        container_name,
+        max_chunk_get_size=1024 * 1024 * 32,  # 32 MiB
+        max_single_get_size=1024 * 1024 * 32,  # 32 MiB
+    ) as container_client:
+        download_stream = container_client.download_blob(
+            blob_name, max_concurrency=4
+        )
+        return stream_to_file(download_stream, dest_file)
+
+
+def _temp_file_next_to(dest_file: str):
+    """creates a temporary file in the directory of dest_file, so that it can be atomically renamed to dest_file"""
+    dest_dir, dest_name = os.path.split(dest_file)
+    return tempfile.mkstemp(dir=dest_dir or ".", prefix=dest_name + ".", suffix=".part")
+
+
+def stream_to_file(download_stream, dest_file: str):
+    """writes a blob download stream to dest_file one chunk at a time, verifies the size and md5 against the
+    blob properties, then renames the temporary file to dest_file. Never holds more than one chunk in memory."""
+    fd, temp_file = _temp_file_next_to(dest_file)
+    set_new_file_mode(fd)
+    md5 = hashlib.md5()
+    num_bytes = 0
+    try:
+        with os.fdopen(fd, mode="wb") as local_blob:
+            for chunk in download_stream.chunks():
+                local_blob.write(chunk)
+                md5.update(chunk)
+                num_bytes += len(chunk)
+            local_blob.flush()
+            os.fsync(local_blob.fileno())
+        properties = download_stream.properties
+        if properties.size is not None and num_bytes != properties.size:
+            raise IOError(f"Received {num_bytes} bytes for {dest_file}, but blob has {properties.size} bytes.")
+        expected_md5 = properties.content_settings.content_md5 if properties.content_settings else None
+        if expected_md5 and bytes(expected_md5) != md5.digest():
+            raise IOError(f"Downloaded {dest_file} does not match the content md5 of the blob.")
+        os.replace(temp_file, dest_file)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    return _metadata_from_properties(properties)
@@ -4,10 +4,12 @@
 # See https://llvm.org/LICENSE.txt for license information.
 # SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
 import abc
+import io
+import os
 import onnxruntime as ort
-from typing import TypeVar, List
+from typing import TypeVar, Dict, List, Optional, Tuple, Union
 from e2e_testing.storage import TestTensors
-from e2e_testing.framework import CompiledOutput, ModelArtifact
+from e2e_testing.framework import CompiledOutput, ModelArtifact, package_version
 from onnx import ModelProto
 
 Invoker = TypeVar("Invoker")
@@ -23,11 +25,71 @@ class BackendBase(abc.ABC):
     def load(self, artifact: CompiledOutput, func_name: str) -> Invoker:
         """loads the function with name func_name from compiled artifact. This method should return a function callable from python."""
 
+    def fingerprint(self) -> str:
+        """describes the compiler and settings used by compile (see TestConfig.stage_fingerprint)"""
+        return type(self).__name__
+
+    def compiled_artifacts(self) -> Optional[List[str]]:
+        """names of the files compile saves, if the compiled artifact can be loaded from them with load_compiled"""
+        return None
+
+    def load_compiled(self, load_from: str) -> CompiledOutput:
+        raise NotImplementedError(f"{type(self).__name__} can't load saved compiled artifacts")
+
+    def runtime_statistics(self) -> Optional[Dict[str, int]]:
+        """returns counters of the runtime's resource usage (e.g., bytes of device memory allocated and freed), if the
+        backend tracks it"""
+        return None
+
 
 from iree import compiler as ireec
 from iree import runtime as ireert
 
 
+# the runtime config (a VM instance and HAL device) of each device, created once per process and shared by all tests
+# run in it, since creating a device (especially with GPU drivers) is slow. Keyed by pid so a forked worker creates
+# its own device instead of using its parent's.
+_runtime_configs: Dict[Tuple[int, str], "ireert.Config"] = {}
+
+
+def get_runtime_config(device: str) -> "ireert.Config":
+    """returns the shared runtime config for device. Each loaded module still gets its own SystemContext."""
+    key = (os.getpid(), device)
+    config = _runtime_configs.get(key)
+    if config is None:
+        config = ireert.Config(device)
+        _runtime_configs[key] = config
+    return config
+
+
+def module_to_bytecode(module) -> bytes:
+    """serializes an MLIR module (e.g., from torch-mlir) to MLIR bytecode, which iree-compile accepts in place of text"""
+    buffer = io.BytesIO()
+    module.operation.write_bytecode(buffer)
+    return buffer.getvalue()
+
+
+# whether iree-compile reads the MLIR bytecode written by torch-mlir, by (iree-compile version, torch-mlir version)
+_reads_bytecode: Dict[Tuple[str, str], bool] = {}
+
+
+def iree_reads_bytecode(module) -> bool:
+    """returns whether iree-compile reads MLIR bytecode written by the MLIR bindings of module. iree-compile can't read
+    bytecode from a newer MLIR than its own, so this is probed once per pair of versions by compiling an empty module
+    of the same context, rather than guessed from the errors of compiling a test's module."""
+    key = (package_version("iree-base-compiler", "iree-compiler"), package_version("torch-mlir"))
+    if key not in _reads_bytecode:
+        with module.context, module.operation.location:
+            probe = type(module).create()
+        try:
+            ireec.tools.compile_str(module_to_bytecode(probe), extra_args=["--compile-to=input"])
+            _reads_bytecode[key] = True
+        except ireec.tools.CompilerToolError:
+            print("\tWarning: iree-compile can't read MLIR bytecode from torch-mlir, falling back to text.")
+            _reads_bytecode[key] = False
+    return _reads_bytecode[key]
+
+
 class SimpleIREEBackend(BackendBase):
     '''This backend uses iree to compile and run MLIR modules for a specified hal_target_backend'''
     def __init__(self, *, device="local-task", hal_target_backend="llvm-cpu", extra_args : List[str] = None):
@@ -63,10 +125,22 @@ class SimpleIREEBackend(BackendBase):
                 # "--iree-llvmcpu-stack-allocation-limit=300000",
             ]
 
+    def fingerprint(self):
+        return f"{package_version('iree-base-compiler', 'iree-compiler')} {self.hal_target_backend} {self.extra_args}"
+
+    def compiled_artifacts(self):
+        return ["compiled_model.vmfb"]
+
+    def load_compiled(self, load_from: str):
+        with open(load_from + "compiled_model.vmfb", "rb") as f:
+            return f.read()
+
     def compile(self, module, *, save_to: str = None):
         # compile to a vmfb for llvm-cpu
+        # hand the module to iree-compile as bytecode: printing and re-parsing large inlined weights as text is slow.
+        # the textual IR is only written out by the test config when it saves artifacts.
         b = ireec.tools.compile_str(
-            str(module),
+            module_to_bytecode(module) if iree_reads_bytecode(module) else str(module),
             target_backends=[self.hal_target_backend],
             extra_args=self.extra_args,
         )
@@ -76,8 +150,15 @@ class SimpleIREEBackend(BackendBase):
                 f.write(b)
         return b
 
+    def runtime_statistics(self):
+        # the statistics of the shared device allocator accumulate over all the tests this process ran
+        config = _runtime_configs.get((os.getpid(), self.device))
+        if config is None:
+            return None
+        return dict(config.device.allocator.statistics)
+
     def load(self, artifact, *, func_name="main"):
-        config = ireert.Config(self.device)
+        config = get_runtime_config(self.device)
         ctx = ireert.SystemContext(config=config)
         vm_module = ireert.VmModule.copy_buffer(ctx.instance, artifact)
         ctx.add_vm_module(vm_module)
@@ -112,9 +193,11 @@ class OnnxrtIreeEpBackend(BackendBase):
             self.sess_opt.intra_op_num_threads = intra_op_num_threads
         #  sess_opt.log_verbosity_level = 0
 
-    def compile(self, model: ModelProto, *, save_to: str = None) -> ort.InferenceSession:
+    def compile(self, model: Union[ModelProto, str], *, save_to: str = None) -> ort.InferenceSession:
+        """builds a session of the model, or of the model saved at a path (e.g., with its weights in external data
+        files, for models which are too large to serialize in memory)"""
         session = ort.InferenceSession(
-                   model.SerializeToString(),
+                   model if isinstance(model, str) else model.SerializeToString(),
                    self.sess_opt,
                    providers=self.providers,
                )
@@ -0,0 +1,110 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""Latency/throughput benchmarking of compiled and native (gold) inference for the benchmark stage of run.py.
+
+Each benchmarked function is run for a number of untimed warmup iterations, then timed per iteration. Peak memory is
+the peak resident set size of the process while the timed iterations ran, sampled in a background thread. It includes
+everything the process holds (e.g., the model weights loaded by both runtimes), so compare it between tests rather
+than reading it as the footprint of one runtime.
+"""
+
+import json
+import os
+import resource
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, NamedTuple
+
+import numpy
+
+BENCHMARK_NAME = "benchmark.json"
+MEMORY_SAMPLE_INTERVAL = 0.01
+
+
+class BenchmarkConfig(NamedTuple):
+    warmup: int = 3
+    iterations: int = 20
+
+
+class BenchmarkResult(NamedTuple):
+    iterations: int
+    mean_ms: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    # runs per second
+    throughput: float
+    peak_rss_mb: float
+
+
+def _current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # not linux: the peak over the life of the process (in KiB) is the best available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _PeakMemorySampler:
+    def __init__(self):
+        self.peak = _current_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(MEMORY_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, _current_rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _current_rss_bytes())
+
+
+def benchmark(func: Callable[[], Any], config: BenchmarkConfig) -> BenchmarkResult:
+    """runs func config.warmup times, then times config.iterations runs of it"""
+    for _ in range(config.warmup):
+        func()
+    times = []
+    with _PeakMemorySampler() as memory:
+        for _ in range(config.iterations):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    times_ms = numpy.array(times) * 1000
+    p50, p90, p99 = numpy.percentile(times_ms, [50, 90, 99])
+    return BenchmarkResult(
+        iterations=len(times),
+        mean_ms=float(times_ms.mean()),
+        p50_ms=float(p50),
+        p90_ms=float(p90),
+        p99_ms=float(p99),
+        throughput=float(len(times) / sum(times)),
+        peak_rss_mb=memory.peak / 2**20,
+    )
+
+
+def save_benchmarks(results: Dict[str, BenchmarkResult], log_dir: str):
+    """saves the results of each benchmarked runtime (e.g., {"compiled": ..., "native": ...}) to the test's log directory"""
+    with open(os.path.join(log_dir, BENCHMARK_NAME), "w") as f:
+        json.dump({name: result._asdict() for name, result in results.items()}, f, indent=4)
+
+
+def load_benchmarks(parent_log_dir: str, test_names: Iterable[str]) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """returns the saved benchmark results of the tests that have them, by test name"""
+    benchmarks = {}
+    for name in test_names:
+        try:
+            with open(os.path.join(parent_log_dir, name, BENCHMARK_NAME)) as f:
+                benchmarks[name] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    return benchmarks
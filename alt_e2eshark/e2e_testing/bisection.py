@@ -0,0 +1,112 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""Helpers for run.py --bisect, which finds the smallest prefix of a failing test's model that fails the same way.
+
+A prefix is made of the first nodes of the model in topological order, and outputs every value the rest of the model
+reads from it. Prefixes are nested, so (for failures caused by a node, rather than by the size of the model) once a
+prefix fails, all longer ones fail too, and a binary search over the prefix size finds the shortest failing prefix in
+O(log N) runs for a model with N nodes. This automates the manual truncation done with TruncatedModel.
+"""
+
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+import onnx
+
+from e2e_testing.framework import OnnxModelInfo
+from e2e_testing.onnx_graph import IndexedGraph, model_with_graph
+from e2e_testing.onnx_utils import get_graph_values, infer_shapes_large, link_external_data
+from e2e_testing.storage import TestTensors
+
+BISECT_NAME = "bisect.json"
+BISECT_DIR = "bisect"
+# the failures a prefix can reproduce: those after the model was set up and the gold outputs were computed
+BISECT_STATUSES = ["import_model", "preprocessing", "compilation", "compiled_inference", "Numerics"]
+# the progress reported while bisecting, followed by ":<status of the full test>"
+BISECT_PROGRESS = "bisect"
+
+
+def bisect_progress(status: str) -> str:
+    """the progress a worker reports while bisecting a test which failed with status"""
+    return f"{BISECT_PROGRESS}:{status}"
+
+
+def bisected_status(progress: Optional[str]) -> Optional[str]:
+    """returns the status of the full test if progress was reported while bisecting it, and None otherwise. A worker
+    which dies while running a prefix has already finished the test itself, so the test keeps that status."""
+    stage, sep, status = (progress or "").partition(":")
+    return status if stage == BISECT_PROGRESS and sep else None
+
+
+class ModelPrefix(OnnxModelInfo):
+    """The first `size` nodes of the (prepared) model of another test. Inputs, dim params and gold inference session
+    options come from the original test."""
+
+    def __init__(self, original: OnnxModelInfo, graph: IndexedGraph, order: List[int], size: int, name: str, onnx_model_path: str):
+        # the prefix is cut from the prepared model, which is already converted to the original's opset version
+        super().__init__(name, onnx_model_path)
+        self.original = original
+        self.graph = graph
+        self.order = order
+        self.size = size
+
+    def construct_model(self):
+        keep = set(self.order[: self.size])
+        graph = self.graph.subgraph(keep, self.graph.frontier(keep))
+        # fills in the types of outputs which had no value info
+        model = infer_shapes_large(model_with_graph(self.original.get_prepared_model(), graph))
+        os.makedirs(os.path.dirname(self.model), exist_ok=True)
+        onnx.save(model, self.model)
+        link_external_data(model, os.path.dirname(self.original.model), os.path.dirname(self.model))
+
+    def update_sess_options(self):
+        self.original.update_sess_options()
+        self.sess_options = self.original.sess_options
+
+    def update_dim_param_dict(self):
+        self.original.update_dim_param_dict()
+        self.dim_param_dict = self.original.dim_param_dict
+
+    def construct_inputs(self):
+        """the inputs of the original test which the prefix still reads"""
+        inputs = self.original.construct_inputs()
+        names = [v.name for v in get_graph_values(self.original.get_model_graph())]
+        prefix_names = {v.name for v in get_graph_values(self.get_model_graph())}
+        return TestTensors(tuple(t for name, t in zip(names, inputs.data) if name in prefix_names))
+
+
+def shortest_failing_prefix(num_nodes: int, fails: Callable[[int], bool], known_failing: bool = False) -> Optional[int]:
+    """returns the smallest size in [1, num_nodes] for which fails(size) is True, assuming that it is True for every
+    larger size too. Returns None if it isn't True for num_nodes. With known_failing, fails(num_nodes) is taken to be
+    True without calling it (e.g., when the whole model was just run and failed)."""
+    if num_nodes == 0 or not (known_failing or fails(num_nodes)):
+        return None
+    low, high = 1, num_nodes
+    while low < high:
+        mid = (low + high) // 2
+        if fails(mid):
+            high = mid
+        else:
+            low = mid + 1
+    return high
+
+
+def save_bisection(result: Dict[str, Any], log_dir: str):
+    with open(os.path.join(log_dir, BISECT_NAME), "w") as f:
+        json.dump(result, f, indent=4)
+
+
+def load_bisections(parent_log_dir: str, test_names) -> Dict[str, Dict[str, Any]]:
+    """returns the saved bisection results of the tests that have them, by test name"""
+    bisections = {}
+    for name in test_names:
+        try:
+            with open(os.path.join(parent_log_dir, name, BISECT_NAME)) as f:
+                bisections[name] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    return bisections
@@ -0,0 +1,132 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Optional
+
+MANIFEST_NAME = "cache_manifest.json"
+
+CacheManifest = Dict[str, Dict[str, Any]]
+
+
+def get_cache_budget() -> Optional[int]:
+    """reads the cache size budget in bytes from the CACHE_BUDGET_GB environment variable, if set"""
+    budget_gb = os.getenv("CACHE_BUDGET_GB")
+    if not budget_gb:
+        return None
+    return int(float(budget_gb) * 1024**3)
+
+
+def get_cache_revalidate() -> bool:
+    """reads whether cached models are revalidated against the remote from the CACHE_REVALIDATE environment variable
+    (on unless set to 0, false or no)"""
+    return os.getenv("CACHE_REVALIDATE", "1").strip().lower() not in ("0", "false", "no")
+
+
+def matches_remote(entry: Dict[str, Any], remote: Dict[str, Any]) -> bool:
+    """compares a manifest entry against remote metadata, preferring md5, then etag, then size"""
+    for key in ["md5", "etag"]:
+        if entry.get(key) and remote.get(key):
+            return entry[key] == remote[key]
+    if remote.get("size") is not None:
+        return entry["size"] == remote["size"]
+    return True
+
+
+class ModelCache:
+    """Tracks downloaded files under a cache directory with a json manifest of (size, etag, md5, last_access).
+
+    Files must be written to a temporary file and renamed into place before being recorded, so an interrupted
+    download never becomes a cache hit. If a size budget is given, the least recently used entries are evicted
+    whenever a new entry is recorded.
+    """
+
+    def __init__(self, cache_dir: str, budget_bytes: Optional[int] = None):
+        self.cache_dir = cache_dir
+        self.budget_bytes = budget_bytes
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+        self._thread_lock = threading.Lock()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    @contextmanager
+    def _manifest(self):
+        """yields the manifest under a process-wide and cross-process lock, then atomically saves it"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._thread_lock, open(self.manifest_path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest = self._load()
+            yield manifest
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=MANIFEST_NAME + ".", suffix=".part")
+            with os.fdopen(fd, "w") as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+            os.replace(temp_path, self.manifest_path)
+
+    def _load(self) -> CacheManifest:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except ValueError:
+            print(f"\tWarning: cache manifest {self.manifest_path} is corrupt and will be rebuilt.")
+            return {}
+
+    def lookup(self, key: str, remote: Optional[Dict[str, Any]] = None) -> bool:
+        """returns True if key is cached and (when remote metadata is provided) up to date. Stale entries are deleted.
+        Files present on disk without a manifest entry are adopted into the manifest."""
+        with self._manifest() as manifest:
+            entry = manifest.get(key)
+            if not self.contains(key):
+                manifest.pop(key, None)
+                return False
+            size = os.path.getsize(self.path(key))
+            if entry is None:
+                entry = {"size": size, "etag": None, "md5": None}
+            if entry["size"] != size or (remote is not None and not matches_remote(entry, remote)):
+                print(f"Removing out-of-date cache entry {key}")
+                os.remove(self.path(key))
+                manifest.pop(key, None)
+                return False
+            entry["last_access"] = time.time()
+            manifest[key] = entry
+            return True
+
+    def record(self, key: str, *, etag: Optional[str] = None, md5: Optional[str] = None):
+        """adds a newly written file to the manifest, then evicts other entries if the cache is over budget"""
+        with self._manifest() as manifest:
+            manifest[key] = {
+                "size": os.path.getsize(self.path(key)),
+                "etag": etag,
+                "md5": md5,
+                "last_access": time.time(),
+            }
+            self._evict(manifest, keep=[key])
+
+    def _evict(self, manifest: CacheManifest, keep: Iterable[str] = ()):
+        if self.budget_bytes is None:
+            return
+        total = sum(entry["size"] for entry in manifest.values())
+        by_last_access = sorted(
+            [key for key in manifest.keys() if key not in keep],
+            key=lambda key: manifest[key].get("last_access", 0),
+        )
+        for key in by_last_access:
+            if total <= self.budget_bytes:
+                return
+            print(f"Evicting least recently used cache entry {key}")
+            if self.contains(key):
+                os.remove(self.path(key))
+            total -= manifest.pop(key)["size"]
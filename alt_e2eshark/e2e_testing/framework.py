@@ -8,9 +8,12 @@ import torch
 import abc
 import os
 from pathlib import Path
-from typing import Union, TypeVar, Tuple, NamedTuple, Dict, Optional, Callable
+from importlib import metadata
+from typing import Any, Union, TypeVar, Tuple, NamedTuple, Dict, List, Optional, Callable
 from e2e_testing.storage import TestTensors
 from e2e_testing.onnx_utils import *
+from e2e_testing.model_store import link_file
+from e2e_testing.prepared_model import PreparedModelCache, file_sha256
 
 # This file two types of classes: framework-specific base classes for storing model info, and generic classes for testing infrastructure.
 
@@ -31,14 +34,13 @@ class OnnxModelInfo:
         self.opset_version = opset_version
         self.sess_options = ort.SessionOptions()
         self.dim_param_dict = None
+        # the parsed model and ort session, with the stat of the model file they were built from (see _get_cached)
+        self._model_cache: Dict[str, Tuple[tuple, Any]] = {}
 
     def forward(self, input: Optional[TestTensors] = None) -> TestTensors:
         """Applies self.model to self.input. Only override if necessary for specific models"""
         input = input.to_numpy().data
-        if not os.path.exists(self.model):
-            self.construct_model()
-        self.update_sess_options()
-        session = ort.InferenceSession(self.model, self.sess_options)
+        session = self.get_session()
         session_inputs = session.get_inputs()
         session_outputs = session.get_outputs()
 
@@ -70,12 +72,10 @@ class OnnxModelInfo:
 
     def construct_inputs(self):
         """can be overridden to generate specific inputs, but a default is provided for convenience"""
-        if not os.path.exists(self.model):
-            self.construct_model()
         self.update_dim_param_dict()
         # print(self.get_signature())
-        # print(get_op_frequency(self.model))
-        return get_sample_inputs_for_onnx_model(self.model, self.dim_param_dict)
+        # print(get_op_frequency(self.get_model_graph()))
+        return get_sample_inputs_for_onnx_model(self.get_model_graph(), self.dim_param_dict)
 
     def apply_postprocessing(self, output: TestTensors):
         """can be overridden to define post-processing methods for individual models"""
@@ -87,11 +87,64 @@ class OnnxModelInfo:
 
     # the following helper methods aren't meant to be overriden
 
-    def get_signature(self, *, from_inputs=True):
-        """Returns the input or output signature of self.model"""
+    def _model_stamp(self) -> tuple:
         if not os.path.exists(self.model):
             self.construct_model()
-        return get_signature_for_onnx_model(self.model, from_inputs=from_inputs, dim_param_dict=self.dim_param_dict)
+        stat = os.stat(self.model)
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _get_cached(self, key: str, build: Callable[[], Any]) -> Any:
+        """returns build() for self.model, reusing the result until the model file is replaced or modified"""
+        stamp = self._model_stamp()
+        cached = self._model_cache.get(key)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, build())
+            self._model_cache[key] = cached
+        return cached[1]
+
+    def get_model_graph(self) -> onnx.ModelProto:
+        """Returns self.model for reading its graph (e.g., the signature), without loading weights stored in external
+        data files. The ModelProto is shared, so don't modify it."""
+        return self._get_cached("model_graph", lambda: load_model_graph(self.model))
+
+    def get_model_hash(self) -> str:
+        """Returns the sha256 of self.model (not including external data files)"""
+        return self._get_cached("sha256", lambda: file_sha256(self.model))
+
+    def get_converted_graph(self) -> onnx.ModelProto:
+        """Returns self.model converted to self.opset_version (if set), without loading weights stored in external data
+        files (see load_external_weights). The ModelProto is shared, so don't modify it."""
+        if not self.opset_version:
+            return self.get_model_graph()
+        return self._get_cached("converted_graph", lambda: self._prepare("converted", self._convert_graph))
+
+    def get_prepared_model(self) -> onnx.ModelProto:
+        """Returns self.model converted to self.opset_version and shape inferred (with data propagation), without
+        loading weights stored in external data files. The ModelProto is shared, so don't modify it."""
+        infer_shapes = lambda: infer_shapes_large(self.get_converted_graph(), data_prop=True)
+        return self._get_cached("prepared_model", lambda: self._prepare("inferred", infer_shapes))
+
+    def _convert_graph(self) -> onnx.ModelProto:
+        return onnx.version_converter.convert_version(self.get_model_graph(), self.opset_version)
+
+    def _prepare(self, stage: str, prepare: Callable[[], onnx.ModelProto]) -> onnx.ModelProto:
+        # prepared models are shared by all test runs through CACHE_DIR, if it is set
+        cache = PreparedModelCache.from_env()
+        if cache is None:
+            return prepare()
+        return cache.load(self.get_model_hash(), self.opset_version, stage, prepare)
+
+    def get_session(self) -> ort.InferenceSession:
+        """Returns an onnxruntime session for self.model with self.sess_options, which is reused for gold inference"""
+        def build():
+            self.update_sess_options()
+            return ort.InferenceSession(self.model, self.sess_options)
+
+        return self._get_cached("session", build)
+
+    def get_signature(self, *, from_inputs=True):
+        """Returns the input or output signature of self.model"""
+        return get_signature_for_onnx_model(self.get_model_graph(), from_inputs=from_inputs, dim_param_dict=self.dim_param_dict)
 
     def load_inputs(self, dir_path):
         """computes the input signature of the onnx model and loads inputs from bin files"""
@@ -118,11 +171,16 @@ class OnnxModelInfo:
         if self.opset_version:
             if not os.path.exists(self.model):
                 self.construct_model()
-            og_model = onnx.load(self.model)
-            model = onnx.version_converter.convert_version(
-                og_model, self.opset_version
-            )
-            onnx.save(model, self.model)
+            # weights in external data files are left where they are: the converted model refers to the same files
+            model = self.get_converted_graph()
+            cache = PreparedModelCache.from_env()
+            converted_path = cache.path(self.get_model_hash(), self.opset_version, "converted") if cache else None
+            # self.model may be linked to the shared model store, so replace the link instead of writing through it
+            if converted_path and os.path.exists(converted_path):
+                link_file(converted_path, self.model)
+            else:
+                onnx.save(model, self.model + ".tmp")
+                os.replace(self.model + ".tmp", self.model)
 
 # TODO: extend TestModel to a union, or make TestModel a base class when supporting other frontends
 TestModel = OnnxModelInfo 
@@ -152,6 +210,42 @@ class TestConfig(abc.ABC):
         """runs the input through the compiled artifact"""
         pass
 
+    def load_function(self, artifact: CompiledOutput, *, func_name: str = None) -> Callable[[TestTensors], TestTensors]:
+        """returns a function which runs inputs through the compiled artifact, so that it can be called repeatedly (e.g.,
+        for benchmarking) without loading the artifact for every call. Override if run does per-call setup."""
+        return lambda inputs: self.run(artifact, inputs, func_name=func_name)
+
+    # The following methods let run.py --reuse skip the import_model, preprocessing and compilation stages when
+    # their saved results are up to date. By default nothing is reused.
+
+    def stage_fingerprint(self, stage: str) -> str:
+        """describes the settings besides its input files that determine the result of stage (e.g., tool versions
+        and flags). Saved results of a stage are only reused while its fingerprint is unchanged."""
+        return type(self).__name__
+
+    def stage_artifacts(self, stage: str) -> Optional[List[str]]:
+        """the names of the files that stage saves in the save_to directory, or None if it can't be reused"""
+        return None
+
+    def load_artifact(self, stage: str, load_from: str) -> Any:
+        """loads the result of stage from the files listed by stage_artifacts in the directory load_from"""
+        raise NotImplementedError(f"{type(self).__name__} can't reuse the results of {stage}")
+
+    def runtime_statistics(self) -> Optional[Dict[str, int]]:
+        """returns counters of the resources (e.g., bytes of device memory) used by run, if they are tracked. The
+        counters may accumulate over all the tests the process ran."""
+        return None
+
+
+def package_version(*names: str) -> str:
+    """returns the installed version of the first of the named packages that is installed, for fingerprints"""
+    for name in names:
+        try:
+            return f"{name} {metadata.version(name)}"
+        except metadata.PackageNotFoundError:
+            continue
+    return f"{names[0]} (unknown version)"
+
 
 class Test(NamedTuple):
     """Used to store the name and TestInfo constructor for a registered test"""
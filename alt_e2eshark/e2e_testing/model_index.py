@@ -0,0 +1,346 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""An index of the op types, opset imports, inputs, dim params, parameter counts and sizes of the onnx models of the
+corpus (the models of e2eshark/onnx/models and of the alt_e2eshark external lists), for questions like "which models
+use GridSample with opset 20" without loading any models.
+
+Models are summarized in parallel on forked workers (see worker_pool.py), reading only their graphs: external data
+files are never opened (only their sizes are read), and the data of inline initializers is skipped at the protobuf wire
+level before the model is parsed, since parameter counts come from the dims of the initializers. Entries are keyed by
+model name (or name/path within the zip for zips with several .onnx files) and record the size and mtime of the file
+they summarize, so rebuilding the index only summarizes new or changed models.
+"""
+
+import json
+import mmap
+import os
+import posixpath
+import tempfile
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy
+import onnx
+
+from e2e_testing.model_store import ModelStore, STORE_DIR
+from e2e_testing.onnx_utils import external_data_locations, graph_value_from_value_info
+from e2e_testing.storage import load_test_txt_file
+from e2e_testing.worker_pool import run_in_workers
+
+INDEX_NAME = "model_index.json"
+INDEX_VERSION = 1
+DEFAULT_DOMAIN = "ai.onnx"
+E2ESHARK_MODELS_DIR = Path(__file__).parents[2] / "e2eshark" / "onnx" / "models"
+EXTERNAL_LISTS_DIR = Path(__file__).parents[1] / "onnx_tests" / "models" / "external_lists"
+
+
+class ModelSource(NamedTuple):
+    """an onnx file to index. Files from the model store are content addressed, so their external data files are
+    found through the {path within the zip: object path} map of their zip rather than next to them."""
+
+    key: str
+    path: str
+    rel_path: Optional[str] = None
+    files: Optional[Dict[str, str]] = None
+
+    def external_data_path(self, location: str) -> Optional[str]:
+        if self.files is None:
+            return os.path.join(os.path.dirname(self.path), location)
+        return self.files.get(posixpath.normpath(posixpath.join(posixpath.dirname(self.rel_path), location)))
+
+
+def corpus_names() -> List[str]:
+    """the names of the e2eshark onnx models and of the models in the alt_e2eshark external lists, without
+    duplicates"""
+    names = sorted(os.listdir(E2ESHARK_MODELS_DIR)) if E2ESHARK_MODELS_DIR.is_dir() else []
+    for list_file in sorted(EXTERNAL_LISTS_DIR.glob("*.txt")):
+        names += load_test_txt_file(list_file)
+    return list(dict.fromkeys(names))
+
+
+def store_sources(names: Iterable[str], cache_dir: str) -> Tuple[List[ModelSource], List[str]]:
+    """returns the sources of the onnx files of the named models which are extracted in the model store of
+    cache_dir (i.e., were downloaded by a test run or azutils), and the names of the models which aren't"""
+    store = ModelStore(os.path.join(cache_dir, STORE_DIR))
+    sources, missing = [], []
+    for name in names:
+        files = store.lookup(name, os.path.join(cache_dir, name, "model.onnx.zip"))
+        onnx_files = sorted(rel_path for rel_path in files or {} if rel_path.endswith(".onnx"))
+        if not onnx_files:
+            missing.append(name)
+            continue
+        for rel_path in onnx_files:
+            key = name if len(onnx_files) == 1 else f"{name}/{rel_path}"
+            sources.append(ModelSource(key, files[rel_path], rel_path, files))
+    return sources, missing
+
+
+def path_sources(paths: Iterable[str]) -> List[ModelSource]:
+    """returns the sources of onnx files given directly, or found under given directories. Files are keyed by the
+    name of their directory (e.g., e2eshark's <model name>/model.onnx) if it has a single .onnx file."""
+    onnx_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            onnx_files += sorted(str(p) for p in Path(path).rglob("*.onnx"))
+        else:
+            onnx_files.append(path)
+    per_dir = Counter(os.path.dirname(os.path.abspath(p)) for p in onnx_files)
+    sources = []
+    for path in onnx_files:
+        model_dir = os.path.dirname(os.path.abspath(path))
+        key = os.path.basename(model_dir) if per_dir[model_dir] == 1 else os.path.splitext(path)[0]
+        sources.append(ModelSource(key, path))
+    return sources
+
+
+def _file_stamp(path: str) -> List[int]:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _graph_nodes(graph: onnx.GraphProto) -> Iterator[onnx.NodeProto]:
+    """the nodes of a graph and of its subgraphs (e.g., the bodies of If and Loop nodes)"""
+    for node in graph.node:
+        yield node
+        for attr in node.attribute:
+            if attr.HasField("g"):
+                yield from _graph_nodes(attr.g)
+            for subgraph in attr.graphs:
+                yield from _graph_nodes(subgraph)
+
+
+def _tensor_size(dims: Iterable[int], data_type: int) -> Tuple[int, int]:
+    """the number of elements and bytes of a tensor, computed from its dims rather than its data"""
+    num_elements = int(numpy.prod(dims, dtype=numpy.int64))
+    try:
+        itemsize = numpy.dtype(onnx.helper.tensor_dtype_to_np_dtype(data_type)).itemsize
+    except (KeyError, TypeError):
+        itemsize = 0
+    if data_type == onnx.TensorProto.STRING:
+        itemsize = 0
+    return num_elements, num_elements * itemsize
+
+
+# the fields to skip when reading a model for its summary, by protobuf message: None skips a field, and a dict skips
+# fields of the submessages in a field. These are the data fields of the TensorProtos of graph.initializer and of
+# graph.sparse_initializer (whose values and indices are TensorProtos).
+_TENSOR_DATA_FIELDS = dict.fromkeys(
+    ["float_data", "int32_data", "string_data", "int64_data", "raw_data", "double_data", "uint64_data"]
+)
+_SPARSE_TENSOR_DATA_FIELDS = {"values": _TENSOR_DATA_FIELDS, "indices": _TENSOR_DATA_FIELDS}
+_GRAPH_DATA_FIELDS = {"initializer": _TENSOR_DATA_FIELDS, "sparse_initializer": _SPARSE_TENSOR_DATA_FIELDS}
+_MODEL_DATA_FIELDS = {"graph": _GRAPH_DATA_FIELDS}
+
+
+def _field_numbers(descriptor, fields: Dict[str, Any]) -> Dict[int, Any]:
+    """maps the names of fields (and of the fields of their submessages) to field numbers"""
+    return {
+        descriptor.fields_by_name[name].number: (
+            None if subfields is None else _field_numbers(descriptor.fields_by_name[name].message_type, subfields)
+        )
+        for name, subfields in fields.items()
+    }
+
+
+_SKIPPED_MODEL_FIELDS = _field_numbers(onnx.ModelProto.DESCRIPTOR, _MODEL_DATA_FIELDS)
+
+
+def _read_varint(data, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _encode_varint(value: int) -> bytes:
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append(value & 0x7F | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _skip_fields(data, start: int, end: int, skipped: Dict[int, Any]) -> List[bytes]:
+    """returns the serialized protobuf message data[start:end] without the skipped fields, as a list of chunks. Fields
+    mapped to a dict are length-delimited submessages, whose own skipped fields are removed (and lengths updated)."""
+    chunks = []
+    copy_from = pos = start
+    while pos < end:
+        field_start = pos
+        key, pos = _read_varint(data, pos)
+        key_end = pos
+        wire_type = key & 0x7
+        if wire_type == 0:
+            _, pos = _read_varint(data, pos)
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            value_start = pos
+            pos += length
+        elif wire_type == 5:
+            pos += 4
+        else:
+            raise ValueError(f"unsupported protobuf wire type {wire_type}")
+        subfields = skipped.get(key >> 3, ...)
+        if subfields is ... or (subfields is not None and wire_type != 2):
+            continue
+        chunks.append(data[copy_from:field_start])
+        copy_from = pos
+        if subfields is not None:
+            value_chunks = _skip_fields(data, value_start, pos, subfields)
+            chunks += [data[field_start:key_end], _encode_varint(sum(map(len, value_chunks)))] + value_chunks
+    chunks.append(data[copy_from:end])
+    return chunks
+
+
+def load_model_without_tensor_data(path: str) -> onnx.ModelProto:
+    """loads an onnx file without the data of its initializers (inline or external), which are kept with their names,
+    dims and types. The data is skipped in the serialized model (mapped rather than read), so it is never copied."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return onnx.ModelProto()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            serialized = b"".join(_skip_fields(data, 0, len(data), _SKIPPED_MODEL_FIELDS))
+    return onnx.ModelProto.FromString(serialized)
+
+
+def summarize_model(source: ModelSource) -> Dict[str, Any]:
+    """returns the index entry of an onnx file"""
+    model = load_model_without_tensor_data(source.path)
+    graph = model.graph
+    op_types = Counter(
+        node.op_type if node.domain in ("", DEFAULT_DOMAIN) else f"{node.domain}::{node.op_type}"
+        for node in _graph_nodes(graph)
+    )
+    initializer_names = {t.name for t in graph.initializer}
+    inputs = [graph_value_from_value_info(vi) for vi in graph.input if vi.name not in initializer_names]
+    outputs = [graph_value_from_value_info(vi) for vi in graph.output]
+    parameters = parameter_bytes = 0
+    for tensor in graph.initializer:
+        num_elements, num_bytes = _tensor_size(tensor.dims, tensor.data_type)
+        parameters += num_elements
+        parameter_bytes += num_bytes
+    for sparse in graph.sparse_initializer:
+        num_elements, num_bytes = _tensor_size(sparse.values.dims, sparse.values.data_type)
+        parameters += num_elements
+        parameter_bytes += num_bytes
+    external_data_bytes = 0
+    for location in external_data_locations(model):
+        data_path = source.external_data_path(location)
+        if data_path is not None and os.path.exists(data_path):
+            external_data_bytes += os.path.getsize(data_path)
+    return {
+        "path": source.path,
+        "stamp": _file_stamp(source.path),
+        "file_bytes": os.path.getsize(source.path),
+        "external_data_bytes": external_data_bytes,
+        "ir_version": model.ir_version,
+        "opsets": {opset.domain or DEFAULT_DOMAIN: opset.version for opset in model.opset_import},
+        "num_nodes": sum(op_types.values()),
+        "op_types": dict(sorted(op_types.items())),
+        "inputs": [value._asdict() for value in inputs],
+        "outputs": [value._asdict() for value in outputs],
+        "dim_params": sorted({d for value in inputs + outputs for d in value.shape if isinstance(d, str)}),
+        "parameters": parameters,
+        "parameter_bytes": parameter_bytes,
+    }
+
+
+def load_index(index_path: str) -> Dict[str, Dict[str, Any]]:
+    """returns the entries of the index at index_path by key, or {} if there is none (or it has an older format)"""
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if index.get("version") != INDEX_VERSION:
+        return {}
+    return index["models"]
+
+
+def save_index(entries: Dict[str, Dict[str, Any]], index_path: str):
+    index_dir = os.path.dirname(os.path.abspath(index_path))
+    os.makedirs(index_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=index_dir, prefix=os.path.basename(index_path) + ".", suffix=".part")
+    with os.fdopen(fd, "w") as f:
+        json.dump({"version": INDEX_VERSION, "models": dict(sorted(entries.items()))}, f)
+    os.replace(temp_path, index_path)
+
+
+def build_index(
+    sources: List[ModelSource], index_path: str, jobs: int, *, keep_others: bool = True
+) -> Tuple[Dict[str, Dict[str, Any]], int]:
+    """summarizes the sources which changed since they were last indexed on `jobs` workers, and saves the index.
+    Entries of models which aren't in sources are kept unless keep_others is False. Returns the entries and the
+    number of sources which were summarized. Models which fail to load (or crash their worker) get an "error" entry,
+    which is retried on the next build."""
+    entries = load_index(index_path)
+    if not keep_others:
+        keys = {source.key for source in sources}
+        entries = {key: entry for key, entry in entries.items() if key in keys}
+    stale = []
+    for source in sources:
+        entry = entries.get(source.key)
+        if entry is None or "error" in entry or entry["path"] != source.path or entry["stamp"] != _file_stamp(source.path):
+            stale.append(source)
+
+    def run_task(index: int, report) -> Dict[str, Any]:
+        try:
+            return summarize_model(stale[index])
+        except Exception as e:
+            return {"path": stale[index].path, "error": f"{type(e).__name__}: {e}"}
+
+    for index, entry, crash in run_in_workers(len(stale), run_task, jobs):
+        if crash is not None:
+            entry = {"path": stale[index].path, "error": crash.describe()}
+        entries[stale[index].key] = entry
+    save_index(entries, index_path)
+    return entries, len(stale)
+
+
+def query_index(
+    entries: Dict[str, Dict[str, Any]],
+    *,
+    op_types: Iterable[str] = (),
+    opset: Optional[int] = None,
+    domain: str = DEFAULT_DOMAIN,
+    dim_param: Optional[str] = None,
+    dynamic: Optional[bool] = None,
+) -> List[str]:
+    """returns the keys of the indexed models which use all of op_types, import `domain` at version `opset`, have
+    an input or output with the dim param `dim_param`, and (if dynamic is given) do or don't have any dim params"""
+    op_types = list(op_types)
+    matches = []
+    for key, entry in entries.items():
+        if "error" in entry:
+            continue
+        if any(op_type not in entry["op_types"] for op_type in op_types):
+            continue
+        if opset is not None and entry["opsets"].get(domain) != opset:
+            continue
+        if dim_param is not None and dim_param not in entry["dim_params"]:
+            continue
+        if dynamic is not None and bool(entry["dim_params"]) != dynamic:
+            continue
+        matches.append(key)
+    return sorted(matches)
+
+
+def op_frequency(entries: Dict[str, Dict[str, Any]], keys: Iterable[str]) -> Dict[str, Tuple[int, int]]:
+    """returns {op type: (number of nodes, number of models)} over the given indexed models, most frequent first"""
+    nodes, models = Counter(), Counter()
+    for key in keys:
+        for op_type, count in entries[key].get("op_types", {}).items():
+            nodes[op_type] += count
+            models[op_type] += 1
+    return {op_type: (count, models[op_type]) for op_type, count in nodes.most_common()}
@@ -0,0 +1,204 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Dict, Iterable, Optional
+from zipfile import ZipFile
+
+STORE_DIR = "extracted"
+COPY_CHUNK_SIZE = 1024 * 1024 * 8  # 8 MiB
+# linux/fs.h ioctl for a copy-on-write clone of a file (btrfs, xfs)
+FICLONE = 0x40049409
+# objects added this recently are never pruned: they may come from a zip that another process is still extracting and
+# hasn't indexed yet
+PRUNE_GRACE_SECONDS = 60 * 60
+
+
+def _temp_file_next_to(dest_file: str):
+    dest_dir = os.path.dirname(dest_file)
+    os.makedirs(dest_dir, exist_ok=True)
+    return tempfile.mkstemp(dir=dest_dir, prefix=os.path.basename(dest_file) + ".", suffix=".part")
+
+
+def _touch(object_file: str):
+    """marks an existing object as just added, so that prune keeps it until the zip reusing it is indexed. Another
+    user's objects in a shared store can't be touched, and are only kept by their index entries and links."""
+    try:
+        os.utime(object_file)
+    except OSError:
+        pass
+
+
+def _reflink(src: str, dest: str) -> bool:
+    """clones src to dest on filesystems with reflink support. Returns False if that isn't possible."""
+    if not sys.platform.startswith("linux"):
+        return False
+    fd, temp_file = _temp_file_next_to(dest)
+    try:
+        with open(src, "rb") as src_f, os.fdopen(fd, "wb") as dest_f:
+            fcntl.ioctl(dest_f.fileno(), FICLONE, src_f.fileno())
+        os.replace(temp_file, dest)
+        return True
+    except OSError as e:
+        os.remove(temp_file)
+        if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL):
+            return False
+        raise
+
+
+def link_file(src: str, dest: str) -> str:
+    """makes dest refer to the contents of src without copying them, preferring a reflink (which can't modify src),
+    then a hardlink, then a symlink. Returns which of these was used."""
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        return "existing"
+    if _reflink(src, dest):
+        return "reflink"
+    temp_file = f"{dest}.{os.getpid()}.{threading.get_ident()}.link"
+    try:
+        os.link(src, temp_file)
+        kind = "hardlink"
+    except OSError:
+        os.symlink(os.path.abspath(src), temp_file)
+        kind = "symlink"
+    os.replace(temp_file, dest)
+    return kind
+
+
+def _source_stamp(zip_path: str) -> Dict[str, int]:
+    stat = os.stat(zip_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class ModelStore:
+    """Content-addressed store of files extracted from model zips.
+
+    Every unique file is decompressed once into objects/<sha256[:2]>/<sha256> (read-only) and linked into each
+    test-run directory that needs it. index/<name>.json records which files came from the zip of a model, so the
+    extracted model can be found without walking any directories, and becomes invalid if the zip is re-downloaded.
+    Linked models must never be written in place: write a new file and os.replace it over the link.
+
+    The layout matches e2eshark/tools/modelstore.py, so both test suites can share a store in the same cache.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self.objects_dir = os.path.join(store_dir, "objects")
+        self.index_dir = os.path.join(store_dir, "index")
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def index_path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name + ".json")
+
+    def lookup(self, name: str, zip_path: str) -> Optional[Dict[str, str]]:
+        """returns {path within the zip: object path} if the files from zip_path are in the store and up to date"""
+        try:
+            with open(self.index_path(name)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(zip_path) or entry["source"] != _source_stamp(zip_path):
+            return None
+        files = {rel_path: self.object_path(digest) for rel_path, digest in entry["files"].items()}
+        if not all(os.path.exists(object_file) for object_file in files.values()):
+            return None
+        return files
+
+    def add_object(self, src: BinaryIO) -> str:
+        """copies the contents of src into the store and returns their sha256 digest"""
+        fd, temp_file = _temp_file_next_to(os.path.join(self.objects_dir, "new"))
+        sha = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as dest:
+                for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b""):
+                    sha.update(chunk)
+                    dest.write(chunk)
+            digest = sha.hexdigest()
+            object_file = self.object_path(digest)
+            if os.path.exists(object_file):
+                os.remove(temp_file)
+                _touch(object_file)
+            else:
+                os.chmod(temp_file, 0o444)
+                os.makedirs(os.path.dirname(object_file), exist_ok=True)
+                os.replace(temp_file, object_file)
+            return digest
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+    def add_zip(self, name: str, zip_path: str, members: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """extracts members (default: all files) of zip_path into the store and indexes them under name"""
+        stamp = _source_stamp(zip_path)
+        members = None if members is None else set(members)
+        digests = {}
+        with ZipFile(zip_path, "r") as zf:
+            for info in zf.infolist():
+                if info.is_dir() or (members is not None and info.filename not in members):
+                    continue
+                if os.path.isabs(info.filename) or ".." in info.filename.split("/"):
+                    raise ValueError(f"Refusing to extract {info.filename} from {zip_path}")
+                with zf.open(info) as src:
+                    digests[info.filename] = self.add_object(src)
+        fd, temp_file = _temp_file_next_to(self.index_path(name))
+        with os.fdopen(fd, "w") as f:
+            json.dump({"zip": os.path.abspath(zip_path), "source": stamp, "files": digests}, f, indent=1)
+        os.replace(temp_file, self.index_path(name))
+        return {rel_path: self.object_path(digest) for rel_path, digest in digests.items()}
+
+    def materialize(self, files: Dict[str, str], dest_dir: str) -> Dict[str, str]:
+        """links files (as returned by lookup or add_zip) into dest_dir and returns their destination paths"""
+        linked = {}
+        for rel_path, object_file in files.items():
+            linked[rel_path] = os.path.join(dest_dir, rel_path)
+            link_file(object_file, linked[rel_path])
+        return linked
+
+    def prune(self) -> int:
+        """removes objects that no up-to-date index entry refers to and that aren't hardlinked elsewhere,
+        e.g. after their zip was evicted from the cache. Objects added in the last PRUNE_GRACE_SECONDS are kept, as
+        the zip they were extracted from may not be indexed yet. Returns the number of bytes freed."""
+        referenced = set()
+        for root, _, filenames in os.walk(self.index_dir):
+            for filename in filenames:
+                if not filename.endswith(".json"):
+                    # e.g., single_flight lock files
+                    continue
+                try:
+                    with open(os.path.join(root, filename)) as f:
+                        entry = json.load(f)
+                    if entry["source"] == _source_stamp(entry["zip"]):
+                        referenced.update(entry["files"].values())
+                except (OSError, ValueError, KeyError):
+                    continue
+        freed = 0
+        for root, _, filenames in os.walk(self.objects_dir):
+            for digest in filenames:
+                object_file = os.path.join(root, digest)
+                try:
+                    stat = os.stat(object_file)
+                    if (
+                        digest in referenced
+                        or digest.endswith(".part")
+                        or stat.st_nlink > 1
+                        or time.time() - stat.st_mtime < PRUNE_GRACE_SECONDS
+                    ):
+                        continue
+                    os.remove(object_file)
+                except FileNotFoundError:
+                    # pruned by another worker
+                    continue
+                freed += stat.st_size
+        return freed
@@ -0,0 +1,159 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""An index of the nodes and values of an onnx graph, for truncating and extracting parts of large models.
+
+Building the index is linear in the size of the graph, and so are (up to sorting) the lookups and extractions built
+on it, whereas rescanning graph.node (or removing from it with pop(i)) per node is quadratic on graphs with 10k+
+nodes. Nodes are referred to by their index in graph.node.
+"""
+
+import heapq
+import itertools
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set
+
+import onnx
+
+
+def _subgraph_outer_names(graph: onnx.GraphProto) -> Set[str]:
+    """the names a subgraph (e.g., the body of an If or Loop) uses from the enclosing scopes"""
+    defined = {vi.name for vi in graph.input} | {t.name for t in graph.initializer}
+    used = set()
+    for node in graph.node:
+        defined.update(node.output)
+        used.update(node_inputs(node))
+    return used - defined
+
+
+def node_inputs(node: onnx.NodeProto) -> List[str]:
+    """the names of the values a node reads, including those read by its subgraphs. Omitted optional inputs ("")
+    are skipped."""
+    names = [name for name in node.input if name]
+    for attr in node.attribute:
+        for subgraph in itertools.chain([attr.g] if attr.HasField("g") else [], attr.graphs):
+            names += sorted(_subgraph_outer_names(subgraph) - set(names))
+    return names
+
+
+class IndexedGraph:
+    def __init__(self, graph: onnx.GraphProto):
+        self.graph = graph
+        self.nodes = list(graph.node)
+        # value name -> index of the node producing it
+        self.producers: Dict[str, int] = {}
+        # value name -> indices of the nodes reading it, in graph order
+        self.consumers: Dict[str, List[int]] = defaultdict(list)
+        # op type -> indices of the nodes of that type, in graph order
+        self.op_nodes: Dict[str, List[int]] = defaultdict(list)
+        self.node_inputs: List[List[str]] = []
+        for i, node in enumerate(self.nodes):
+            self.op_nodes[node.op_type].append(i)
+            for name in node.output:
+                if name:
+                    self.producers[name] = i
+            self.node_inputs.append(node_inputs(node))
+            for name in self.node_inputs[i]:
+                self.consumers[name].append(i)
+        self.initializers: Dict[str, onnx.TensorProto] = {t.name: t for t in graph.initializer}
+        # value infos of graph inputs, intermediate values (if shapes were inferred) and graph outputs
+        self.value_infos: Dict[str, onnx.ValueInfoProto] = {
+            vi.name: vi for vi in itertools.chain(graph.input, graph.value_info, graph.output)
+        }
+        self.graph_outputs = [vi.name for vi in graph.output]
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def nth_node(self, n: int, op_type: str) -> int:
+        """returns the index of the nth node (negative n counts from the end) of type op_type"""
+        indices = self.op_nodes.get(op_type, [])
+        if n > len(indices) - 1 or n < -len(indices):
+            op_freq = {op: len(nodes) for op, nodes in self.op_nodes.items()}
+            raise ValueError(f"There are {len(indices)} nodes with op name {op_type} in model. Provided index {n} is OOB.\n{op_freq}")
+        return indices[n]
+
+    def topological_order(self) -> List[int]:
+        """returns the node indices in an order where every node comes after the producers of its inputs. Nodes of
+        a valid onnx graph are already sorted, in which case this is range(len(self))."""
+        num_deps = [len({self.producers[name] for name in inputs if name in self.producers}) for inputs in self.node_inputs]
+        dependents = defaultdict(set)
+        for i, inputs in enumerate(self.node_inputs):
+            for name in inputs:
+                if name in self.producers:
+                    dependents[self.producers[name]].add(i)
+        # taking the first ready node in graph order keeps the order of a sorted graph
+        ready = [i for i, n in enumerate(num_deps) if n == 0]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            i = heapq.heappop(ready)
+            order.append(i)
+            for j in dependents[i]:
+                num_deps[j] -= 1
+                if num_deps[j] == 0:
+                    heapq.heappush(ready, j)
+        if len(order) != len(self.nodes):
+            raise ValueError("the graph has a cycle")
+        return order
+
+    def ancestors(self, names: Iterable[str]) -> Set[int]:
+        """returns the indices of the nodes needed to compute the values with the given names"""
+        keep = set()
+        stack = [self.producers[name] for name in names if name in self.producers]
+        while stack:
+            i = stack.pop()
+            if i in keep:
+                continue
+            keep.add(i)
+            stack += [self.producers[name] for name in self.node_inputs[i] if name in self.producers]
+        return keep
+
+    def frontier(self, keep: Set[int]) -> List[str]:
+        """returns the values produced by the kept nodes which are read by other nodes or are graph outputs, i.e., the
+        outputs of the graph truncated to the kept nodes"""
+        graph_outputs = set(self.graph_outputs)
+        outputs = []
+        for i in sorted(keep):
+            for name in self.nodes[i].output:
+                if name in graph_outputs or any(c not in keep for c in self.consumers.get(name, [])):
+                    outputs.append(name)
+        return outputs
+
+    def subgraph(self, keep: Set[int], outputs: List[str]) -> onnx.GraphProto:
+        """returns a new graph made of the kept nodes (in graph order) with the given outputs, and the inputs,
+        initializers and value infos they use. Outputs without value infos get empty ones (e.g., to be inferred)."""
+        used = set(outputs)
+        for i in keep:
+            used.update(self.node_inputs[i])
+            used.update(self.nodes[i].output)
+        graph = onnx.GraphProto()
+        graph.name = self.graph.name
+        graph.doc_string = self.graph.doc_string
+        graph.node.extend(self.nodes[i] for i in sorted(keep))
+        graph.input.extend(vi for vi in self.graph.input if vi.name in used)
+        graph.initializer.extend(t for t in self.graph.initializer if t.name in used)
+        graph.sparse_initializer.extend(t for t in self.graph.sparse_initializer if t.values.name in used)
+        graph.value_info.extend(vi for vi in self.graph.value_info if vi.name in used and vi.name not in outputs)
+        for name in outputs:
+            value_info = self.value_infos.get(name)
+            graph.output.append(value_info if value_info is not None else onnx.helper.make_empty_tensor_value_info(name))
+        return graph
+
+
+def model_with_graph(model: onnx.ModelProto, graph: onnx.GraphProto) -> onnx.ModelProto:
+    """returns a new model with the opsets, functions and metadata of model and the given graph"""
+    new_model = onnx.helper.make_model(
+        graph,
+        opset_imports=model.opset_import,
+        functions=model.functions,
+        ir_version=model.ir_version,
+        producer_name=model.producer_name,
+        producer_version=model.producer_version,
+        domain=model.domain,
+        model_version=model.model_version,
+    )
+    new_model.metadata_props.extend(model.metadata_props)
+    return new_model
@@ -1,12 +1,154 @@
 import numpy
 import onnx
 import onnxruntime
+import os
+import tempfile
 import torch
+from onnx.external_data_helper import (
+    ExternalDataInfo,
+    load_external_data_for_model,
+    load_external_data_for_tensor,
+    uses_external_data,
+)
+from e2e_testing.onnx_graph import IndexedGraph, model_with_graph
 from e2e_testing.storage import TestTensors
-from typing import Optional
+from typing import Iterator, NamedTuple, List, Optional, Set, Union
 from pathlib import Path
 
 
+# the onnxruntime names of onnx tensor element types, as in the NodeArg.type strings "tensor(<name>)"
+ORT_TYPE_NAMES = {
+    onnx.TensorProto.FLOAT: "float",
+    onnx.TensorProto.DOUBLE: "double",
+    onnx.TensorProto.FLOAT16: "float16",
+    onnx.TensorProto.BFLOAT16: "bfloat16",
+    onnx.TensorProto.INT8: "int8",
+    onnx.TensorProto.INT16: "int16",
+    onnx.TensorProto.INT32: "int32",
+    onnx.TensorProto.INT64: "int64",
+    onnx.TensorProto.UINT8: "uint8",
+    onnx.TensorProto.UINT16: "uint16",
+    onnx.TensorProto.UINT32: "uint32",
+    onnx.TensorProto.UINT64: "uint64",
+    onnx.TensorProto.BOOL: "bool",
+    onnx.TensorProto.STRING: "string",
+}
+
+
+class GraphValue(NamedTuple):
+    """The name, shape and type of a graph input or output, read from the onnx graph. Has the same fields as an
+    onnxruntime NodeArg: dims are ints, dim_param names, or None if unknown, and type is of the form "tensor(dtype)"."""
+
+    name: str
+    shape: List[Union[int, str, None]]
+    type: str
+
+
+def graph_value_from_value_info(value_info: onnx.ValueInfoProto) -> GraphValue:
+    tensor_type = value_info.type.tensor_type
+    shape = []
+    for dim in tensor_type.shape.dim:
+        if dim.HasField("dim_value"):
+            shape.append(dim.dim_value)
+        elif dim.HasField("dim_param"):
+            shape.append(dim.dim_param)
+        else:
+            shape.append(None)
+    type_name = ORT_TYPE_NAMES.get(tensor_type.elem_type, str(tensor_type.elem_type))
+    return GraphValue(value_info.name, shape, f"tensor({type_name})")
+
+
+def load_model_graph(model_or_path) -> onnx.ModelProto:
+    """returns the given ModelProto, or loads the onnx model at a path without its external weights"""
+    if isinstance(model_or_path, str) or isinstance(model_or_path, Path):
+        return onnx.load(model_or_path, load_external_data=False)
+    if isinstance(model_or_path, onnx.ModelProto):
+        return model_or_path
+    raise TypeError(f'Input argument must be a path, string, or onnx model.')
+
+
+def get_graph_values(model_or_path, *, from_inputs: bool = True) -> List[GraphValue]:
+    """returns the inputs or outputs of an onnx model as an onnxruntime session would, without creating one.
+    Like onnxruntime, initializers which are also listed as graph inputs are not counted as inputs."""
+    graph = load_model_graph(model_or_path).graph
+    if not from_inputs:
+        return [graph_value_from_value_info(vi) for vi in graph.output]
+    initializer_names = {i.name for i in graph.initializer}
+    return [graph_value_from_value_info(vi) for vi in graph.input if vi.name not in initializer_names]
+
+
+def _graph_tensors(graph: onnx.GraphProto) -> Iterator[onnx.TensorProto]:
+    yield from graph.initializer
+    for node in graph.node:
+        for attr in node.attribute:
+            if attr.HasField("t"):
+                yield attr.t
+            yield from attr.tensors
+            if attr.HasField("g"):
+                yield from _graph_tensors(attr.g)
+            for subgraph in attr.graphs:
+                yield from _graph_tensors(subgraph)
+
+
+def has_external_data(model: onnx.ModelProto) -> bool:
+    """returns True if some tensors of the model are stored in external data files and aren't loaded"""
+    return any(uses_external_data(tensor) for tensor in _graph_tensors(model.graph))
+
+
+def external_data_locations(model: onnx.ModelProto) -> Set[str]:
+    """returns the paths (relative to the model's directory) of the external data files the model refers to"""
+    return {ExternalDataInfo(t).location for t in _graph_tensors(model.graph) if uses_external_data(t)}
+
+
+def link_external_data(model: onnx.ModelProto, model_dir: str, copy_dir: str):
+    """symlinks the external data files of a model in model_dir into copy_dir, where a copy of the model (which
+    refers to them by relative paths) is saved"""
+    for location in external_data_locations(model):
+        link = os.path.join(copy_dir, location)
+        if not os.path.exists(link):
+            os.makedirs(os.path.dirname(link), exist_ok=True)
+            os.symlink(os.path.abspath(os.path.join(model_dir, location)), link)
+
+
+def infer_shapes_large(model: onnx.ModelProto, *, data_prop: bool = False) -> onnx.ModelProto:
+    """onnx.shape_inference.infer_shapes for models of any size. If the model can't be serialized in memory (over the
+    2 GB protobuf limit), its weights are saved to a temporary external data file and infer_shapes_path is used.
+
+    Tensors of the model which are stored in external data files are not loaded, so infer the shapes of a model loaded
+    without its external data to avoid copying the weights."""
+    try:
+        return onnx.shape_inference.infer_shapes(model, data_prop=data_prop)
+    except ValueError:
+        pass
+    # the name must differ from the external data files the model already refers to
+    temp_location = "shape_inference_weights.data"
+    with tempfile.TemporaryDirectory() as temp_dir:
+        model_path = os.path.join(temp_dir, "model.onnx")
+        inferred_path = os.path.join(temp_dir, "inferred_model.onnx")
+        # saving as external data moves the weights out of the saved proto, so save a copy
+        model_copy = onnx.ModelProto()
+        model_copy.CopyFrom(model)
+        onnx.save(model_copy, model_path, save_as_external_data=True, location=temp_location)
+        del model_copy
+        onnx.shape_inference.infer_shapes_path(model_path, inferred_path, data_prop=data_prop)
+        inferred_model = onnx.load(inferred_path, load_external_data=False)
+        # only load back the weights which were in memory, the others stay in the model's own external data files
+        for tensor in _graph_tensors(inferred_model.graph):
+            if uses_external_data(tensor) and ExternalDataInfo(tensor).location == temp_location:
+                load_external_data_for_tensor(tensor, temp_dir)
+                tensor.data_location = onnx.TensorProto.DEFAULT
+                del tensor.external_data[:]
+    return inferred_model
+
+
+def load_external_weights(model: onnx.ModelProto, base_dir: str) -> onnx.ModelProto:
+    """loads the tensors of the model which are stored in external data files (with paths relative to base_dir) into
+    the model, for consumers which need the weights in memory (e.g., the torch-mlir importer). Modifies model in place."""
+    if has_external_data(model):
+        load_external_data_for_model(model, base_dir)
+    return model
+
+
 def dtype_from_ort_node(node):
     '''infers a torch dtype from an ort node type of the form "tensor(dtype)"'''
     typestr = node.type
@@ -28,8 +170,8 @@ def dtype_from_ort_node(node):
     raise NotImplementedError(f"Unhandled dtype string found: {dtypestr}")
 
 
-def generate_input_from_node(node: onnxruntime.capi.onnxruntime_pybind11_state.NodeArg, dim_param_dict: Optional[dict[str, int]] = None):
-    """A convenience function for generating sample inputs for an onnxruntime node"""
+def generate_input_from_node(node: Union[GraphValue, onnxruntime.capi.onnxruntime_pybind11_state.NodeArg], dim_param_dict: Optional[dict[str, int]] = None):
+    """A convenience function for generating sample inputs for a graph input or onnxruntime node"""
     int_dims = []
     for dim in node.shape:
         if isinstance(dim, str) and dim_param_dict:
@@ -61,40 +203,31 @@ def generate_input_from_node(node: onnxruntime.capi.onnxruntime_pybind11_state.N
     raise NotImplementedError(f"Found an unhandled dtype: {node.type}.")
 
 
-def get_sample_inputs_for_onnx_model(model_path, dim_param_dict = None):
-    """A convenience function for generating sample inputs for an onnx model"""
-    opt = onnxruntime.SessionOptions()
-    opt.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
-    s = onnxruntime.InferenceSession(model_path, opt)
-    inputs = s.get_inputs()
+def get_sample_inputs_for_onnx_model(model_or_path, dim_param_dict = None):
+    """A convenience function for generating sample inputs for an onnx model (a path or ModelProto)"""
+    inputs = get_graph_values(model_or_path, from_inputs=True)
     sample_inputs = TestTensors(
         tuple([generate_input_from_node(node, dim_param_dict) for node in inputs])
     )
     return sample_inputs
 
 
-def get_signature_for_onnx_model(model_path, *, from_inputs: bool = True, dim_param_dict: Optional[dict[str, int]] = None):
-    """A convenience funtion for retrieving the input or output shapes and dtypes"""
-    s = onnxruntime.InferenceSession(model_path, None)
-    if from_inputs:
-        nodes = s.get_inputs()
-    else:  # taking from outputs
-        nodes = s.get_outputs()
+def get_signature_for_onnx_model(model_or_path, *, from_inputs: bool = True, dim_param_dict: Optional[dict[str, int]] = None):
+    """A convenience funtion for retrieving the input or output shapes and dtypes. Dim params found in dim_param_dict are replaced by their values."""
+    nodes = get_graph_values(model_or_path, from_inputs=from_inputs)
     shapes = []
     dtypes = []
     for i in nodes:
-        shapes.append(i.shape)
+        shape = i.shape
+        if dim_param_dict:
+            shape = [dim_param_dict.get(d, d) if isinstance(d, str) else d for d in shape]
+        shapes.append(shape)
         dtypes.append(dtype_from_ort_node(i))
     return shapes, dtypes
 
 
 def get_op_frequency(model_or_path):
-    if isinstance(model_or_path, str) or isinstance(model_or_path, Path):
-        model = onnx.load(model_or_path)
-    elif isinstance(model_or_path, onnx.ModelProto):
-        model = model_or_path
-    else:
-        raise TypeError(f'Input argument must be a path, string, or onnx model.')
+    model = load_model_graph(model_or_path)
     op_freq = dict()
     for n in model.graph.node:
         if n.op_type in op_freq:
@@ -105,77 +238,30 @@ def get_op_frequency(model_or_path):
 
 
 def modify_model_output(model: onnx.ModelProto, final_node_key: int) -> onnx.ModelProto:
-    """A helper function to change the output of an onnx model to a new output."""
-
+    """A helper function to change the output of an onnx model to a new output. Returns a new model made of the nodes
+    needed to compute the outputs of the node at index final_node_key; model isn't modified."""
+    graph = IndexedGraph(model.graph)
     if final_node_key < 0:
-        final_node_key += len(model.graph.node)
-
-    final_node = model.graph.node[final_node_key]
-
-    # clear old outputs
-    n = len(model.graph.output)
-    for _ in range(n):
-        model.graph.output.pop()
-
-    # add new outputs
-    for vi in model.graph.value_info:
-        if vi.name in final_node.output:
-            model.graph.output.append(vi)
-
-    # remove nodes after the final output
-    for _ in range(final_node_key + 1, len(model.graph.node)):
-        model.graph.node.pop()
-
-    # remove unused nodes, inputs, value_info, and initializers before final output
-    keep_node_names, keep_vi_names = find_minimal_graph(model.graph, final_node_key)
-
-    def remove_unused(attr: str, keep_list):
-        i = 0
-        while i < len(model.graph.__getattribute__(attr)):
-            obj = model.graph.__getattribute__(attr)[i]
-            if obj.name not in keep_list:
-                model.graph.__getattribute__(attr).pop(i)
-            else:
-                i += 1
-
-    remove_unused("node", keep_node_names)
-    remove_unused("input", keep_vi_names)
-    remove_unused("value_info", keep_vi_names)
-    remove_unused("initializer", keep_vi_names)
-    return model
+        final_node_key += len(graph)
+    final_node = graph.nodes[final_node_key]
+    # the new outputs need value infos (e.g., from shape inference), outputs without them are left out as before
+    outputs = [name for name in final_node.output if name in graph.value_infos]
+    keep = graph.ancestors(final_node.output)
+    return model_with_graph(model, graph.subgraph(keep, outputs))
 
 
 def find_minimal_graph(graph: onnx.GraphProto, top_key: int):
-    keep_vi_names = set()
-    keep_vi_names.update(set(graph.node[top_key].output))
-    keep_names = set()
-    i = top_key
-    while i >= 0:
-        node = graph.node[i]
-        if len(set(node.output).intersection(keep_vi_names)) != 0:
-            keep_names.add(node.name)
-            keep_vi_names.update(set(node.input))
-        i -= 1
-
+    """returns the names of the nodes needed to compute the outputs of the node at index top_key, and the names of the
+    values they use"""
+    indexed_graph = IndexedGraph(graph)
+    keep = indexed_graph.ancestors(graph.node[top_key].output)
+    keep_names = {indexed_graph.nodes[i].name for i in keep}
+    keep_vi_names = set(graph.node[top_key].output)
+    for i in keep:
+        keep_vi_names.update(indexed_graph.node_inputs[i])
     return keep_names, keep_vi_names
 
 
-def find_node(model: onnx.ModelProto, n: int, op_name: str) -> onnx.NodeProto:
-    """returns the output names for the nth node in the onnx model with op_type given by op_name"""
-    op_freq = get_op_frequency(model)
-    N = op_freq[op_name]
-    if n > N-1 or n < -N:
-        raise ValueError(f"There are {N} nodes with op name {op_name} in model. Provided index {n} is OOB.\n{op_freq}")
-    if n < 0:
-        n += N
-    match_counter = 0
-    key = -1
-    for nde in model.graph.node:
-        key += 1
-        if nde.op_type != op_name:
-            continue
-        if match_counter == n:
-            node = nde
-            break
-        match_counter += 1
-    return key
+def find_node(model: onnx.ModelProto, n: int, op_name: str) -> int:
+    """returns the index of the nth node in the onnx model with op_type given by op_name"""
+    return IndexedGraph(model.graph).nth_node(n, op_name)
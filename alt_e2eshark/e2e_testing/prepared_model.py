@@ -0,0 +1,76 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""A cache of "prepared" onnx models, i.e., converted to the opset version of a test and shape inferred, in
+CACHE_DIR/prepared.
+
+Opset conversion and shape inference (with data propagation) can take longer than compiling a large model, and give
+the same result for every test-run directory, sibling test and test config using the model. Entries are keyed by the
+sha256 of model.onnx, the target opset version and the onnx version, and are never modified, so the directory can be
+deleted at any time. Weights in external data files aren't part of the hash: prepared models keep referring to them
+(relative to the directory of the original model) and aren't affected by their values.
+"""
+
+import hashlib
+import os
+import tempfile
+from typing import Callable, Optional
+
+import onnx
+
+from e2e_testing.single_flight import single_flight
+
+PREPARED_DIR = "prepared"
+HASH_CHUNK_SIZE = 1024 * 1024 * 8  # 8 MiB
+
+
+def file_sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class PreparedModelCache:
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def from_env() -> Optional["PreparedModelCache"]:
+        """the cache in CACHE_DIR, or None if CACHE_DIR isn't set"""
+        parent_cache_dir = os.getenv("CACHE_DIR")
+        return PreparedModelCache(os.path.join(parent_cache_dir, PREPARED_DIR)) if parent_cache_dir else None
+
+    def path(self, model_hash: str, opset_version: Optional[int], stage: str) -> str:
+        """the path of the model with the given hash prepared up to stage ("converted" or "inferred")"""
+        opset = opset_version or "model"
+        return os.path.join(self.cache_dir, f"{model_hash}.{stage}.opset_{opset}.onnx_{onnx.__version__}.onnx")
+
+    def load(
+        self, model_hash: str, opset_version: Optional[int], stage: str, prepare: Callable[[], onnx.ModelProto]
+    ) -> onnx.ModelProto:
+        """returns the cached model, or the result of prepare(), which is saved to the cache. External weights aren't
+        loaded. Models which are too large to be saved without moving their weights to external data aren't cached."""
+        path = self.path(model_hash, opset_version, stage)
+        if os.path.exists(path):
+            return onnx.load(path, load_external_data=False)
+        with single_flight(path + ".lock"):
+            if os.path.exists(path):
+                return onnx.load(path, load_external_data=False)
+            model = prepare()
+            if model.ByteSize() > onnx.checker.MAXIMUM_PROTOBUF:
+                return model
+            fd, temp_file = tempfile.mkstemp(dir=self.cache_dir, prefix=os.path.basename(path) + ".", suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(model.SerializeToString())
+                # entries may be linked into test-run directories, like the extracted models of the model store
+                os.chmod(temp_file, 0o444)
+                os.replace(temp_file, path)
+            except BaseException:
+                os.remove(temp_file)
+                raise
+        return model
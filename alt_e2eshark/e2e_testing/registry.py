@@ -3,12 +3,38 @@
 # Licensed under the Apache License v2.0 with LLVM Exceptions.
 # See https://llvm.org/LICENSE.txt for license information.
 # SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+import importlib
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from site import getsitepackages
+from typing import Dict, List, Optional
 from e2e_testing.framework import Test
 
 GLOBAL_TEST_LIST = []
 
 _SEEN_NAMES = set()
 
+# the module whose import registered each test, e.g. "onnx_tests.models.azure_models"
+TEST_MODULES: Dict[str, str] = {}
+
+TEST_GROUPS = ["combinations", "models", "operators"]
+TESTS_DIR = Path(__file__).parents[1].joinpath("onnx_tests")
+# caches the names and modules of the registered tests of each group, see load_test_manifest
+MANIFEST_PATH = Path(__file__).parents[1].joinpath(".test_manifest.json")
+
+
+def _registering_module() -> Optional[str]:
+    """returns the name of the module whose top-level code is (directly or through helper functions) registering a test"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code.co_name == "<module>":
+            return frame.f_globals.get("__name__")
+        frame = frame.f_back
+    return None
+
 
 def register_test(test_class: type, test_name: str):
     '''After defining a ModelInfo class "MyModelInfo", you can register it as a test with register_test(MyModelInfo, "my_test_name")'''
@@ -18,6 +44,7 @@ def register_test(test_class: type, test_name: str):
             f"Duplicate test name: '{test_name}'. Please make sure that the function wrapped by `register_test` has a unique name."
         )
     _SEEN_NAMES.add(test_name)
+    TEST_MODULES[test_name] = _registering_module()
 
     # Store the test in the registry.
     GLOBAL_TEST_LIST.append(
@@ -31,3 +58,82 @@ def register_test(test_class: type, test_name: str):
 def register_with_name(name):
     '''Use @register_with_name("my_test_name") before defining a ModelInfo class to add that ModelInfo as a test.'''
     return lambda test_class : register_test(test_class, name)
+
+
+def _group_fingerprint(group: str) -> Dict[str, int]:
+    """the mtimes of the files which can change the tests registered by a group"""
+    paths = [TESTS_DIR.joinpath("helper_classes.py")]
+    for root, dirs, files in os.walk(TESTS_DIR.joinpath(group)):
+        dirs[:] = [d for d in dirs if d != "__pycache__"]
+        paths += [Path(root).joinpath(f) for f in files]
+    if group == "operators":
+        # the onnx node tests are listed from the installed onnx package (see onnx_tests/operators/generate_node.py)
+        paths.append(Path(getsitepackages()[0]).joinpath("onnx", "backend", "test", "data", "node"))
+    fingerprint = {}
+    for path in paths:
+        try:
+            fingerprint[str(path)] = os.stat(path).st_mtime_ns
+        except OSError:
+            fingerprint[str(path)] = None
+    return fingerprint
+
+
+def _import_group(group: str) -> List[str]:
+    """imports all the tests of a group (the slow path), returning their names in the order they were registered"""
+    first = len(GLOBAL_TEST_LIST)
+    importlib.import_module(f"onnx_tests.{group}.model")
+    names = [t.unique_name for t in GLOBAL_TEST_LIST[first:]]
+    if not names:
+        # the group was already imported
+        prefix = f"onnx_tests.{group}."
+        names = [t.unique_name for t in GLOBAL_TEST_LIST if (TEST_MODULES[t.unique_name] or "").startswith(prefix)]
+    return names
+
+
+def load_test_manifest(groups: List[str]) -> Dict[str, str]:
+    """returns the names of the tests registered by the given groups, mapped to the module which registers each of them.
+
+    The manifest is cached in MANIFEST_PATH, and a group's entry is rebuilt by importing the whole group (e.g., after a
+    file in onnx_tests/<group> changed). Otherwise, nothing is imported, so that import_tests only needs to import the
+    modules of the selected tests.
+    """
+    try:
+        with open(MANIFEST_PATH) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    tests = {}
+    changed = False
+    for group in groups:
+        fingerprint = _group_fingerprint(group)
+        entry = manifest.get(group)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            names = _import_group(group)
+            entry = {"fingerprint": fingerprint, "tests": [[name, TEST_MODULES[name]] for name in names]}
+            manifest[group] = entry
+            changed = True
+        tests.update(entry["tests"])
+    if changed:
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=MANIFEST_PATH.parent, prefix=MANIFEST_PATH.name, suffix=".part")
+            with os.fdopen(fd, "w") as f:
+                json.dump(manifest, f)
+            os.replace(temp_path, MANIFEST_PATH)
+        except OSError:
+            # e.g. a read-only checkout: the manifest is rebuilt on every run
+            pass
+    return tests
+
+
+def import_tests(names: List[str], manifest: Dict[str, str]) -> List[Test]:
+    """imports the modules which register the named tests, and returns the tests in the order of names"""
+    for module in dict.fromkeys(manifest[name] for name in names):
+        importlib.import_module(module)
+    tests = {t.unique_name: t for t in GLOBAL_TEST_LIST}
+    missing = [name for name in names if name not in tests]
+    if missing:
+        # the module registers tests differently than when the manifest was built (e.g., depending on the environment)
+        for group in TEST_GROUPS:
+            _import_group(group)
+        tests = {t.unique_name: t for t in GLOBAL_TEST_LIST}
+    return [tests[name] for name in names if name in tests]
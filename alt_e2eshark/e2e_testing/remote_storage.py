@@ -0,0 +1,238 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""Storage backends for downloading model files, and a local/NFS mirror of them.
+
+Backend selection is configured with environment variables:
+ - SHARK_MIRROR_DIR : a mirror directory, laid out as <mirror>/<host>/<url path> with the remote metadata of each
+   file in <file>.meta.json. The layout is shared with e2eshark and iree_tests, so one mirror can serve all of them.
+ - SHARK_STORAGE_BACKEND : "remote", "mirror" (the default if SHARK_MIRROR_DIR is set) or "mirror-first".
+"""
+
+import abc
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import urllib.request
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlparse
+
+from e2e_testing.single_flight import single_flight
+
+MIRROR_DIR_ENV = "SHARK_MIRROR_DIR"
+BACKEND_ENV = "SHARK_STORAGE_BACKEND"
+METADATA_SUFFIX = ".meta.json"
+COPY_CHUNK_SIZE = 1024 * 1024 * 8  # 8 MiB
+# read once at import, before any download threads start: reading the umask means setting it, which would race with
+# files created by other threads
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+# {"size": int, "etag": str or None, "md5": hex str or None}
+Metadata = Dict[str, Any]
+
+
+def mirror_path(mirror_dir: str, url: str) -> str:
+    parsed = urlparse(url)
+    return os.path.join(mirror_dir, parsed.netloc, parsed.path.lstrip("/"))
+
+
+def set_new_file_mode(fd: int):
+    """gives a temporary file from mkstemp (which only its owner can read) the mode of a newly created file, before
+    it's renamed into place, so that shared caches and mirrors stay readable by other users"""
+    os.fchmod(fd, 0o666 & ~_UMASK)
+
+
+def write_chunks(chunks: Iterable[bytes], dest_file: str, expected: Optional[Metadata] = None) -> Metadata:
+    """writes chunks to a temporary file next to dest_file, verifies them against the expected metadata,
+    then renames the file into place. Returns the metadata of the written file."""
+    dest_dir = os.path.dirname(dest_file) or "."
+    os.makedirs(dest_dir, exist_ok=True)
+    fd, temp_file = tempfile.mkstemp(dir=dest_dir, prefix=os.path.basename(dest_file) + ".", suffix=".part")
+    set_new_file_mode(fd)
+    expected = expected or {}
+    md5 = hashlib.md5()
+    num_bytes = 0
+    try:
+        with os.fdopen(fd, mode="wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                md5.update(chunk)
+                num_bytes += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if expected.get("size") is not None and num_bytes != expected["size"]:
+            raise IOError(f"Received {num_bytes} bytes for {dest_file}, expected {expected['size']}.")
+        if expected.get("md5") and expected["md5"] != md5.hexdigest():
+            raise IOError(f"{dest_file} does not match the expected md5.")
+        os.replace(temp_file, dest_file)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    return {"size": num_bytes, "etag": expected.get("etag"), "md5": md5.hexdigest()}
+
+
+def _read_chunks(f: BinaryIO) -> Iterator[bytes]:
+    return iter(lambda: f.read(COPY_CHUNK_SIZE), b"")
+
+
+class StorageBackend(abc.ABC):
+    """A place model files can be downloaded from, with files named by key (e.g., an azure blob name)"""
+
+    @abc.abstractmethod
+    def url(self, key: str) -> str:
+        """returns the url of key, which also determines its location in a mirror"""
+
+    @abc.abstractmethod
+    def get_metadata(self, key: str) -> Optional[Metadata]:
+        """returns the metadata of key, or None if it can't be reached"""
+
+    @abc.abstractmethod
+    def download(self, key: str, dest_file: str) -> Metadata:
+        """atomically downloads key to dest_file and returns its metadata"""
+
+
+class HttpBackend(StorageBackend):
+    """files served over plain http(s), e.g. by a web server in front of a mirror directory"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+    def headers(self) -> Dict[str, str]:
+        """the headers to send with requests for files"""
+        return {}
+
+    def get_metadata(self, key: str) -> Optional[Metadata]:
+        request = urllib.request.Request(self.url(key), headers=self.headers(), method="HEAD")
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                headers = response.headers
+        except OSError:
+            return None
+        size = headers.get("Content-Length")
+        content_md5 = headers.get("Content-MD5")
+        return {
+            "size": None if size is None else int(size),
+            "etag": headers.get("ETag"),
+            "md5": base64.b64decode(content_md5).hex() if content_md5 else None,
+        }
+
+    def download(self, key: str, dest_file: str) -> Metadata:
+        expected = self.get_metadata(key)
+        request = urllib.request.Request(self.url(key), headers=self.headers())
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return write_chunks(_read_chunks(response), dest_file, expected)
+
+
+class HfBackend(HttpBackend):
+    """the files of a Hugging Face model repository, keyed by their path in the repository. Files are served from the
+    resolve urls of the hub, so they are mirrored in <mirror>/huggingface.co/<repo id>/resolve/<revision> (the layout
+    of a snapshot_download of the repository with local_dir)."""
+
+    def __init__(self, repo_id: str, revision: str = "main", endpoint: str = "https://huggingface.co"):
+        super().__init__(f"{endpoint}/{repo_id}/resolve/{revision}")
+        self.repo_id = repo_id
+        self.revision = revision
+
+    def headers(self) -> Dict[str, str]:
+        # huggingface_hub is only needed for Hugging Face files. Its headers carry the token of a logged in user
+        from huggingface_hub.utils import build_hf_headers
+
+        return build_hf_headers()
+
+    def get_metadata(self, key: str) -> Optional[Metadata]:
+        # the hub redirects large files to a CDN, so the size and etag of the file come from huggingface_hub
+        from huggingface_hub import get_hf_file_metadata
+
+        try:
+            metadata = get_hf_file_metadata(self.url(key))
+        except Exception:
+            # connection errors of the http client of huggingface_hub aren't OSErrors
+            return None
+        return {"size": metadata.size, "etag": metadata.etag, "md5": None}
+
+
+class MirrorBackend(StorageBackend):
+    """serves the files of a remote backend from a mirror directory"""
+
+    def __init__(self, mirror_dir: str, remote: StorageBackend):
+        self.mirror_dir = mirror_dir
+        self.remote = remote
+
+    def url(self, key: str) -> str:
+        return self.remote.url(key)
+
+    def path(self, key: str) -> str:
+        return mirror_path(self.mirror_dir, self.url(key))
+
+    def get_metadata(self, key: str) -> Optional[Metadata]:
+        mirrored_file = self.path(key)
+        if not os.path.exists(mirrored_file):
+            return None
+        size = os.path.getsize(mirrored_file)
+        try:
+            with open(mirrored_file + METADATA_SUFFIX) as f:
+                metadata = json.load(f)
+            if metadata.get("size") == size:
+                return metadata
+        except (OSError, ValueError):
+            pass
+        return {"size": size, "etag": None, "md5": None}
+
+    def download(self, key: str, dest_file: str) -> Metadata:
+        expected = self.get_metadata(key)
+        if expected is None:
+            raise FileNotFoundError(f"{self.url(key)} is not in the mirror {self.mirror_dir}")
+        with open(self.path(key), "rb") as f:
+            return write_chunks(_read_chunks(f), dest_file, expected)
+
+    def sync(self, key: str) -> str:
+        """copies key from the remote into the mirror if the mirror doesn't have the same version.
+        Returns "synced", "uptodate" or "failed"."""
+        remote_metadata = self.remote.get_metadata(key)
+        if remote_metadata is None:
+            print(f"Unable to reach {self.url(key)}")
+            return "failed"
+        # the mirror may be shared, and synced from several hosts at once
+        with single_flight(self.path(key) + ".lock"):
+            return self._sync_locked(key, remote_metadata)
+
+    def _sync_locked(self, key: str, remote_metadata: Metadata) -> str:
+        mirrored = self.get_metadata(key)
+        if mirrored is not None and any(
+            mirrored[field] and mirrored[field] == remote_metadata[field] for field in ["md5", "etag"]
+        ):
+            return "uptodate"
+        print(f"Mirroring {self.url(key)}")
+        try:
+            metadata = self.remote.download(key, self.path(key))
+        except Exception as e:
+            print(f"Unable to mirror {self.url(key)}.\nError - {type(e).__name__}")
+            return "failed"
+        with open(self.path(key) + METADATA_SUFFIX, "w") as f:
+            json.dump(metadata, f, indent=1)
+        return "synced"
+
+
+def select_backends(remotes: List[StorageBackend]) -> List[StorageBackend]:
+    """returns the backends to try, in order, for files of the given remotes according to the environment"""
+    mirror_dir = os.getenv(MIRROR_DIR_ENV, "")
+    mode = os.getenv(BACKEND_ENV, "mirror" if mirror_dir else "remote")
+    if mode == "remote":
+        return list(remotes)
+    if not mirror_dir:
+        raise ValueError(f"{BACKEND_ENV}={mode} requires {MIRROR_DIR_ENV} to be set")
+    mirrors = [MirrorBackend(mirror_dir, remote) for remote in remotes]
+    if mode == "mirror":
+        return mirrors
+    if mode == "mirror-first":
+        return mirrors + list(remotes)
+    raise ValueError(f"Unknown {BACKEND_ENV}: {mode}")
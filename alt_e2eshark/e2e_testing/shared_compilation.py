@@ -0,0 +1,85 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""Shares the compiled artifacts of tests with identical models and compile configs during a run.
+
+Sibling tests (e.g., resnet50_vaiq_int8_pp and resnet50_vaiq_int8_no_opt) often differ only in their inputs, gold
+inference or postprocessing, so the first of them to reach import_model imports, preprocesses and compiles the model
+while holding the lock of its key, and publishes the compiled artifacts (or the stage that failed). The others wait
+for the lock, then link the artifacts into their own log directories and skip to construct_inputs.
+
+The key hashes the model file, its opset version, the test config class and the fingerprints of the import_model,
+preprocessing and compilation stages. Entries live in <parent log dir>/.shared_compilation and are cleared at the
+start of every run, since they aren't checked against local rebuilds of the tools (see run.py --reuse for that).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from e2e_testing.framework import OnnxModelInfo, TestConfig
+from e2e_testing.model_store import link_file
+from e2e_testing.single_flight import single_flight
+
+SHARED_DIR = ".shared_compilation"
+ENTRY_NAME = "entry.json"
+COMPILE_STAGES = ["import_model", "preprocessing", "compilation"]
+
+
+class SharedCompilations:
+    def __init__(self, parent_log_dir: str):
+        self.shared_dir = os.path.join(parent_log_dir, SHARED_DIR)
+
+    def clear(self):
+        """drops the entries of previous runs. Call before starting any tests."""
+        shutil.rmtree(self.shared_dir, ignore_errors=True)
+
+    def key(self, inst: OnnxModelInfo, config: TestConfig) -> Optional[str]:
+        """the key of the compiled artifacts of inst, or None if config can't load them from files"""
+        if config.stage_artifacts("compilation") is None:
+            return None
+        description = [inst.get_model_hash(), inst.opset_version, type(config).__name__]
+        description += [config.stage_fingerprint(stage) for stage in COMPILE_STAGES]
+        return hashlib.sha256(json.dumps(description).encode()).hexdigest()
+
+    def lock(self, key: str):
+        """held while the owner of a key runs the compile stages, so the other tests with the key wait for them"""
+        return single_flight(os.path.join(self.shared_dir, key + ".lock"))
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """returns the published entry of key, or None if no test with key has finished compiling"""
+        try:
+            with open(os.path.join(self.shared_dir, key, ENTRY_NAME)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def publish(self, key: str, test_name: str, log_dir: str, artifacts: List[str], func_name: Optional[str]):
+        """shares the compiled artifacts which test_name saved in log_dir"""
+        entry_dir = os.path.join(self.shared_dir, key)
+        os.makedirs(entry_dir, exist_ok=True)
+        for name in artifacts:
+            link_file(os.path.join(log_dir, name), os.path.join(entry_dir, name))
+        self._write_entry(entry_dir, {"test": test_name, "artifacts": artifacts, "func_name": func_name})
+
+    def publish_failure(self, key: str, test_name: str, stage: str):
+        """records that test_name failed at stage, so the other tests with key fail there without retrying it"""
+        entry_dir = os.path.join(self.shared_dir, key)
+        os.makedirs(entry_dir, exist_ok=True)
+        self._write_entry(entry_dir, {"test": test_name, "failed_stage": stage})
+
+    def materialize(self, key: str, entry: Dict[str, Any], log_dir: str):
+        """links the published artifacts of key into log_dir"""
+        for name in entry["artifacts"]:
+            link_file(os.path.join(self.shared_dir, key, name), os.path.join(log_dir, name))
+
+    def _write_entry(self, entry_dir: str, entry: Dict[str, Any]):
+        fd, temp_path = tempfile.mkstemp(dir=entry_dir, prefix=ENTRY_NAME + ".", suffix=".part")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(temp_path, os.path.join(entry_dir, ENTRY_NAME))
@@ -0,0 +1,25 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""Single-flight locking for filling shared caches.
+
+When several test workers, or several CI jobs sharing an NFS cache, need the same cache entry at once, the first one
+to take its lock fills it and the others wait, then re-check the cache and reuse the result:
+
+    with single_flight(dest_file + ".lock"):
+        if not is_up_to_date(dest_file):
+            download(dest_file)
+
+The lock is the one of e2eshark/tools/singleflight.py (an flock on a file next to the entry, with a heartbeat so that
+locks of dead hosts are broken on NFS), which iree_tests also takes, so that the suites can share a cache or mirror.
+"""
+
+import sys
+from pathlib import Path
+
+# allow importing the tools of e2eshark
+sys.path.append(str(Path(__file__).parents[2] / "e2eshark"))
+
+from tools.singleflight import HEARTBEAT_SECONDS, POLL_SECONDS, STALE_LOCK_SECONDS, single_flight
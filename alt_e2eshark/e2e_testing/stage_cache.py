@@ -0,0 +1,87 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+MANIFEST_NAME = "stages.json"
+
+
+class StageCache:
+    """Records the files each test stage read and wrote, and a fingerprint of the settings it ran with, in
+    <log_dir>/stages.json, so that a rerun with --reuse can skip stages whose results are still valid.
+
+    A stage is fresh (reusable) if it ran with the same fingerprint, its outputs exist and are at least as new as its
+    inputs, and the stages it depends on are fresh too. Entries are recorded whether or not reuse is enabled, so any
+    run can be followed by a run with --reuse.
+    """
+
+    def __init__(self, log_dir: str, reuse: bool):
+        self.log_dir = log_dir
+        self.reuse = reuse
+        self.manifest_path = os.path.join(log_dir, MANIFEST_NAME)
+        self.fresh_stages = set()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(self.manifest_path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def is_fresh(self, stage: str, fingerprint: str, depends_on: Iterable[str] = ()) -> bool:
+        """returns True if the saved results of stage can be reused. Stages must be checked in the order they run."""
+        entry = self.entries.get(stage)
+        if not self.reuse or entry is None or entry["fingerprint"] != fingerprint:
+            return False
+        if not all(dep in self.fresh_stages for dep in depends_on):
+            return False
+        outputs = [os.path.join(self.log_dir, name) for name in entry["outputs"]]
+        if not all(os.path.exists(path) for path in entry["inputs"] + outputs):
+            return False
+        newest_input = max((os.path.getmtime(path) for path in entry["inputs"]), default=0)
+        oldest_output = min((os.path.getmtime(path) for path in outputs), default=entry["time"])
+        if newest_input > oldest_output:
+            return False
+        self.fresh_stages.add(stage)
+        return True
+
+    def metadata(self, stage: str) -> Dict[str, Any]:
+        return self.entries[stage]["metadata"]
+
+    def outputs(self, stage: str) -> List[str]:
+        """the paths of the files stage wrote, e.g. to use as the inputs of the next stage"""
+        entry = self.entries.get(stage)
+        return [] if entry is None else [os.path.join(self.log_dir, name) for name in entry["outputs"]]
+
+    def forget(self, stage: str):
+        """drops the entry of a stage which is about to be rerun, since its outputs may be partially rewritten"""
+        if self.entries.pop(stage, None) is not None:
+            self._save()
+
+    def record(self, stage: str, fingerprint: str, inputs: Iterable[str], outputs: Optional[Iterable[str]], **metadata):
+        """records a stage that ran successfully. inputs are paths, outputs are file names in log_dir. A stage with
+        outputs=None saved nothing it can be reused from, so it isn't recorded."""
+        if outputs is None:
+            return
+        outputs = list(outputs)
+        if not all(os.path.exists(os.path.join(self.log_dir, name)) for name in outputs):
+            return
+        self.entries[stage] = {
+            "fingerprint": fingerprint,
+            "inputs": [os.path.abspath(path) for path in inputs],
+            "outputs": outputs,
+            "time": time.time(),
+            "metadata": metadata,
+        }
+        self._save()
+
+    def _save(self):
+        fd, temp_path = tempfile.mkstemp(dir=self.log_dir, prefix=MANIFEST_NAME + ".", suffix=".part")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.manifest_path)
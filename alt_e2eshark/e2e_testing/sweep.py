@@ -0,0 +1,88 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""Helpers for sweeping the dim params of a model (e.g., batch_size and seq_len) with run.py --sweep.
+
+A sweep is specified as NAME=V1,V2,... for each swept dim param, and runs every combination of the values. The model is
+either compiled once with its dim params left dynamic, or compiled once per point after fixing the dim params to the
+values of that point (like e2eshark's --run_as_static).
+"""
+
+import csv
+import itertools
+import os
+from typing import Any, Dict, Iterable, List
+
+import onnx
+from onnxruntime.tools.onnx_model_utils import make_dim_param_fixed, fix_output_shapes
+
+from e2e_testing.framework import OnnxModelInfo
+from e2e_testing.onnx_utils import get_graph_values, link_external_data
+
+SWEEP_NAME = "sweep.csv"
+
+
+def parse_sweep(specs: Iterable[str]) -> Dict[str, List[int]]:
+    """parses a sweep specification, e.g. ["batch_size=1,4,16", "seq_len=128,512"]"""
+    sweep = {}
+    for spec in specs:
+        name, sep, values = spec.partition("=")
+        if not sep or not name or not values:
+            raise ValueError(f"invalid sweep specification '{spec}', expected NAME=V1,V2,...")
+        try:
+            sweep[name] = [int(v) for v in values.split(",")]
+        except ValueError:
+            raise ValueError(f"invalid sweep specification '{spec}': dim param values must be integers")
+    return sweep
+
+
+def sweep_points(sweep: Dict[str, List[int]]) -> List[Dict[str, int]]:
+    """returns every combination of the swept dim param values"""
+    names = list(sweep.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*sweep.values())]
+
+
+def point_name(point: Dict[str, int]) -> str:
+    """a name for a sweep point which can be used as a directory name, e.g. batch_size_4-seq_len_128"""
+    return "-".join(f"{name}_{value}" for name, value in point.items())
+
+
+def check_sweep_dims(model: onnx.ModelProto, sweep: Dict[str, List[int]]):
+    """raises a ValueError if the model's inputs don't have some of the swept dim params"""
+    dim_params = {d for value in get_graph_values(model) for d in value.shape if isinstance(d, str)}
+    missing = [name for name in sweep if name not in dim_params]
+    if missing:
+        raise ValueError(f"the model inputs have no dim params named {missing}. The dim params are: {sorted(dim_params)}")
+
+
+def make_static_model_info(model_info: OnnxModelInfo, dims: Dict[str, int], save_to: str) -> OnnxModelInfo:
+    """saves a copy of the model of model_info with its dim params fixed to dims in the directory save_to, and returns
+    the model info of the copy, which can be imported by a test config"""
+    model = onnx.ModelProto()
+    model.CopyFrom(model_info.get_model_graph())
+    for name, value in dims.items():
+        make_dim_param_fixed(model.graph, name, value)
+    fix_output_shapes(model)
+    os.makedirs(save_to, exist_ok=True)
+    static_info = OnnxModelInfo(model_info.name, save_to, model_info.opset_version)
+    onnx.save(model, static_info.model)
+    link_external_data(model, os.path.dirname(model_info.model), save_to)
+    return static_info
+
+
+def save_sweep(rows: List[Dict[str, Any]], path: str):
+    """writes the rows of a sweep as a csv file. Rows may have different columns (e.g., an error)."""
+    columns = []
+    for row in rows:
+        columns += [c for c in row if c not in columns]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def load_sweep(path: str) -> List[Dict[str, str]]:
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
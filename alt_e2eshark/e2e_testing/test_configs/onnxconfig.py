@@ -4,14 +4,17 @@
 # See https://llvm.org/LICENSE.txt for license information.
 # SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
 import onnx
+import os
+import tempfile
 from torch_mlir.extras import onnx_importer
 from torch_mlir.dialects import torch as torch_d
-from torch_mlir.ir import Context
+from torch_mlir.ir import Context, Module as MlirModule
 from e2e_testing.backends import BackendBase
-from e2e_testing.framework import TestConfig, OnnxModelInfo, Module, CompiledArtifact
+from e2e_testing.framework import TestConfig, OnnxModelInfo, Module, CompiledArtifact, package_version
+from e2e_testing.onnx_utils import has_external_data, load_external_weights
 from e2e_testing.storage import TestTensors
 from torch_mlir.passmanager import PassManager
-from typing import Tuple
+from typing import List, Optional, Tuple, Union
 from onnxruntime import InferenceSession
 
 REDUCE_TO_LINALG_PIPELINE = [
@@ -20,6 +23,16 @@ REDUCE_TO_LINALG_PIPELINE = [
 ]
 
 
+def with_external_weights(model: onnx.ModelProto, model_info: OnnxModelInfo) -> onnx.ModelProto:
+    """returns the shared model (e.g., the prepared model of model_info), or a copy of it with the weights in its
+    external data files loaded, since both onnxruntime and the torch-mlir importer need them in memory"""
+    if not has_external_data(model):
+        return model
+    weighted_model = onnx.ModelProto()
+    weighted_model.CopyFrom(model)
+    return load_external_weights(weighted_model, os.path.dirname(model_info.model))
+
+
 class OnnxEpTestConfig(TestConfig):
     '''This is the basic testing configuration for onnx models'''
     def __init__(self, log_dir: str, backend: BackendBase):
@@ -28,27 +41,46 @@ class OnnxEpTestConfig(TestConfig):
         self.backend = backend
 
     def import_model(self, model_info: OnnxModelInfo, *, save_to: str = None) -> Tuple[onnx.ModelProto, None]:
-        model = onnx.load(model_info.model)
-        if model_info.opset_version:
-            model = onnx.version_converter.convert_version(
-                model, model_info.opset_version
-            )
+        model = with_external_weights(model_info.get_prepared_model(), model_info)
         # don't save the model, since it already exists in the log directory.
         return model, None
     
-    def preprocess_model(self, model: onnx.ModelProto, *, save_to: str) -> onnx.ModelProto:
-        shaped_model = onnx.shape_inference.infer_shapes(model, data_prop=True)
-        if save_to:
-            onnx.save(shaped_model, save_to + "inferred_model.onnx")
-        return shaped_model
+    def preprocess_model(self, model: onnx.ModelProto, *, save_to: str) -> Union[onnx.ModelProto, str]:
+        """returns the model (the prepared model from import_model is already shape inferred), or the path it was saved
+        to if it is too large to be serialized in memory, in which case onnxruntime loads it and its external data
+        from the file"""
+        if model.ByteSize() <= onnx.checker.MAXIMUM_PROTOBUF:
+            if save_to:
+                onnx.save(model, save_to + "inferred_model.onnx")
+            return model
+        # without a log directory (no_artifacts), the model still needs a file of its own
+        save_dir = save_to or tempfile.mkdtemp(dir=self.log_dir, prefix="inferred_model.")
+        model_path = os.path.join(save_dir, "inferred_model.onnx")
+        # saving with external data moves the weights out of the saved model, so save a copy
+        saved_model = onnx.ModelProto()
+        saved_model.CopyFrom(model)
+        onnx.save(
+            saved_model,
+            model_path,
+            save_as_external_data=True,
+            all_tensors_to_one_file=True,
+            location="inferred_model.onnx.data",
+        )
+        return model_path
 
-    def compile(self, model: onnx.ModelProto, *, save_to: str = None) -> InferenceSession:
+    def compile(self, model: Union[onnx.ModelProto, str], *, save_to: str = None) -> InferenceSession:
         return self.backend.compile(model, save_to=save_to)
 
     def run(self, session: InferenceSession, inputs: TestTensors, *, func_name=None) -> TestTensors:
         func = self.backend.load(session)
         return func(inputs)
 
+    def load_function(self, session: InferenceSession, *, func_name=None):
+        return self.backend.load(session)
+
+    def runtime_statistics(self):
+        return self.backend.runtime_statistics()
+
 
 class OnnxTestConfig(TestConfig):
     '''This is the basic testing configuration for onnx models. This should be initialized with a specific backend, and uses torch-mlir to import the onnx model to torch-onnx MLIR, and apply torch-mlir pre-proccessing passes if desired.'''
@@ -64,12 +96,7 @@ class OnnxTestConfig(TestConfig):
             self.pass_pipeline = None
 
     def import_model(self, model_info: OnnxModelInfo, *, save_to: str = None) -> Tuple[Module, str]:
-        model = onnx.load(model_info.model)
-        if model_info.opset_version:
-            model = onnx.version_converter.convert_version(
-                model, model_info.opset_version
-            )
-        shaped_model = onnx.shape_inference.infer_shapes(model, data_prop=True)
+        shaped_model = with_external_weights(model_info.get_prepared_model(), model_info)
         func_name = shaped_model.graph.name
         context = Context()
         torch_d.register_dialect(context)
@@ -112,3 +139,40 @@ class OnnxTestConfig(TestConfig):
     def run(self, artifact: CompiledArtifact, inputs: TestTensors, *, func_name="main") -> TestTensors:
         func = self.backend.load(artifact, func_name=func_name)
         return func(inputs)
+
+    def load_function(self, artifact: CompiledArtifact, *, func_name="main"):
+        return self.backend.load(artifact, func_name=func_name)
+
+    def runtime_statistics(self):
+        return self.backend.runtime_statistics()
+
+    def stage_fingerprint(self, stage: str) -> str:
+        if stage == "import_model":
+            return f"{package_version('torch-mlir')} {package_version('onnx')}"
+        if stage == "preprocessing":
+            return f"{package_version('torch-mlir')} {self.pass_pipeline}"
+        if stage == "compilation":
+            return self.backend.fingerprint()
+        return super().stage_fingerprint(stage)
+
+    def stage_artifacts(self, stage: str) -> Optional[List[str]]:
+        if stage == "import_model":
+            return ["model.torch_onnx.mlir"]
+        if stage == "preprocessing":
+            # without a pass pipeline the imported module is passed through
+            return ["model.torch.mlir", "model.modified.mlir"] if self.pass_pipeline else []
+        if stage == "compilation":
+            return self.backend.compiled_artifacts()
+        return None
+
+    def load_artifact(self, stage: str, load_from: str):
+        if stage == "preprocessing" and not self.pass_pipeline:
+            stage = "import_model"
+        if stage in ["import_model", "preprocessing"]:
+            context = Context()
+            torch_d.register_dialect(context)
+            with open(load_from + self.stage_artifacts(stage)[-1]) as f:
+                return MlirModule.parse(f.read(), context=context)
+        if stage == "compilation":
+            return self.backend.load_compiled(load_from)
+        return super().load_artifact(stage, load_from)
@@ -0,0 +1,99 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""Generates many truncated copies of a model (e.g., repros of a failure at different depths) from one parse and one
+shape inference of it.
+
+A TruncationBatch directory holds base.onnx, the shape inferred model with its weights moved to one external data
+file, and the truncated models, which only hold their graphs and refer to the weights in that same file. Generating a
+truncated model therefore only extracts and saves its graph. The base is built once, under a lock, and is reused by
+every process that truncates the same model.
+"""
+
+import os
+import tempfile
+from typing import Dict, Iterable, List
+
+import onnx
+
+from e2e_testing.framework import OnnxModelInfo
+from e2e_testing.onnx_graph import IndexedGraph, model_with_graph
+from e2e_testing.onnx_utils import infer_shapes_large, link_external_data, load_model_graph
+from e2e_testing.single_flight import single_flight
+
+BASE_NAME = "base.onnx"
+WEIGHTS_NAME = "truncation_weights.data"
+TRUNCATION_DIR = "truncated"
+
+
+class TruncationBatch:
+    def __init__(self, model_path: str, batch_dir: str):
+        self.batch_dir = batch_dir
+        base_path = os.path.join(batch_dir, BASE_NAME)
+        with single_flight(batch_dir + ".lock"):
+            if not os.path.exists(base_path):
+                self._save_base(model_path, base_path)
+        self.base = onnx.load(base_path, load_external_data=False)
+        self.graph = IndexedGraph(self.base.graph)
+
+    def _save_base(self, model_path: str, base_path: str):
+        model = infer_shapes_large(load_model_graph(model_path), data_prop=True)
+        os.makedirs(self.batch_dir, exist_ok=True)
+        # weights which are already in external data files stay there, and are linked into the batch directory
+        link_external_data(model, os.path.dirname(model_path), self.batch_dir)
+        fd, temp_path = tempfile.mkstemp(dir=self.batch_dir, prefix=BASE_NAME + ".", suffix=".part")
+        os.close(fd)
+        onnx.save(model, temp_path, save_as_external_data=True, all_tensors_to_one_file=True, location=WEIGHTS_NAME)
+        os.replace(temp_path, base_path)
+
+    def node_index(self, n: int, op_type: str) -> int:
+        """the index of the node TruncatedModel(n, op_type) cuts at: the nth node of type op_type, or the nth node
+        back from the end if op_type is \"\""""
+        if op_type == "":
+            return len(self.graph) - n
+        return self.graph.nth_node(n, op_type)
+
+    def every_k_nodes(self, k: int) -> List[int]:
+        """the indices of every kth node, e.g. for truncating a model at regular depths"""
+        return list(range(k - 1, len(self.graph), k))
+
+    def path(self, node_index: int) -> str:
+        return os.path.join(self.batch_dir, f"truncated_{node_index}.onnx")
+
+    def save(self, node_index: int) -> str:
+        """saves the model truncated to the outputs of the node at node_index (and the nodes computing them), unless
+        it was already saved, and returns its path"""
+        path = self.path(node_index)
+        if os.path.exists(path):
+            return path
+        node = self.graph.nodes[node_index]
+        # outputs need value infos from shape inference, as in modify_model_output
+        outputs = [name for name in node.output if name in self.graph.value_infos]
+        model = model_with_graph(self.base, self.graph.subgraph(self.graph.ancestors(node.output), outputs))
+        fd, temp_path = tempfile.mkstemp(dir=self.batch_dir, prefix=os.path.basename(path) + ".", suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(model.SerializeToString())
+        os.replace(temp_path, path)
+        return path
+
+    def save_all(self, node_indices: Iterable[int]) -> Dict[int, str]:
+        """saves the model truncated at each of node_indices, and returns their paths by node index"""
+        return {i: self.save(i) for i in node_indices}
+
+
+# batch directory -> batch, so the tests truncating a model in the same process share its parsed graph
+_batches: Dict[str, TruncationBatch] = {}
+
+
+def get_truncation_batch(model_info: OnnxModelInfo) -> TruncationBatch:
+    """returns the batch of truncated models of model_info, in a directory next to its model named after the model's
+    hash, so that the batch is rebuilt if the model changes"""
+    if not os.path.exists(model_info.model):
+        model_info.construct_model()
+    model_dir = os.path.dirname(model_info.model)
+    batch_dir = os.path.join(model_dir, TRUNCATION_DIR, model_info.get_model_hash()[:16])
+    if batch_dir not in _batches:
+        _batches[batch_dir] = TruncationBatch(model_info.model, batch_dir)
+    return _batches[batch_dir]
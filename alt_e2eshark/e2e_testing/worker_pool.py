@@ -0,0 +1,134 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""Runs tasks in forked worker processes, so that a crash (e.g., a segfault in native bindings) only fails one task.
+
+Workers are forked, so tasks (e.g., tests whose model classes can't be pickled) are referred to by index. While running
+a task, a worker reports its progress (e.g., the current test stage) to the parent, so a crash can be attributed to
+the step that was running. Each worker is replaced after max_tasks_per_worker tasks, and after a crash.
+"""
+
+import multiprocessing
+import signal
+from collections import deque
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Iterator, NamedTuple, Optional
+
+# called by a task with a description of its progress, e.g., the stage it is about to run
+ProgressCallback = Callable[[str], None]
+
+
+class WorkerCrash(NamedTuple):
+    """describes a worker process which died while running a task"""
+
+    last_progress: Optional[str]
+    exitcode: Optional[int]
+
+    def describe(self) -> str:
+        if self.exitcode is not None and self.exitcode < 0:
+            try:
+                return f"worker process was killed by {signal.Signals(-self.exitcode).name}"
+            except ValueError:
+                pass
+        return f"worker process exited with code {self.exitcode}"
+
+
+def _worker_main(conn: Connection, run_task: Callable[[int, ProgressCallback], Any]):
+    report = lambda progress: conn.send(("progress", progress))
+    while True:
+        index = conn.recv()
+        if index is None:
+            return
+        conn.send(("done", run_task(index, report)))
+
+
+class _Worker:
+    def __init__(self, ctx, run_task: Callable[[int, ProgressCallback], Any]):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, run_task), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task: Optional[int] = None
+        self.progress: Optional[str] = None
+        self.num_tasks = 0
+
+    def assign(self, index: int):
+        self.task = index
+        self.progress = None
+        try:
+            self.conn.send(index)
+        except (BrokenPipeError, OSError):
+            # the worker died after its last task, which is detected (as a crash) by run_in_workers
+            pass
+
+    def receive(self) -> Optional[Any]:
+        """handles the messages from the worker. Returns ("done", result) once the task finished, or None."""
+        try:
+            while self.conn.poll():
+                kind, value = self.conn.recv()
+                if kind == "progress":
+                    self.progress = value
+                else:
+                    return (kind, value)
+        except (EOFError, OSError):
+            pass
+        return None
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join()
+        self.conn.close()
+
+
+def run_in_workers(
+    num_tasks: int,
+    run_task: Callable[[int, ProgressCallback], Any],
+    jobs: int,
+    max_tasks_per_worker: int = 0,
+) -> Iterator[tuple]:
+    """runs run_task(index, report_progress) for every index in range(num_tasks) on `jobs` forked worker processes.
+
+    Yields (index, result, None) for every finished task and (index, None, WorkerCrash) for every task whose worker
+    died, in order of completion. Tasks are started in index order. max_tasks_per_worker = 0 never recycles workers.
+    """
+    ctx = multiprocessing.get_context("fork")
+    pending = deque(range(num_tasks))
+    workers = [_Worker(ctx, run_task) for _ in range(min(jobs, num_tasks))]
+    for worker in workers:
+        worker.assign(pending.popleft())
+
+    while workers:
+        ready = wait([w.conn for w in workers] + [w.process.sentinel for w in workers])
+        for worker in list(workers):
+            if worker.conn not in ready and worker.process.sentinel not in ready:
+                continue
+            message = worker.receive()
+            crashed = message is None and not worker.process.is_alive()
+            if message is not None:
+                yield worker.task, message[1], None
+            elif crashed:
+                worker.process.join()
+                yield worker.task, None, WorkerCrash(worker.progress, worker.process.exitcode)
+            else:
+                continue
+            worker.task = None
+            worker.num_tasks += 1
+
+            # the worker is idle: replace it if it crashed or ran its share of tasks, then give it the next task
+            if crashed or 0 < max_tasks_per_worker <= worker.num_tasks:
+                worker.stop()
+                workers.remove(worker)
+                if not pending:
+                    continue
+                worker = _Worker(ctx, run_task)
+                workers.append(worker)
+            if pending:
+                worker.assign(pending.popleft())
+            else:
+                worker.stop()
+                workers.remove(worker)
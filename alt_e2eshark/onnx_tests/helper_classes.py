@@ -10,10 +10,8 @@ from onnx.helper import make_node, make_graph, make_model
 from pathlib import Path
 from e2e_testing import azutils
 from e2e_testing.framework import OnnxModelInfo
-from e2e_testing.onnx_utils import (
-    modify_model_output,
-    find_node,
-)
+from e2e_testing.onnx_utils import get_op_frequency
+from e2e_testing.truncation import get_truncation_batch
 
 """This file contains several helpful child classes of OnnxModelInfo."""
 
@@ -31,29 +29,19 @@ class AzureDownloadableModel(OnnxModelInfo):
         self.sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
 
     def construct_model(self):
-        # try to find a .onnx file in the test-run dir
-        # if that fails, check for zip file in cache
-        # if that fails, try to download and setup from azure, then search again for a .onnx file
-
-        # TODO: make the zip file structure more uniform so we don't need to search for extracted files
+        # download the zip to the cache (or revalidate the cached one) and link the extracted files into the test-run dir
+        # the .onnx files are known from the model store index, so there is no need to search for them
+        # TODO: make the zip file structure more uniform so we don't need to handle multiple .onnx files
         model_dir = str(Path(self.model).parent)
-
-        def find_models(model_dir):
-            # search for a .onnx file in the ./test-run/testname/ dir
-            found_models = []
+        found_models = azutils.pre_test_onnx_model_azure_download(
+            self.name, self.cache_dir, self.model
+        )
+        if len(found_models) == 0:
+            # nothing in the cache (e.g. offline), fall back to a model previously extracted into the test-run dir
             for root, dirs, files in os.walk(model_dir):
                 for name in files:
-                    if name[-5:] == ".onnx":  
+                    if name[-5:] == ".onnx":
                         found_models.append(os.path.abspath(os.path.join(root, name)))
-            return found_models
-
-        found_models = find_models(model_dir) 
-
-        if len(found_models) == 0:
-            azutils.pre_test_onnx_model_azure_download(
-                self.name, self.cache_dir, self.model
-            )
-            found_models = find_models(model_dir)
         if len(found_models) == 1:
             self.model = found_models[0]
             return
@@ -124,18 +112,10 @@ class TruncatedModel(SiblingModel):
         super().__init__(*args, **kwargs)
 
     def construct_model(self):
-        if not os.path.exists(self.sibling_inst.model):
-            self.sibling_inst.construct_model()
-        og_model = onnx.load(self.sibling_inst.model)
-        inf_model = onnx.shape_inference.infer_shapes(og_model, data_prop=True)
-        output_node = (
-            -self.n
-            if self.op_type == ""
-            else find_node(inf_model, self.n, self.op_type)
-        )
-        new_model = modify_model_output(inf_model, output_node)
-        onnx.save(new_model, self.model)
-        from e2e_testing.onnx_utils import get_op_frequency
+        # the sibling model is parsed and shape inferred once for all of its truncations (see e2e_testing/truncation.py),
+        # and the truncated models share its weights
+        batch = get_truncation_batch(self.sibling_inst)
+        self.model = batch.save(batch.node_index(self.n, self.op_type))
         print(get_op_frequency(self.model))
 
 
@@ -40,7 +40,7 @@ class NodeTest(OnnxModelInfo):
         self.model = onnx_node_tests_dir + self.name + "/model.onnx"
 
     def construct_inputs(self):
-        model = onnx.load(self.model)
+        model = self.get_model_graph()
         inputs = model.graph.input
         num_inputs = len(inputs)
         input_list = []
@@ -50,7 +50,7 @@ class NodeTest(OnnxModelInfo):
         return TestTensors(input_list)
 
     def forward(self, input):
-        model = onnx.load(self.model)
+        model = self.get_model_graph()
         outputs = model.graph.output
         num_outputs = len(outputs)
         output_list = []
@@ -11,7 +11,10 @@ from pathlib import Path
 import argparse
 import re
 import logging
-from typing import List, Literal, Optional
+import shutil
+import time
+from contextlib import ExitStack
+from typing import Any, Callable, List, Literal, Optional
 
 # append alt_e2eshark dir to path to allow importing without explicit pythonpath management
 TEST_DIR = str(Path(__file__).parent)
@@ -30,6 +33,33 @@ from e2e_testing.test_configs.onnxconfig import (
 from e2e_testing.backends import SimpleIREEBackend, OnnxrtIreeEpBackend
 from e2e_testing.storage import load_test_txt_file, load_json_dict
 from utils.report import generate_report, save_dict
+from e2e_testing.worker_pool import run_in_workers
+from e2e_testing.stage_cache import StageCache
+from e2e_testing.shared_compilation import SharedCompilations, COMPILE_STAGES
+from e2e_testing.benchmark import BenchmarkConfig, BENCHMARK_NAME, benchmark, save_benchmarks, load_benchmarks
+from e2e_testing.sweep import (
+    SWEEP_NAME,
+    parse_sweep,
+    sweep_points,
+    point_name,
+    check_sweep_dims,
+    make_static_model_info,
+    save_sweep,
+    load_sweep,
+)
+from e2e_testing.bisection import (
+    BISECT_DIR,
+    BISECT_PROGRESS,
+    BISECT_STATUSES,
+    ModelPrefix,
+    bisect_progress,
+    bisected_status,
+    shortest_failing_prefix,
+    save_bisection,
+    load_bisections,
+)
+from e2e_testing.onnx_graph import IndexedGraph
+from utils.harness_profile import profile_harness, merge_profiles, PROFILE_NAME
 
 ALL_STAGES = [
     "setup",
@@ -40,38 +70,38 @@ ALL_STAGES = [
     "native_inference",
     "compiled_inference",
     "postprocessing",
+    "benchmark",
 ]
+# stages which only run if they are requested (e.g., with --benchmark or --stages)
+OPTIONAL_STAGES = ["benchmark"]
+# the stages of a test with --sweep
+SWEEP_STAGES = [
+    "setup",
+    "import_model",
+    "preprocessing",
+    "compilation",
+    "native_inference",
+    "sweep",
+]
+# (rtol, atol) for comparing outputs, as used by log_result
+SWEEP_TOLERANCE = [1e-3, 1e-3]
 
-def get_tests(groups: Literal["all", "combinations", "operators"], test_filter: Optional[str], testsfile: Optional[str]) -> List[str]:
-    """imports tests based on groups and test_filter specification"""
-    combinations = True if groups == "all" or groups == "combinations" else False
-    models = True if groups == "all" or groups == "models" else False
-    operators = True if groups == "all" or groups == "operators" else False
-
-    from e2e_testing.registry import GLOBAL_TEST_LIST
-
-    # importing the test generating files will register them to GLOBAL_TEST_LIST
-    if combinations:
-        from onnx_tests.combinations import model
-    if models:
-        from onnx_tests.models import model
-    if operators:
-        from onnx_tests.operators import model
+def get_tests(groups: Literal["all", "combinations", "models", "operators"], test_filter: Optional[str], testsfile: Optional[str]) -> List[Test]:
+    """imports tests based on groups and test_filter specification. Tests are selected from a cached manifest of the
+    registered tests, so only the modules which register the selected tests are imported (see e2e_testing/registry.py)."""
+    from e2e_testing.registry import TEST_GROUPS, load_test_manifest, import_tests
 
-    pre_test_list = GLOBAL_TEST_LIST
+    manifest = load_test_manifest([g for g in TEST_GROUPS if groups == "all" or groups == g])
+    test_names = list(manifest.keys())
 
     if testsfile:
-        test_names = load_test_txt_file(testsfile)
-        pre_test_list = [t for t in GLOBAL_TEST_LIST if t.unique_name in test_names]
+        selected_names = set(load_test_txt_file(testsfile))
+        test_names = [name for name in test_names if name in selected_names]
 
     if test_filter:
-        test_list = [
-            test for test in pre_test_list if re.match(test_filter, test.unique_name)
-        ]
-    else:
-        test_list = pre_test_list
+        test_names = [name for name in test_names if re.match(test_filter, name)]
 
-    return test_list
+    return import_tests(test_names, manifest)
 
 
 def main(args):
@@ -90,11 +120,23 @@ def main(args):
     else:
         raise NotImplementedError(f"unsupported mode: {args.mode}")
 
+    if args.mirror_dir:
+        # read by e2e_testing/remote_storage.py
+        os.environ["SHARK_MIRROR_DIR"] = os.path.abspath(args.mirror_dir)
+    if args.cache_budget is not None:
+        # read by the azure model download utils (see e2e_testing/cache.py)
+        os.environ["CACHE_BUDGET_GB"] = str(args.cache_budget)
+    if args.no_revalidate:
+        # read by the azure model download utils (see e2e_testing/cache.py)
+        os.environ["CACHE_REVALIDATE"] = "0"
+
     # get test list
     test_list = get_tests(args.groups, args.test_filter, args.testsfile)
 
     #setup test stages
-    stages = ALL_STAGES
+    stages = [s for s in ALL_STAGES if s not in OPTIONAL_STAGES]
+    if args.benchmark:
+        stages.append("benchmark")
 
     if args.stages:
         stages = args.stages
@@ -103,6 +145,41 @@ def main(args):
     
     parent_log_dir = os.path.join(TEST_DIR, args.rundirectory)
 
+    if args.sweep:
+        status_dict = run_sweeps(
+            test_list,
+            config,
+            parent_log_dir,
+            args.verbose,
+            parse_sweep(args.sweep),
+            args.sweep_compile,
+            BenchmarkConfig(args.benchmark_warmup, args.benchmark_iterations),
+            args.jobs,
+            args.max_tests_per_worker,
+        )
+        if args.report:
+            generate_report(args, list(SWEEP_STAGES), status_dict)
+            json_save_to = str(Path(args.report_file).parent.joinpath(Path(args.report_file).stem + ".json"))
+            save_dict(status_dict, json_save_to)
+        return
+
+    if args.bisect:
+        status_dict = run_bisections(
+            test_list,
+            config,
+            parent_log_dir,
+            args.verbose,
+            [s for s in stages if s not in OPTIONAL_STAGES],
+            args.jobs,
+            args.max_tests_per_worker,
+        )
+        if args.report:
+            generate_report(args, stages, status_dict)
+            json_save_to = str(Path(args.report_file).parent.joinpath(Path(args.report_file).stem + ".json"))
+            save_dict(status_dict, json_save_to)
+            save_dict(load_bisections(parent_log_dir, status_dict.keys()), json_save_to[:-len(".json")] + "_bisect.json")
+        return
+
     status_dict = run_tests(
         test_list,
         config,
@@ -110,20 +187,42 @@ def main(args):
         args.no_artifacts,
         args.verbose,
         stages,
-        args.load_inputs
+        args.load_inputs,
+        args.profile_harness,
+        args.jobs,
+        args.max_tests_per_worker,
+        args.reuse,
+        BenchmarkConfig(args.benchmark_warmup, args.benchmark_iterations),
     )
 
     if args.report:
-        generate_report(args, stages, status_dict)
+        benchmarks = load_benchmarks(parent_log_dir, status_dict.keys()) if "benchmark" in stages else None
+        generate_report(args, stages, status_dict, benchmarks)
         json_save_to = str(Path(args.report_file).parent.joinpath(Path(args.report_file).stem + ".json"))
         save_dict(status_dict, json_save_to)
+        if benchmarks:
+            save_dict(benchmarks, json_save_to[:-len(".json")] + "_benchmark.json")
 
 
 def run_tests(
-    test_list: List[Test], config: TestConfig, parent_log_dir: str, no_artifacts: bool, verbose: bool, stages: List[str], load_inputs: bool
+    test_list: List[Test],
+    config: TestConfig,
+    parent_log_dir: str,
+    no_artifacts: bool,
+    verbose: bool,
+    stages: List[str],
+    load_inputs: bool,
+    profile: bool = False,
+    jobs: int = 1,
+    max_tests_per_worker: int = 0,
+    reuse: bool = False,
+    benchmark_config: BenchmarkConfig = BenchmarkConfig(),
 ) -> Dict[str, str]:
-    """runs tests in test_list based on config. Returns a dictionary containing the test statuses."""
-    # TODO: multi-process
+    """runs tests in test_list based on config. Returns a dictionary containing the test statuses.
+
+    With jobs > 0, tests run in that many worker subprocesses (see e2e_testing/worker_pool.py), so a crash in native
+    code only fails the test that was running, at the stage it was in. jobs = 0 runs the tests in this process.
+    """
     # TODO: setup exception handling and better logging
     # TODO: log command-line reproducers for each step
 
@@ -131,110 +230,289 @@ def run_tests(
     if not os.path.exists(parent_log_dir):
         os.makedirs(parent_log_dir)
 
-    num_passes = 0
     warnings.filterwarnings("ignore")
 
     if verbose:
         print(f"Stages to be run: {stages}")
         print(f'Test list: {[test.unique_name for test in test_list]}')
 
+    # with no_artifacts there are no compiled artifacts to share between tests
+    shared_compilations = None if no_artifacts else SharedCompilations(parent_log_dir)
+    if shared_compilations is not None:
+        shared_compilations.clear()
+
+    run_args = (
+        config, parent_log_dir, no_artifacts, verbose, stages, load_inputs, profile, reuse, benchmark_config,
+        shared_compilations,
+    )
+    run_test = lambda t, on_stage: run_single_test(t, *run_args, on_stage=on_stage)
+    status_dict = run_each_test(test_list, run_test, parent_log_dir, verbose, jobs, max_tests_per_worker)
+
+    num_passes = sum(status == "PASS" for status in status_dict.values())
+    print("\nTest Summary:")
+    print(f"\tPASSES: {num_passes}\n\tTOTAL: {len(test_list)}")
+    print(f"results stored in {parent_log_dir}")
+    if profile:
+        summarize_harness_profile(test_list, parent_log_dir)
+    return status_dict
+
+
+def run_each_test(
+    test_list: List[Test],
+    run_test: Callable[[Test, Optional[Callable[[str], None]]], Optional[str]],
+    parent_log_dir: str,
+    verbose: bool,
+    jobs: int,
+    max_tests_per_worker: int,
+) -> Dict[str, str]:
+    """calls run_test(t, on_stage) for each test, in the main process if jobs = 0 and otherwise in worker processes.
+    Returns the statuses returned by run_test, or the stage a test's worker crashed at, sorted by test name."""
     status_dict = dict()
+    if jobs == 0:
+        for t in test_list:
+            status = run_test(t, None)
+            if status is not None:
+                status_dict[t.unique_name] = status
+    else:
+        run_task = lambda index, report_stage: run_test(test_list[index], report_stage)
+        for index, status, crash in run_in_workers(len(test_list), run_task, jobs, max_tests_per_worker):
+            t = test_list[index]
+            if crash is not None:
+                log_dir = os.path.join(parent_log_dir, t.unique_name) + "/"
+                status = bisected_status(crash.last_progress)
+                if status is not None:
+                    # the test itself had already failed, and the worker died running one of its prefixes
+                    log_exception(RuntimeError(crash.describe()), log_dir, BISECT_PROGRESS, t.unique_name, verbose)
+                else:
+                    # the stage that was running when the worker died (a test always starts with "setup")
+                    status = crash.last_progress or "setup"
+                    log_exception(RuntimeError(crash.describe()), log_dir, status, t.unique_name, verbose)
+            if status is not None:
+                status_dict[t.unique_name] = status
 
-    for t in test_list:
+    # sorted by name, so the results don't depend on the order tests finished in
+    return dict(sorted(status_dict.items(), key=lambda item : item[0].lower()))
 
-        if verbose:
-            print(f"running test {t.unique_name}...")
 
-        # set log directory for the individual test
-        log_dir = os.path.join(parent_log_dir, t.unique_name) + "/"
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
+def run_single_test(
+    t: Test,
+    config: TestConfig,
+    parent_log_dir: str,
+    no_artifacts: bool,
+    verbose: bool,
+    stages: List[str],
+    load_inputs: bool,
+    profile: bool = False,
+    reuse: bool = False,
+    benchmark_config: BenchmarkConfig = BenchmarkConfig(),
+    shared_compilations: Optional[SharedCompilations] = None,
+    on_stage: Optional[Callable[[str], None]] = None,
+) -> Optional[str]:
+    """runs the stages of one test, calling on_stage before each one. Returns the status of the test: the stage it
+    failed at, "Numerics" or "PASS", or None if the stages needed for comparing results were not run.
+
+    With reuse, stages whose saved results in the log directory are up to date (see e2e_testing/stage_cache.py) are
+    skipped, and their results are only loaded if a stage that runs needs them.
 
+    With shared_compilations, a test whose model and compile config match a test which already compiled them in this
+    run uses its compiled artifacts instead of running import_model, preprocessing and compilation."""
+    if verbose:
+        print(f"running test {t.unique_name}...")
+
+    # set log directory for the individual test
+    log_dir = os.path.join(parent_log_dir, t.unique_name) + "/"
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    # a test which now fails before the benchmark stage must not report the numbers of a previous run
+    if "benchmark" in stages and os.path.exists(log_dir + BENCHMARK_NAME):
+        os.remove(log_dir + BENCHMARK_NAME)
+
+    curr_stage = None
+    # with no_artifacts nothing is saved, so stages are neither recorded nor reused
+    stage_cache = None if no_artifacts else StageCache(log_dir, reuse)
+
+    def is_reusable(stage: str, fingerprint: str, depends_on: List[str] = []) -> bool:
+        """returns whether the saved results of stage can be used instead of running it"""
+        if stage_cache is None:
+            return False
+        if stage_cache.is_fresh(stage, fingerprint, depends_on):
+            if verbose:
+                print(f"\treusing {stage}")
+            return True
+        stage_cache.forget(stage)
+        return False
+
+    def record_stage(stage: str, fingerprint: str, inputs: List[str], outputs: Optional[List[str]], **metadata):
+        if stage_cache is not None:
+            stage_cache.record(stage, fingerprint, inputs, outputs, **metadata)
+
+    def enter_stage(stage: str) -> bool:
+        """records stage as the current stage and returns whether it should run"""
+        nonlocal curr_stage
+        curr_stage = stage
+        if on_stage is not None:
+            on_stage(stage)
+        return stage in stages
+
+    status = None
+    # the shared compilation key of the test, and the entry of the test that compiled it (see SharedCompilations)
+    shared_key = None
+    shared_entry = None
+    # the lock of shared_key, held from import_model until the compiled artifacts are published
+    compile_lock = ExitStack()
+    with profile_harness(log_dir + PROFILE_NAME, enabled=profile):
         try:
             # TODO: convert staging to an Enum and figure out how to specify staging from args
-            # TODO: enable loading output/goldoutput bin files, vmfb, and mlir files if already present
 
             # set up test
-            curr_stage = "setup"
-            if curr_stage in stages:
+            if enter_stage("setup"):
                 # build an instance of the test info class
                 inst = t.model_constructor(t.unique_name, log_dir)
                 # this is highly onnx specific. 
                 # TODO: Figure out how to factor this out of run.py
                 if not os.path.exists(inst.model):
                     inst.construct_model()
-            
+
             artifact_save_to = None if no_artifacts else log_dir
-            # generate mlir from the instance using the config
-            curr_stage = "import_model"
-            if curr_stage in stages:
-                model_artifact, func_name = config.import_model(
-                    inst, save_to=artifact_save_to
-                )
+            # the stage whose reused result is the current model artifact, which is only loaded when it is needed
+            unloaded_stage = None
 
-            # apply config-specific preprocessing to the ModelArtifact
-            curr_stage = "preprocessing"
-            if curr_stage in stages:
-                model_artifact = config.preprocess_model(
-                    model_artifact, save_to=artifact_save_to
+            # the compilation of a sibling test with the same model and compile config, if one already finished
+            if shared_compilations is not None and all(s in stages for s in COMPILE_STAGES):
+                shared_key = shared_compilations.key(inst, config)
+            if shared_key:
+                compile_lock.enter_context(shared_compilations.lock(shared_key))
+                shared_entry = shared_compilations.lookup(shared_key)
+            if shared_entry and "failed_stage" in shared_entry:
+                enter_stage(shared_entry["failed_stage"])
+                raise RuntimeError(
+                    f"{curr_stage} failed for {shared_entry['test']}, which has the same model and compile config"
                 )
+            if shared_entry:
+                compile_lock.close()
+                shared_compilations.materialize(shared_key, shared_entry, log_dir)
+                func_name = shared_entry["func_name"]
+                if verbose:
+                    print(f"\tusing the compiled artifacts of {shared_entry['test']}")
 
-            # compile mlir_module using config (calls backend compile)
-            curr_stage = "compilation"
-            if curr_stage in stages:
-                compiled_artifact = config.compile(model_artifact, save_to=artifact_save_to)
+            # generate mlir from the instance using the config
+            if enter_stage("import_model") and not shared_entry:
+                fingerprint = config.stage_fingerprint("import_model")
+                if is_reusable("import_model", fingerprint):
+                    func_name = stage_cache.metadata("import_model")["func_name"]
+                    unloaded_stage = "import_model"
+                else:
+                    model_artifact, func_name = config.import_model(
+                        inst, save_to=artifact_save_to
+                    )
+                    record_stage(
+                        "import_model", fingerprint, [inst.model], config.stage_artifacts("import_model"), func_name=func_name
+                    )
 
-            # get inputs from inst
-            curr_stage = "construct_inputs"
-            if curr_stage in stages:
-                if load_inputs:
-                    inputs = inst.load_inputs(log_dir)
+            # apply config-specific preprocessing to the ModelArtifact
+            if enter_stage("preprocessing") and not shared_entry:
+                fingerprint = config.stage_fingerprint("preprocessing")
+                if is_reusable("preprocessing", fingerprint, ["import_model"]):
+                    unloaded_stage = "preprocessing"
                 else:
-                    inputs = inst.construct_inputs()
-                    inputs.save_to(log_dir + "input")
+                    if unloaded_stage:
+                        model_artifact, unloaded_stage = config.load_artifact(unloaded_stage, log_dir), None
+                    model_artifact = config.preprocess_model(
+                        model_artifact, save_to=artifact_save_to
+                    )
+                    record_stage(
+                        "preprocessing", fingerprint, stage_cache.outputs("import_model") if stage_cache else [],
+                        config.stage_artifacts("preprocessing"),
+                    )
 
-            # run native inference
-            curr_stage = "native_inference"
-            if curr_stage in stages:
-                golden_outputs_raw = inst.forward(inputs)
-                golden_outputs_raw.save_to(log_dir + "golden_output")
+            # compile mlir_module using config (calls backend compile)
+            if enter_stage("compilation"):
+                fingerprint = config.stage_fingerprint("compilation")
+                if shared_entry:
+                    compiled_artifact = config.load_artifact("compilation", log_dir)
+                elif is_reusable("compilation", fingerprint, ["import_model", "preprocessing"]):
+                    compiled_artifact = config.load_artifact("compilation", log_dir)
+                else:
+                    if unloaded_stage:
+                        model_artifact, unloaded_stage = config.load_artifact(unloaded_stage, log_dir), None
+                    compiled_artifact = config.compile(model_artifact, save_to=artifact_save_to)
+                    upstream_files = stage_cache.outputs("import_model") + stage_cache.outputs("preprocessing") if stage_cache else []
+                    record_stage("compilation", fingerprint, upstream_files, config.stage_artifacts("compilation"))
+                if shared_key and not shared_entry:
+                    shared_compilations.publish(
+                        shared_key, t.unique_name, log_dir, config.stage_artifacts("compilation"), func_name
+                    )
+                compile_lock.close()
 
             # get inputs from inst
-            curr_stage = "construct_inputs"
-            if curr_stage in stages:
-                if load_inputs:
+            if enter_stage("construct_inputs"):
+                fingerprint = type(inst).__name__
+                if is_reusable("construct_inputs", fingerprint):
+                    inst.update_dim_param_dict()
+                    inputs = inst.load_inputs(log_dir)
+                elif load_inputs:
                     inputs = inst.load_inputs(log_dir)
                 else:
                     inputs = inst.construct_inputs()
                     inputs.save_to(log_dir + "input")
+                    input_files = [f"input.{i}.bin" for i in range(len(inputs.data))]
+                    record_stage("construct_inputs", fingerprint, [inst.model], input_files)
 
             # run native inference
-            curr_stage = "native_inference"
-            if curr_stage in stages:
-                golden_outputs_raw = inst.forward(inputs)
-                golden_outputs_raw.save_to(log_dir + "golden_output")
+            if enter_stage("native_inference"):
+                fingerprint = package_version("onnxruntime")
+                if is_reusable("native_inference", fingerprint, ["construct_inputs"]):
+                    golden_outputs_raw = inst.load_golden_outputs(log_dir)
+                else:
+                    golden_outputs_raw = inst.forward(inputs)
+                    golden_outputs_raw.save_to(log_dir + "golden_output")
+                    golden_files = [f"golden_output.{i}.bin" for i in range(len(golden_outputs_raw.data))]
+                    record_stage(
+                        "native_inference", fingerprint, stage_cache.outputs("construct_inputs") if stage_cache else [],
+                        golden_files,
+                    )
 
             # run inference with the compiled module
-            curr_stage = "compiled_inference"
-            if curr_stage in stages:
+            if enter_stage("compiled_inference"):
+                statistics_before = config.runtime_statistics()
                 outputs_raw = config.run(compiled_artifact, inputs, func_name=func_name)
                 outputs_raw.save_to(log_dir + "output")
+                statistics_after = config.runtime_statistics()
+                if statistics_after:
+                    with open(log_dir + "runtime_statistics.log", "w") as f:
+                        f.write(format_runtime_statistics(statistics_before, statistics_after))
 
             # apply model-specific post-processing:
-            curr_stage = "postprocessing"
-            if curr_stage in stages:
+            if enter_stage("postprocessing"):
                 golden_outputs = inst.apply_postprocessing(golden_outputs_raw)
                 outputs = inst.apply_postprocessing(outputs_raw)
                 inst.save_processed_output(golden_outputs, log_dir, "golden_output")
                 inst.save_processed_output(outputs, log_dir, "output")
 
+            # time compiled inference against native inference
+            if enter_stage("benchmark"):
+                compiled_func = config.load_function(compiled_artifact, func_name=func_name)
+                results = {
+                    "compiled": benchmark(lambda: compiled_func(inputs), benchmark_config),
+                    "native": benchmark(lambda: inst.forward(inputs), benchmark_config),
+                }
+                save_benchmarks(results, log_dir)
+                if verbose:
+                    speedup = results["native"].p50_ms / results["compiled"].p50_ms
+                    print(f"\tmedian latency: {results['compiled'].p50_ms:.3f} ms compiled, {results['native'].p50_ms:.3f} ms native ({speedup:.2f}x)")
+
         except Exception as e:
-            status_dict[t.unique_name] = curr_stage
+            if shared_key and not shared_entry and curr_stage in COMPILE_STAGES:
+                shared_compilations.publish_failure(shared_key, t.unique_name, curr_stage)
             log_exception(e, log_dir, curr_stage, t.unique_name, verbose)
-            continue
+            return curr_stage
+        finally:
+            compile_lock.close()
 
         # store the results
         if "setup" and "native_inference" and "compiled_inference" in stages:
+            if on_stage is not None:
+                on_stage("results-summary")
             try:
                 result = TestResult(
                     name=t.unique_name,
@@ -244,28 +522,299 @@ def run_tests(
                 )
                 # log the results
                 test_passed = log_result(result, log_dir, [1e-3, 1e-3])
-                if test_passed:
-                    status_dict[t.unique_name] = "PASS"
-                    num_passes+=1
-                else:
-                    status_dict[t.unique_name] = "Numerics"
+                status = "PASS" if test_passed else "Numerics"
             except Exception as e:
-                status_dict[inst.name] = "results-summary"
+                status = "results-summary"
                 log_exception(e, log_dir, "results-summary", t.unique_name, verbose)
-        
-        if verbose:
-            if t.unique_name not in status_dict.keys() or status_dict[t.unique_name] == "PASS":
-                print(f"\tPASSED")
-            else:
-                print(f"\tFAILED ({status_dict[t.unique_name]})")
 
-    print("\nTest Summary:")
+    if verbose:
+        if status is None or status == "PASS":
+            print(f"\tPASSED")
+        else:
+            print(f"\tFAILED ({status})")
+    return status
+
+
+def run_bisections(
+    test_list: List[Test],
+    config: TestConfig,
+    parent_log_dir: str,
+    verbose: bool,
+    stages: List[str],
+    jobs: int = 1,
+    max_tests_per_worker: int = 0,
+) -> Dict[str, str]:
+    """runs the tests in test_list, and for each one that fails, finds the shortest prefix of its model that fails the
+    same way (see e2e_testing/bisection.py). Returns the statuses of the full tests."""
+    if not os.path.exists(parent_log_dir):
+        os.makedirs(parent_log_dir)
+    warnings.filterwarnings("ignore")
+    if verbose:
+        print(f"Stages to be run: {stages}")
+        print(f'Test list: {[test.unique_name for test in test_list]}')
+
+    run_test = lambda t, on_stage: run_bisect_test(t, config, parent_log_dir, verbose, stages, on_stage=on_stage)
+    status_dict = run_each_test(test_list, run_test, parent_log_dir, verbose, jobs, max_tests_per_worker)
+
+    print("\nBisection Summary:")
+    for name, result in load_bisections(parent_log_dir, status_dict.keys()).items():
+        if "size" in result:
+            print(
+                f"\t{name}: {result['status']} reproduced by the first {result['size']} of {result['num_nodes']} nodes, "
+                f"ending at {result['op_type']} node '{result['node']}' ({result['log_dir']})"
+            )
+        else:
+            print(f"\t{name}: {result['status']} not reproduced by the prefixes of its {result['num_nodes']} nodes")
+    return status_dict
+
+
+def run_bisect_test(
+    t: Test,
+    config: TestConfig,
+    parent_log_dir: str,
+    verbose: bool,
+    stages: List[str],
+    on_stage: Optional[Callable[[str], None]] = None,
+) -> Optional[str]:
+    """runs a test, and if it failed at one of BISECT_STATUSES, binary searches for the shortest prefix of its model
+    which fails with the same status. Each prefix runs as a test in <log_dir>/bisect/prefix_<size>, and the result is
+    saved to bisect.json in the test's log directory. Returns the status of the full test."""
+    log_dir = os.path.join(parent_log_dir, t.unique_name) + "/"
+    bisect_dir = os.path.join(log_dir, BISECT_DIR)
+    # prefix models from an earlier bisection would be reused by their tests, so start over
+    shutil.rmtree(bisect_dir, ignore_errors=True)
+    status = run_single_test(t, config, parent_log_dir, False, verbose, stages, False, on_stage=on_stage)
+    if status not in BISECT_STATUSES:
+        return status
+
+    if on_stage is not None:
+        on_stage(bisect_progress(status))
+    if verbose:
+        print(f"bisecting the model of {t.unique_name} ({status})...")
+    try:
+        inst = t.model_constructor(t.unique_name, log_dir)
+        if not os.path.exists(inst.model):
+            inst.construct_model()
+        graph = IndexedGraph(inst.get_prepared_model().graph)
+        order = graph.topological_order()
+
+        def prefix_constructor(size: int):
+            return lambda name, onnx_model_path: ModelPrefix(inst, graph, order, size, name, onnx_model_path)
+
+        def fails(size: int) -> bool:
+            prefix_test = Test(f"prefix_{size}", prefix_constructor(size))
+            prefix_status = run_single_test(prefix_test, config, bisect_dir, False, verbose, stages, False)
+            if verbose:
+                print(f"\tprefix of {size}/{len(order)} nodes: {prefix_status}")
+            return prefix_status == status
+
+        # the whole model is the test itself, which just failed with status
+        size = shortest_failing_prefix(len(order), fails, known_failing=True)
+    except Exception as e:
+        log_exception(e, log_dir, "bisect", t.unique_name, verbose)
+        return status
+
+    result = {"status": status, "num_nodes": len(order)}
+    if size is not None:
+        last_node = graph.nodes[order[size - 1]]
+        result.update(
+            size=size,
+            node=last_node.name,
+            op_type=last_node.op_type,
+            log_dir=os.path.join(bisect_dir, f"prefix_{size}"),
+        )
+    save_bisection(result, log_dir)
+    return status
+
+
+def run_sweeps(
+    test_list: List[Test],
+    config: TestConfig,
+    parent_log_dir: str,
+    verbose: bool,
+    sweep: Dict[str, List[int]],
+    compile_mode: Literal["dynamic", "static", "both"],
+    benchmark_config: BenchmarkConfig,
+    jobs: int = 1,
+    max_tests_per_worker: int = 0,
+) -> Dict[str, str]:
+    """benchmarks the tests in test_list at every point of the dim param sweep (see e2e_testing/sweep.py). Each test's
+    results are saved to sweep.csv in its log directory, and the results of all tests to sweep.csv in parent_log_dir."""
+    if not os.path.exists(parent_log_dir):
+        os.makedirs(parent_log_dir)
+    warnings.filterwarnings("ignore")
+    if verbose:
+        print(f"Sweep points: {sweep_points(sweep)}")
+        print(f'Test list: {[test.unique_name for test in test_list]}')
+
+    run_test = lambda t, on_stage: run_sweep_test(
+        t, config, parent_log_dir, verbose, sweep, compile_mode, benchmark_config, on_stage=on_stage
+    )
+    status_dict = run_each_test(test_list, run_test, parent_log_dir, verbose, jobs, max_tests_per_worker)
+
+    rows = []
+    for name in status_dict:
+        try:
+            rows += [{"test": name, **row} for row in load_sweep(os.path.join(parent_log_dir, name, SWEEP_NAME))]
+        except OSError:
+            continue
+    if rows:
+        save_sweep(rows, os.path.join(parent_log_dir, SWEEP_NAME))
+
+    num_passes = sum(status == "PASS" for status in status_dict.values())
+    print("\nSweep Summary:")
     print(f"\tPASSES: {num_passes}\n\tTOTAL: {len(test_list)}")
-    print(f"results stored in {parent_log_dir}")
-    status_dict = dict(sorted(status_dict.items(), key=lambda item : item[0].lower()))
+    print(f"results stored in {os.path.join(parent_log_dir, SWEEP_NAME)}")
     return status_dict
 
 
+def run_sweep_test(
+    t: Test,
+    config: TestConfig,
+    parent_log_dir: str,
+    verbose: bool,
+    sweep: Dict[str, List[int]],
+    compile_mode: Literal["dynamic", "static", "both"],
+    benchmark_config: BenchmarkConfig,
+    on_stage: Optional[Callable[[str], None]] = None,
+) -> str:
+    """compiles the model of a test once with dynamic dims and/or once per sweep point with the swept dim params fixed
+    (compile_mode "dynamic", "static" or "both"). At every sweep point, the compiled modules are checked against native
+    inference and benchmarked with generated inputs. Returns "PASS", "Numerics" if the outputs at some point didn't
+    match, the stage the test failed at, or "sweep" if some of the points failed (see the "error" column of sweep.csv)."""
+    if verbose:
+        print(f"running sweep of test {t.unique_name}...")
+    log_dir = os.path.join(parent_log_dir, t.unique_name) + "/"
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    if os.path.exists(log_dir + SWEEP_NAME):
+        os.remove(log_dir + SWEEP_NAME)
+
+    curr_stage = None
+
+    def enter_stage(stage: str):
+        nonlocal curr_stage
+        curr_stage = stage
+        if on_stage is not None:
+            on_stage(stage)
+
+    def compile_function(model_info: OnnxModelInfo):
+        """returns the compiled function of the model and the time it took to import, preprocess and compile it"""
+        start = time.perf_counter()
+        enter_stage("import_model")
+        model_artifact, func_name = config.import_model(model_info, save_to=None)
+        enter_stage("preprocessing")
+        model_artifact = config.preprocess_model(model_artifact, save_to=None)
+        enter_stage("compilation")
+        compiled_artifact = config.compile(model_artifact, save_to=None)
+        return config.load_function(compiled_artifact, func_name=func_name), time.perf_counter() - start
+
+    rows = []
+    try:
+        enter_stage("setup")
+        inst = t.model_constructor(t.unique_name, log_dir)
+        if not os.path.exists(inst.model):
+            inst.construct_model()
+        check_sweep_dims(inst.get_model_graph(), sweep)
+        # the test's own dim params fix any dims which aren't swept
+        inst.update_dim_param_dict()
+        base_dims = inst.dim_param_dict or {}
+
+        compile_modes = ["dynamic", "static"] if compile_mode == "both" else [compile_mode]
+        # the stage at which compiling the dynamic module failed
+        dynamic_error = None
+        if "dynamic" in compile_modes:
+            try:
+                dynamic_func, dynamic_compile_time = compile_function(inst)
+            except Exception as e:
+                if compile_mode != "both":
+                    raise
+                # keep comparing against static compiles, the failure is reported on each point of the dynamic module
+                log_exception(e, log_dir, curr_stage, t.unique_name, verbose)
+                dynamic_error = curr_stage
+
+        for point in sweep_points(sweep):
+            dims = {**base_dims, **point}
+            # the inputs and golden outputs of this point, shared by the compile modes
+            inputs = None
+            point_rows = {}
+            for mode in compile_modes:
+                row = {**point, "compile": mode}
+                try:
+                    if mode == "static":
+                        static_info = make_static_model_info(inst, dims, os.path.join(log_dir, "sweep", point_name(point)))
+                        compiled_func, compile_time = compile_function(static_info)
+                        # the static copy of the model is only needed for compiling
+                        os.remove(static_info.model)
+                    elif dynamic_error:
+                        enter_stage(dynamic_error)
+                        raise RuntimeError(f"the dynamic module failed at {dynamic_error} (see {dynamic_error}.log)")
+                    else:
+                        compiled_func, compile_time = dynamic_func, dynamic_compile_time
+                    row["compile_s"] = compile_time
+                    if inputs is None:
+                        enter_stage("native_inference")
+                        point_inputs = get_sample_inputs_for_onnx_model(inst.get_model_graph(), dims)
+                        golden_outputs = inst.apply_postprocessing(inst.forward(point_inputs))
+                        inputs = point_inputs
+                    enter_stage("sweep")
+                    outputs = inst.apply_postprocessing(compiled_func(inputs))
+                    row.update(compare_outputs(t.unique_name, inputs, golden_outputs, outputs, SWEEP_TOLERANCE))
+                    row.update(benchmark(lambda: compiled_func(inputs), benchmark_config)._asdict())
+                except Exception as e:
+                    row["error"] = f"{curr_stage}: {e}".replace("\n", " ")
+                    if verbose:
+                        print(f"\t{point_name(point)} ({mode}) FAILED ({curr_stage})")
+                point_rows[mode] = row
+                rows.append(row)
+            if "p50_ms" in point_rows.get("dynamic", {}) and "p50_ms" in point_rows.get("static", {}):
+                point_rows["dynamic"]["dynamic_vs_static"] = point_rows["dynamic"]["p50_ms"] / point_rows["static"]["p50_ms"]
+            # saved after every point, so the finished points are kept if a later one crashes the worker
+            save_sweep(rows, log_dir + SWEEP_NAME)
+    except Exception as e:
+        log_exception(e, log_dir, curr_stage, t.unique_name, verbose)
+        return curr_stage
+
+    if any("error" in row for row in rows):
+        status = "sweep"
+    elif any(row["numerics"] != "PASS" for row in rows):
+        status = "Numerics"
+    else:
+        status = "PASS"
+    if verbose:
+        print(f"\tPASSED" if status == "PASS" else f"\tFAILED ({status})")
+    return status
+
+
+def compare_outputs(name: str, inputs: TestTensors, golden_outputs: TestTensors, outputs: TestTensors, tol) -> Dict[str, Any]:
+    """compares outputs against golden_outputs, returning the sweep.csv columns with the result"""
+    summary = result_comparison(TestResult(name=name, input=inputs, gold_output=golden_outputs, output=outputs), tol)
+    num_match = sum(s.sum().item() for s in summary)
+    num_total = sum(s.nelement() for s in summary)
+    return {
+        "numerics": "PASS" if num_match == num_total else "Numerics",
+        "match_percent": 100 * num_match / num_total if num_total else 100.0,
+    }
+
+
+def summarize_harness_profile(test_list: List[Test], parent_log_dir: str):
+    """merges the per-test harness profiles into one collapsed stack file and prints the harness overhead"""
+    profiles = [
+        (t.unique_name, os.path.join(parent_log_dir, t.unique_name, PROFILE_NAME))
+        for t in test_list
+    ]
+    merged_path = os.path.join(parent_log_dir, "harness-profile.collapsed")
+    summary = merge_profiles(profiles, merged_path)
+    total_time = sum(s[1] for s in summary)
+    total_harness = sum(s[2] for s in summary)
+    print("\nHarness Profile:")
+    for name, sampled, harness in summary:
+        print(f"\t{name}: {harness:.3f}s of {sampled:.3f}s in harness code")
+    if total_time > 0:
+        print(f"\tTOTAL: {total_harness:.3f}s of {total_time:.3f}s ({100*total_harness/total_time:.1f}%) in harness code")
+    print(f"collapsed stacks stored in {merged_path}")
+
+
 def log_result(result, log_dir, tol):
     # TODO: add more information for the result comparison (e.g., on verbose, add information on where the error is occuring, etc)
     summary = result_comparison(result, tol)
@@ -283,6 +832,19 @@ def log_result(result, log_dir, tol):
     return num_match == num_total
 
 
+def format_runtime_statistics(before: Optional[Dict[str, int]], after: Dict[str, int]) -> str:
+    """describes the resources used by one test from the runtime statistics of its worker before and after it. The
+    statistics accumulate over the tests a worker runs, so counters are written as the difference, except for peaks,
+    which can't be attributed to one test."""
+    lines = []
+    for key, value in after.items():
+        if key.endswith("_peak"):
+            lines.append(f"{key}: {value} (worker peak so far)")
+        else:
+            lines.append(f"{key}: {value - (before or {}).get(key, 0)}")
+    return "\n".join(lines) + "\n"
+
+
 def log_exception(e: Exception, path: str, stage: str, name: str, verbose: bool):
     '''generates a log for an exception generated during a testing stage'''
     log_filename = path + stage + ".log"
@@ -369,6 +931,51 @@ def _get_argparse():
         default=False,
         help="If true, will try to load inputs from bin files.",
     )
+    parser.add_argument(
+        "--reuse",
+        action="store_true",
+        default=False,
+        help="Skip the import_model, preprocessing, compilation, construct_inputs and native_inference stages of tests whose saved artifacts are up to date with their inputs and with the tool versions and flags of this run. Results are always recorded, unless --no-artifacts is set.",
+    )
+
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        default=False,
+        help="Add the benchmark stage, which times compiled inference against native (onnxruntime) inference and adds their latencies to the report.",
+    )
+    parser.add_argument(
+        "--benchmark-warmup",
+        type=int,
+        default=BenchmarkConfig().warmup,
+        help="Number of untimed runs before benchmarking.",
+    )
+    parser.add_argument(
+        "--benchmark-iterations",
+        type=int,
+        default=BenchmarkConfig().iterations,
+        help="Number of timed runs for benchmarking.",
+    )
+
+    parser.add_argument(
+        "--sweep",
+        nargs="+",
+        metavar="DIM_PARAM=V1,V2,...",
+        help="Instead of running the test stages, benchmark each test at every combination of these dim param values, e.g. --sweep batch_size=1,4,16 seq_len=128,512. Results are written to sweep.csv. Uses --benchmark-warmup and --benchmark-iterations.",
+    )
+    parser.add_argument(
+        "--sweep-compile",
+        choices=["dynamic", "static", "both"],
+        default="dynamic",
+        help="dynamic: compile each model once with its dim params left dynamic. static: compile once per sweep point with the dim params fixed. both: do both, and compare the latency of the dynamic module to the static ones (dynamic_vs_static in sweep.csv).",
+    )
+
+    parser.add_argument(
+        "--bisect",
+        action="store_true",
+        default=False,
+        help="For each test that fails at import_model, preprocessing, compilation or compiled_inference, or with a numeric mismatch, binary search for the shortest prefix of its model (in topological order) that fails the same way. Each tried prefix runs in the bisect/ subdirectory of the test's log directory, and the result is saved to bisect.json.",
+    )
 
     # test-list filtering arguments:
     parser.add_argument(
@@ -388,6 +995,21 @@ def _get_argparse():
         help="A file with lists of test names to run",
     )
 
+    # parallelism
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes to run tests in. A test that crashes its worker fails at the stage it was running. 0 runs tests in the main process (e.g., for debugging).",
+    )
+    parser.add_argument(
+        "--max-tests-per-worker",
+        type=int,
+        default=50,
+        help="Replace each worker process after running this many tests, to bound memory growth. 0 never replaces workers.",
+    )
+
     # test tolerance
     parser.add_argument(
         "--tolerance",
@@ -416,6 +1038,27 @@ def _get_argparse():
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "--profile-harness",
+        action="store_true",
+        default=False,
+        help="Sample the python stacks of the test runner (not the tools under test) and merge them into a flamegraph-compatible harness-profile.collapsed in the run directory",
+    )
+    parser.add_argument(
+        "--cache-budget",
+        type=float,
+        help="Maximum size (in GB) of downloaded models kept in CACHE_DIR. Least recently used models are evicted once it is exceeded. Can also be set with the CACHE_BUDGET_GB environment variable.",
+    )
+    parser.add_argument(
+        "--no-revalidate",
+        action="store_true",
+        default=False,
+        help="Use cached models without revalidating them against the remote blob (e.g., for offline runs). Can also be set with CACHE_REVALIDATE=0.",
+    )
+    parser.add_argument(
+        "--mirror-dir",
+        help="Download models from this local/NFS mirror instead of azure (populate it with utils/sync_mirror.py). Can also be set with the SHARK_MIRROR_DIR environment variable.",
+    )
     parser.add_argument(
         "--report",
         action="store_true",
@@ -435,13 +1078,6 @@ def _get_argparse():
     #     help="If not default, casts model and input to given data type if framework supports model.to(dtype) and tensor.to(dtype)",
     # )
     # parser.add_argument(
-    #     "-j",
-    #     "--jobs",
-    #     type=int,
-    #     default=4,
-    #     help="Number of parallel processes to use per machine for running tests",
-    # )
-    # parser.add_argument(
     #     "--norun",
     #     action="store_true",
     #     default=False,
@@ -0,0 +1,65 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""Tests of revalidating cached azure models. Run with `pytest tests` from the alt_e2eshark directory."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("azure.storage.blob")
+
+# allow importing from the alt_e2eshark dir, like run.py
+sys.path.append(str(Path(__file__).parents[1]))
+
+from e2e_testing import azutils
+from e2e_testing.cache import ModelCache
+
+
+class ChangedRemote:
+    """a backend whose copy of every model differs from the cached one"""
+
+    def __init__(self):
+        self.metadata_requests = 0
+
+    def url(self, key):
+        return f"fake://{key}"
+
+    def get_metadata(self, key):
+        self.metadata_requests += 1
+        return {"size": 3, "etag": '"new"', "md5": None}
+
+    def download(self, key, dest_file):
+        Path(dest_file).write_bytes(b"new")
+        return {"size": 3, "etag": '"new"', "md5": None}
+
+
+@pytest.fixture
+def cached_model(tmp_path, monkeypatch):
+    backend = ChangedRemote()
+    monkeypatch.setattr(azutils, "onnx_model_backends", lambda: [backend])
+    model_cache = ModelCache(str(tmp_path))
+    zip_path = Path(model_cache.path("model/model.onnx.zip"))
+    zip_path.parent.mkdir()
+    zip_path.write_bytes(b"old")
+    model_cache.record("model/model.onnx.zip", etag='"old"')
+    return backend, zip_path
+
+
+def test_cached_model_is_revalidated(cached_model, monkeypatch):
+    backend, zip_path = cached_model
+    monkeypatch.delenv("CACHE_REVALIDATE", raising=False)
+    azutils.download_and_setup_onnxmodel(str(zip_path.parent), "model")
+    assert backend.metadata_requests == 1
+    assert zip_path.read_bytes() == b"new"
+
+
+def test_no_revalidate_uses_the_cached_model(cached_model, monkeypatch):
+    backend, zip_path = cached_model
+    monkeypatch.setenv("CACHE_REVALIDATE", "0")
+    azutils.download_and_setup_onnxmodel(str(zip_path.parent), "model")
+    assert backend.metadata_requests == 0
+    assert zip_path.read_bytes() == b"old"
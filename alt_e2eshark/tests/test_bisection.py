@@ -0,0 +1,98 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""Tests of the bisection helpers of run.py --bisect. Run with `pytest tests` from the alt_e2eshark directory."""
+
+import argparse
+import os
+import signal
+import sys
+from pathlib import Path
+
+import pytest
+
+# allow importing from the alt_e2eshark dir, like run.py
+sys.path.append(str(Path(__file__).parents[1]))
+
+from e2e_testing.bisection import bisect_progress, bisected_status, shortest_failing_prefix
+from e2e_testing.worker_pool import run_in_workers
+from utils.report import generate_report
+
+STAGES = ["setup", "import_model", "preprocessing", "compilation", "construct_inputs", "native_inference"]
+
+
+def test_shortest_failing_prefix():
+    def fails_from(first_failing):
+        calls = []
+
+        def fails(size):
+            calls.append(size)
+            return size >= first_failing
+
+        return fails, calls
+
+    for num_nodes in [1, 2, 7, 100, 1000]:
+        for first_failing in sorted({1, 2, num_nodes // 2 + 1, num_nodes - 1, num_nodes} - {0}):
+            if first_failing > num_nodes:
+                continue
+            fails, calls = fails_from(first_failing)
+            assert shortest_failing_prefix(num_nodes, fails) == first_failing
+            # the full model, then a binary search
+            assert calls[0] == num_nodes
+            assert len(calls) <= 1 + max(1, num_nodes - 1).bit_length()
+
+    # the full model isn't rerun when it is known to fail
+    fails, calls = fails_from(600)
+    assert shortest_failing_prefix(1000, fails, known_failing=True) == 600
+    assert 1000 not in calls
+
+    fails, calls = fails_from(1001)
+    assert shortest_failing_prefix(1000, fails) is None
+    assert calls == [1000]
+    assert shortest_failing_prefix(0, fails) is None
+
+
+def crash_while_bisecting(index, report):
+    """a test which fails at compilation, then kills its worker while running a prefix"""
+    report("setup")
+    report("compilation")
+    report(bisect_progress("compilation"))
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def test_crash_while_bisecting_keeps_the_test_status(tmp_path):
+    [(index, status, crash)] = list(run_in_workers(1, crash_while_bisecting, jobs=1))
+    assert status is None and crash is not None
+    assert crash.last_progress == bisect_progress("compilation")
+    assert bisected_status(crash.last_progress) == "compilation"
+    assert bisected_status("compilation") is None
+    assert bisected_status(None) is None
+
+    args = argparse.Namespace(report_file=str(tmp_path / "report.md"))
+    generate_report(args, list(STAGES), {"test": bisected_status(crash.last_progress)})
+    assert "| compilation | 1 |" in (tmp_path / "report.md").read_text()
+
+
+def test_report_of_run_each_test_with_a_crashed_bisection(tmp_path):
+    # run.py imports the test configs and backends, which need torch_mlir and iree
+    pytest.importorskip("torch_mlir")
+    pytest.importorskip("iree.compiler")
+    from run import run_each_test
+    from e2e_testing.framework import Test
+
+    def run_test(t, on_stage):
+        # like run_single_test, which creates the log directory of the test
+        os.makedirs(tmp_path / t.unique_name, exist_ok=True)
+        crash_while_bisecting(0, on_stage)
+
+    tests = [Test("crashed_bisection", None)]
+    status_dict = run_each_test(tests, run_test, str(tmp_path), verbose=False, jobs=1, max_tests_per_worker=0)
+    assert status_dict == {"crashed_bisection": "compilation"}
+    # the crash is logged to bisect.log, rather than over the log of the compilation failure
+    assert (tmp_path / "crashed_bisection" / "bisect.log").exists()
+
+    args = argparse.Namespace(report_file=str(tmp_path / "report.md"))
+    generate_report(args, list(STAGES), status_dict)
+    assert "| crashed_bisection | compilation | |" in (tmp_path / "report.md").read_text()
@@ -0,0 +1,68 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""Tests of reading onnx models for the model index. Run with `pytest tests` from the alt_e2eshark directory."""
+
+import sys
+from pathlib import Path
+
+import numpy
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+# allow importing from the alt_e2eshark dir, like run.py
+sys.path.append(str(Path(__file__).parents[1]))
+
+from e2e_testing.model_index import ModelSource, load_model_without_tensor_data, summarize_model
+
+
+def make_model() -> onnx.ModelProto:
+    weights = [numpy_helper.from_array(numpy.random.rand(64, 64).astype(numpy.float32), f"w{i}") for i in range(4)]
+    shape = helper.make_tensor("shape", TensorProto.INT64, [2], [-1, 64])
+    sparse = helper.make_sparse_tensor(
+        numpy_helper.from_array(numpy.ones(4, numpy.float32), "values"),
+        numpy_helper.from_array(numpy.arange(4, dtype=numpy.int64), "indices"),
+        [16],
+    )
+    nodes = [helper.make_node("MatMul", ["x", f"w{i}"], [f"y{i}"]) for i in range(4)]
+    nodes.append(helper.make_node("Reshape", ["y3", "shape"], ["y"]))
+    graph = helper.make_graph(
+        nodes,
+        "graph",
+        [helper.make_tensor_value_info("x", TensorProto.FLOAT, ["batch", 64])],
+        [helper.make_tensor_value_info("y", TensorProto.FLOAT, ["batch", 64])],
+        weights + [shape],
+        sparse_initializer=[sparse],
+    )
+    return helper.make_model(graph)
+
+
+def test_load_model_without_tensor_data(tmp_path):
+    model = make_model()
+    model_path = str(tmp_path / "model.onnx")
+    onnx.save(model, model_path)
+
+    for tensor in list(model.graph.initializer) + [
+        t for sparse in model.graph.sparse_initializer for t in [sparse.values, sparse.indices]
+    ]:
+        for field in ["raw_data", "float_data", "int64_data"]:
+            tensor.ClearField(field)
+    assert load_model_without_tensor_data(model_path) == model
+
+
+def test_summaries_of_inline_and_external_data_match(tmp_path):
+    model = make_model()
+    inline_path = str(tmp_path / "inline.onnx")
+    onnx.save(model, inline_path)
+    external_path = str(tmp_path / "external.onnx")
+    onnx.save(model, external_path, save_as_external_data=True, location="external.data", size_threshold=0)
+
+    inline = summarize_model(ModelSource("inline", inline_path))
+    external = summarize_model(ModelSource("external", external_path))
+    assert inline["parameters"] == external["parameters"] == 4 * 64 * 64 + 2 + 4
+    assert inline["parameter_bytes"] == 4 * 64 * 64 * 4 + 2 * 8 + 4 * 4
+    assert inline["op_types"] == external["op_types"] == {"MatMul": 4, "Reshape": 1}
+    assert inline["dim_params"] == ["batch"]
+    assert inline["external_data_bytes"] == 0 and external["external_data_bytes"] >= 4 * 64 * 64 * 4
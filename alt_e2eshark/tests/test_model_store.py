@@ -0,0 +1,39 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""Tests of pruning the model store. Run with `pytest tests` from the alt_e2eshark directory."""
+
+import io
+import os
+import sys
+import time
+from pathlib import Path
+
+# allow importing from the alt_e2eshark dir, like run.py
+sys.path.append(str(Path(__file__).parents[1]))
+
+from e2e_testing.model_store import PRUNE_GRACE_SECONDS, ModelStore
+
+
+def backdate(path: str):
+    past = time.time() - 2 * PRUNE_GRACE_SECONDS
+    os.utime(path, (past, past))
+
+
+def test_prune_keeps_objects_which_may_not_be_indexed_yet(tmp_path):
+    store = ModelStore(str(tmp_path / "store"))
+    # an object of a zip being extracted by another worker, which hasn't written its index entry yet
+    new_object = store.object_path(store.add_object(io.BytesIO(b"new")))
+    # an object of an evicted zip, which a new extraction reuses
+    reused_object = store.object_path(store.add_object(io.BytesIO(b"reused")))
+    backdate(reused_object)
+    store.add_object(io.BytesIO(b"reused"))
+    # an object of an evicted zip
+    old_object = store.object_path(store.add_object(io.BytesIO(b"old")))
+    backdate(old_object)
+
+    assert store.prune() == len(b"old")
+    assert os.path.exists(new_object) and os.path.exists(reused_object)
+    assert not os.path.exists(old_object)
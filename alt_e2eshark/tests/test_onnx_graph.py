@@ -0,0 +1,181 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+"""Tests of truncating and extracting parts of onnx graphs with IndexedGraph. Run with `pytest tests` from the
+alt_e2eshark directory."""
+
+import sys
+from pathlib import Path
+
+import numpy
+import onnx
+import pytest
+from onnx import TensorProto, helper, numpy_helper
+
+# allow importing from the alt_e2eshark dir, like run.py
+sys.path.append(str(Path(__file__).parents[1]))
+
+from e2e_testing.onnx_graph import IndexedGraph
+from e2e_testing.onnx_utils import find_minimal_graph, find_node, modify_model_output
+
+
+def tensor_info(name: str) -> onnx.ValueInfoProto:
+    return helper.make_tensor_value_info(name, TensorProto.FLOAT, [4])
+
+
+def make_chain(num_blocks: int = 3) -> onnx.ModelProto:
+    """x -> Relu -> Add w -> Relu -> Add w -> ... -> y, with value infos for every intermediate value"""
+    nodes = []
+    value = "x"
+    for i in range(num_blocks):
+        nodes.append(helper.make_node("Relu", [value], [f"r{i}"], name=f"relu{i}"))
+        value = f"a{i}" if i < num_blocks - 1 else "y"
+        nodes.append(helper.make_node("Add", [f"r{i}", "w"], [value], name=f"add{i}"))
+    intermediates = [name for node in nodes for name in node.output if name != "y"]
+    graph = helper.make_graph(
+        nodes,
+        "chain",
+        [tensor_info("x")],
+        [tensor_info("y")],
+        [numpy_helper.from_array(numpy.ones(4, numpy.float32), "w")],
+        value_info=[tensor_info(name) for name in intermediates],
+    )
+    return helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)])
+
+
+def node_names(model: onnx.ModelProto):
+    return [node.name for node in model.graph.node]
+
+
+def test_truncate_by_op_type():
+    model = make_chain()
+    assert find_node(model, 1, "Relu") == 2
+    assert find_node(model, -1, "Add") == 5
+    assert find_node(model, -3, "Add") == 1
+    with pytest.raises(ValueError, match="OOB"):
+        find_node(model, 3, "Relu")
+    with pytest.raises(ValueError, match="OOB"):
+        find_node(model, 0, "MatMul")
+
+    truncated = modify_model_output(model, find_node(model, 1, "Relu"))
+    onnx.checker.check_model(truncated)
+    assert node_names(truncated) == ["relu0", "add0", "relu1"]
+    assert [vi.name for vi in truncated.graph.output] == ["r1"]
+    assert [t.name for t in truncated.graph.initializer] == ["w"]
+    # the output isn't also left as a value info
+    assert "r1" not in {vi.name for vi in truncated.graph.value_info}
+    # the original model is left as is
+    assert len(model.graph.node) == 6 and [vi.name for vi in model.graph.output] == ["y"]
+
+
+def test_truncate_from_the_end():
+    model = make_chain()
+    truncated = modify_model_output(model, -2)
+    onnx.checker.check_model(truncated)
+    assert node_names(truncated) == ["relu0", "add0", "relu1", "add1", "relu2"]
+    assert [vi.name for vi in truncated.graph.output] == ["r2"]
+    whole = modify_model_output(model, -1)
+    assert list(whole.graph.node) == list(model.graph.node)
+    assert list(whole.graph.output) == list(model.graph.output)
+
+    # the first node only needs the graph input
+    first = modify_model_output(model, 0)
+    assert node_names(first) == ["relu0"]
+    assert [vi.name for vi in first.graph.input] == ["x"]
+    assert len(first.graph.initializer) == 0
+
+
+def test_unsorted_node_order():
+    model = make_chain()
+    sorted_nodes = list(model.graph.node)
+    # a permutation in which every node comes before the producer of its input
+    permutation = [5, 3, 4, 1, 2, 0]
+    del model.graph.node[:]
+    model.graph.node.extend(sorted_nodes[i] for i in permutation)
+
+    graph = IndexedGraph(model.graph)
+    assert [graph.nodes[i].name for i in graph.topological_order()] == [node.name for node in sorted_nodes]
+    # nodes of an op type are counted in graph order, as in the graph the user sees
+    assert graph.nth_node(0, "Relu") == permutation.index(4)
+    assert graph.nth_node(-1, "Relu") == permutation.index(0)
+
+    # add1 (at index 1) needs the first four nodes, wherever they are
+    keep_names, keep_vi_names = find_minimal_graph(model.graph, 1)
+    assert keep_names == {"relu0", "add0", "relu1", "add1"}
+    assert keep_vi_names == {"x", "w", "r0", "a0", "r1", "a1"}
+
+    truncated = modify_model_output(model, 1)
+    assert sorted(node_names(truncated)) == sorted(keep_names)
+    assert [vi.name for vi in truncated.graph.output] == ["a1"]
+
+    cycle = helper.make_graph(
+        [helper.make_node("Relu", ["b"], ["a"]), helper.make_node("Relu", ["a"], ["b"])], "cycle", [], []
+    )
+    with pytest.raises(ValueError, match="cycle"):
+        IndexedGraph(cycle).topological_order()
+
+
+def make_control_flow_model() -> onnx.ModelProto:
+    """a model whose If and Loop bodies read values of the outer graph which no node of the outer graph reads"""
+    then_branch = helper.make_graph(
+        [helper.make_node("Neg", ["outer_then"], ["then_out"])], "then", [], [tensor_info("then_out")]
+    )
+    else_branch = helper.make_graph(
+        [helper.make_node("Abs", ["outer_else"], ["else_out"])], "else", [], [tensor_info("else_out")]
+    )
+    loop_body = helper.make_graph(
+        [
+            helper.make_node("Identity", ["cond_in"], ["cond_out"]),
+            helper.make_node("Add", ["carried_in", "outer_loop"], ["carried_out"]),
+        ],
+        "body",
+        [
+            helper.make_tensor_value_info("iteration", TensorProto.INT64, []),
+            helper.make_tensor_value_info("cond_in", TensorProto.BOOL, []),
+            tensor_info("carried_in"),
+        ],
+        [helper.make_tensor_value_info("cond_out", TensorProto.BOOL, []), tensor_info("carried_out")],
+    )
+    nodes = [
+        helper.make_node("Relu", ["x"], ["outer_then"], name="then_input"),
+        helper.make_node("Sigmoid", ["x"], ["outer_else"], name="else_input"),
+        helper.make_node("Tanh", ["x"], ["outer_loop"], name="loop_input"),
+        helper.make_node("Unused", ["x"], ["unused"], name="unused", domain="test"),
+        helper.make_node("If", ["cond"], ["if_out"], name="if", then_branch=then_branch, else_branch=else_branch),
+        helper.make_node("Loop", ["trip_count", "", "if_out"], ["y"], name="loop", body=loop_body),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "control_flow",
+        [
+            tensor_info("x"),
+            helper.make_tensor_value_info("cond", TensorProto.BOOL, []),
+            helper.make_tensor_value_info("trip_count", TensorProto.INT64, []),
+        ],
+        [tensor_info("y"), tensor_info("unused")],
+        value_info=[tensor_info("outer_then"), tensor_info("outer_else"), tensor_info("if_out")],
+    )
+    return helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17), helper.make_opsetid("test", 1)])
+
+
+def test_if_and_loop_bodies():
+    model = make_control_flow_model()
+    graph = IndexedGraph(model.graph)
+    if_index = find_node(model, 0, "If")
+    # the values read by the bodies count as inputs of the If and Loop nodes, but the omitted loop condition doesn't
+    assert graph.node_inputs[if_index] == ["cond", "outer_else", "outer_then"]
+    assert graph.node_inputs[find_node(model, 0, "Loop")] == ["trip_count", "if_out", "outer_loop"]
+    assert graph.consumers["outer_then"] == [if_index]
+
+    truncated = modify_model_output(model, if_index)
+    assert node_names(truncated) == ["then_input", "else_input", "if"]
+    assert [vi.name for vi in truncated.graph.output] == ["if_out"]
+    assert [vi.name for vi in truncated.graph.input] == ["x", "cond"]
+
+    keep_names, keep_vi_names = find_minimal_graph(model.graph, -1)
+    assert keep_names == {"then_input", "else_input", "loop_input", "if", "loop"}
+    assert {"outer_then", "outer_else", "outer_loop"} <= keep_vi_names
+    # a value defined inside a body isn't an input of the outer graph
+    assert "carried_in" not in keep_vi_names and "then_out" not in keep_vi_names
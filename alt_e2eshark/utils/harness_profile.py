@@ -0,0 +1,139 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Tuple, Union
+from pathlib import Path
+
+SAMPLE_INTERVAL = 0.005
+# each sample is weighted by the number of milliseconds since the previous one, because the sampling
+# thread can be held back by the GIL while the harness runs pure python code
+SAMPLE_UNIT = 0.001
+TOOL_FRAME = "[tool]"
+PROFILE_NAME = "harness.collapsed"
+
+# Frames belonging to the tools under test. A sample whose stack passes through one of these
+# (path fragment, function name or None) pairs is counted as tool time, everything else is harness
+# overhead. Note that onnx.load and InferenceSession construction intentionally count as overhead.
+DEFAULT_TOOL_FRAMES = [
+    (f"{os.sep}iree{os.sep}", None),
+    (f"{os.sep}torch_mlir{os.sep}", None),
+    ("subprocess.py", None),
+    ("onnxruntime_inference_collection.py", "run"),
+]
+
+
+class HarnessSampler:
+    """Samples the python stack of the thread that calls start() and counts identical stacks.
+    Stacks are stored in the collapsed format used by flamegraph.pl and speedscope."""
+
+    def __init__(self, tool_frames: Iterable[Tuple[str, Optional[str]]] = DEFAULT_TOOL_FRAMES, interval: float = SAMPLE_INTERVAL):
+        self.tool_frames = list(tool_frames)
+        self.interval = interval
+        self.stacks = Counter()
+        self._target = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _is_tool_frame(self, code) -> bool:
+        for path_fragment, func_name in self.tool_frames:
+            if path_fragment in code.co_filename and (func_name is None or func_name == code.co_name):
+                return True
+        return False
+
+    def _sample_loop(self):
+        last = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            now = time.perf_counter()
+            weight = max(1, round((now - last) / SAMPLE_UNIT))
+            last = now
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            names = []
+            is_tool = False
+            while frame is not None:
+                code = frame.f_code
+                is_tool = is_tool or self._is_tool_frame(code)
+                names.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            names.reverse()
+            if is_tool:
+                names.append(TOOL_FRAME)
+            self.stacks[";".join(names)] += weight
+
+    def save_to(self, path: Union[str, Path]):
+        write_collapsed(self.stacks, path)
+
+
+def write_collapsed(stacks: Counter, path: Union[str, Path]):
+    with open(path, "w") as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f"{stack} {count}\n")
+
+
+def read_collapsed(path: Union[str, Path]) -> Counter:
+    stacks = Counter()
+    if not os.path.exists(path):
+        return stacks
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack:
+                stacks[stack] += int(count)
+    return stacks
+
+
+def harness_seconds(stacks: Counter) -> Tuple[float, float]:
+    """returns (sampled seconds, seconds spent in harness code) for a set of collapsed stacks"""
+    total = sum(stacks.values())
+    tool = sum(c for s, c in stacks.items() if s.endswith(";" + TOOL_FRAME))
+    return total * SAMPLE_UNIT, (total - tool) * SAMPLE_UNIT
+
+
+def merge_profiles(profiles: List[Tuple[str, Union[str, Path]]], save_to: Union[str, Path]) -> List[Tuple[str, float, float]]:
+    """merges (name, path) collapsed stack files into save_to. Returns a (name, sampled seconds, harness seconds) summary per profile."""
+    merged = Counter()
+    summary = []
+    for name, path in profiles:
+        stacks = read_collapsed(path)
+        if len(stacks) == 0:
+            continue
+        merged.update(stacks)
+        summary.append((name, *harness_seconds(stacks)))
+    write_collapsed(merged, save_to)
+    return summary
+
+
+@contextmanager
+def profile_harness(save_to: Union[str, Path], enabled: bool = True):
+    """context manager that samples the enclosed harness code and saves the collapsed stacks to save_to"""
+    if not enabled:
+        yield None
+        return
+    sampler = HarnessSampler()
+    sampler.start()
+    try:
+        yield sampler
+    finally:
+        sampler.stop()
+        sampler.save_to(save_to)
@@ -0,0 +1,154 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+# allow importing from the alt_e2eshark dir when run as a script
+sys.path.append(str(Path(__file__).parents[1]))
+
+from e2e_testing.model_index import (
+    INDEX_NAME,
+    build_index,
+    corpus_names,
+    load_index,
+    op_frequency,
+    path_sources,
+    query_index,
+    store_sources,
+)
+
+
+def _default_index_path():
+    cache_dir = os.getenv("CACHE_DIR")
+    return os.path.join(cache_dir, INDEX_NAME) if cache_dir else INDEX_NAME
+
+
+def _get_argparse():
+    msg = "A script for indexing the op types, opsets, inputs, dim params, parameter counts and sizes of the onnx models of the corpus, and for querying the index."
+    parser = argparse.ArgumentParser(prog="index_models.py", description=msg, epilog="")
+    parser.add_argument(
+        "--index",
+        default=_default_index_path(),
+        help="the index file (default: $CACHE_DIR/model_index.json)",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="index new and changed models")
+    build.add_argument(
+        "paths",
+        nargs="*",
+        help="onnx files or directories to index. By default, indexes the corpus models which are extracted in the model store of CACHE_DIR.",
+    )
+    build.add_argument(
+        "-c",
+        "--cachedir",
+        default=os.getenv("CACHE_DIR"),
+        help="the cache directory of the model store (default: $CACHE_DIR)",
+    )
+    build.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes",
+    )
+    build.add_argument(
+        "--prune",
+        action="store_true",
+        default=False,
+        help="drop the entries of models which weren't indexed by this build",
+    )
+
+    query = subparsers.add_parser("query", help="list the indexed models matching all the given conditions")
+    query.add_argument(
+        "--op",
+        action="append",
+        default=[],
+        help="an op type the models use (repeatable). Ops of other domains are written as <domain>::<op type>.",
+    )
+    query.add_argument(
+        "--opset",
+        type=int,
+        help="the opset version the models import for --domain",
+    )
+    query.add_argument(
+        "--domain",
+        default="ai.onnx",
+        help="the domain of --opset",
+    )
+    query.add_argument(
+        "--dim-param",
+        help="a dim param of the inputs or outputs of the models",
+    )
+    query.add_argument(
+        "--dynamic",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="only models with (--dynamic) or without (--no-dynamic) dim params",
+    )
+    query.add_argument(
+        "--op-frequency",
+        action="store_true",
+        default=False,
+        help="print the number of nodes and models of each op type over the matching models instead of their names",
+    )
+    query.add_argument(
+        "--json",
+        action="store_true",
+        default=False,
+        help="print the index entries of the matching models as json",
+    )
+    return parser
+
+
+def build(args):
+    if args.paths:
+        sources = path_sources(args.paths)
+    elif args.cachedir:
+        sources, missing = store_sources(corpus_names(), args.cachedir)
+        if missing:
+            print(f"{len(missing)} models aren't in the model store of {args.cachedir} and weren't indexed (run their tests or azutils to download them)")
+    else:
+        print("pass onnx files or directories to index, or set CACHE_DIR (or pass --cachedir) to index the model store")
+        sys.exit(1)
+    entries, num_indexed = build_index(sources, args.index, max(args.jobs, 1), keep_others=not args.prune)
+    failed = [key for key in (s.key for s in sources) if "error" in entries[key]]
+    print(f"indexed {num_indexed} of {len(sources)} models into {args.index} ({len(entries)} entries)")
+    for key in failed:
+        print(f"failed to index {key}: {entries[key]['error']}")
+
+
+def query(args):
+    entries = load_index(args.index)
+    if not entries:
+        print(f"no index found at {args.index}. Run index_models.py build first.")
+        sys.exit(1)
+    keys = query_index(
+        entries, op_types=args.op, opset=args.opset, domain=args.domain, dim_param=args.dim_param, dynamic=args.dynamic
+    )
+    if args.op_frequency:
+        for op_type, (num_nodes, num_models) in op_frequency(entries, keys).items():
+            print(f"{op_type}: {num_nodes} nodes in {num_models} models")
+    elif args.json:
+        print(json.dumps({key: entries[key] for key in keys}, indent=1))
+    else:
+        print("\n".join(keys))
+
+
+def main(args):
+    if args.command == "build":
+        build(args)
+    else:
+        query(args)
+
+
+if __name__ == "__main__":
+    parser = _get_argparse()
+    main(parser.parse_args())
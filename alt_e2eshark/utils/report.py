@@ -11,8 +11,8 @@ def save_dict(status_dict, status_dict_json):
         dict_str = json.dumps(status_dict, indent=4, sort_keys=True, separators=(',',': '), ensure_ascii=False)
         outfile.write(dict_str)
 
-def generate_report(args, stages, status_dict):
-    """generates a markdown report for a test-run"""
+def generate_report(args, stages, status_dict, benchmarks=None):
+    """generates a markdown report for a test-run. benchmarks maps test names to the results of the benchmark stage."""
 
     # set up report summary
     stages.append("results-summary")
@@ -21,7 +21,8 @@ def generate_report(args, stages, status_dict):
     stages.reverse()
     counts = {s : 0 for s in stages}
     for (key, value) in status_dict.items():
-        counts[value] += 1
+        # e.g. a stage that isn't in stages, which a crashed worker was running
+        counts[value] = counts.get(value, 0) + 1
     results_str = "## Summary\n\n|Stage|Count|\n|--|--|\n"
     results_str += f"| Total | {len(status_dict.keys())} |\n"
     for (key, value) in counts.items():
@@ -37,4 +38,26 @@ def generate_report(args, stages, status_dict):
     # get a report file and write to it 
     with open(args.report_file, "w") as file:
         file.write(results_str)
-        file.write(report_string)
\ No newline at end of file
+        file.write(report_string)
+        if benchmarks:
+            file.write(benchmark_report(benchmarks))
+
+def benchmark_report(benchmarks):
+    """a markdown table comparing the latency of compiled (e.g., IREE) and native (onnxruntime) inference, slowest compiled tests first"""
+    def speedup(result):
+        return result["native"]["p50_ms"] / result["compiled"]["p50_ms"]
+
+    report_string = "\n## Benchmarks\n\nSpeedup is the native median latency over the compiled median latency.\n\n"
+    report_string += "| Test | Compiled p50 (ms) | Compiled p90 (ms) | Native p50 (ms) | Native p90 (ms) | Compiled (runs/s) | Native (runs/s) | Speedup | Peak RSS (MB) |\n"
+    report_string += "|--|--|--|--|--|--|--|--|--|\n"
+    total_compiled = 0.0
+    total_native = 0.0
+    for (key, result) in sorted(benchmarks.items(), key=lambda item : speedup(item[1])):
+        compiled = result["compiled"]
+        native = result["native"]
+        total_compiled += compiled["p50_ms"]
+        total_native += native["p50_ms"]
+        peak_rss = max(compiled["peak_rss_mb"], native["peak_rss_mb"])
+        report_string += f"| {key} | {compiled['p50_ms']:.3f} | {compiled['p90_ms']:.3f} | {native['p50_ms']:.3f} | {native['p90_ms']:.3f} | {compiled['throughput']:.1f} | {native['throughput']:.1f} | {speedup(result):.2f}x | {peak_rss:.0f} |\n"
+    report_string += f"\nTotal median latency: {total_compiled:.3f} ms compiled, {total_native:.3f} ms native ({total_native / total_compiled:.2f}x)\n"
+    return report_string
\ No newline at end of file
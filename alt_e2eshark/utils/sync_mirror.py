@@ -0,0 +1,51 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+import argparse
+import sys
+from pathlib import Path
+
+# allow importing from the alt_e2eshark dir when run as a script
+sys.path.append(str(Path(__file__).parents[1]))
+
+from e2e_testing.azutils import sync_onnx_models_mirror
+from onnx_tests.helper_classes import AzureDownloadableModel
+from run import get_tests
+
+
+def _get_argparse():
+    msg = "A script for populating a local/NFS mirror with the model zips of azure downloadable tests. Set SHARK_MIRROR_DIR (or pass --mirror-dir to run.py) to run tests from the mirror."
+    parser = argparse.ArgumentParser(prog="sync_mirror.py", description=msg, epilog="")
+    parser.add_argument(
+        "mirror_dir",
+        help="the mirror directory to populate",
+    )
+    parser.add_argument(
+        "-t",
+        "--test-filter",
+        help="only mirror the models of tests matching this regex",
+    )
+    parser.add_argument(
+        "--testsfile",
+        help="a file with a list of test names to mirror the models of",
+    )
+    return parser
+
+
+def main(args):
+    test_list = get_tests("models", args.test_filter, args.testsfile)
+    names = [
+        t.unique_name
+        for t in test_list
+        if isinstance(t.model_constructor, type) and issubclass(t.model_constructor, AzureDownloadableModel)
+    ]
+    if not sync_onnx_models_mirror(args.mirror_dir, names):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = _get_argparse()
+    main(parser.parse_args())
@@ -1,7 +1,6 @@
 import os
 import glob
 import pickle
-from azure.storage.blob import BlobServiceClient
 import zipfile
 import struct
 import torch
@@ -58,33 +57,11 @@ def loadE2eSharkCheckDictionary():
     return e2esharkDict
 
 
-def uploadToBlobStorage(file_path, file_name, testName, uploadDict):
-    connection_string = os.getenv("AZURE_CONNECTION_STRING")
-    container_name = "e2esharkuserartifacts"
-
-    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-    blob_client = blob_service_client.get_blob_client(
-        container=container_name, blob=file_name
-    )
-    blob = blob_client.from_connection_string(
-        conn_str=connection_string,
-        container_name=container_name,
-        blob_name=blob_client.blob_name,
-    )
-    # we check to see if we already uploaded the blob (don't want to duplicate)
-    if blob.exists():
-        print(f"model artifacts have already been uploaded for this blob name")
-        return
-    # upload to azure storage container e2esharkuserartifacts
-    with open(file_path, "rb") as data:
-        blob_client.upload_blob(data)
-    dict_value = uploadDict.get(testName)
-    if not dict_value:
-        uploadDict[testName] = [blob_client.url]
-    else:
-        dict_value.append(blob_client.url)
-        uploadDict[testName] = dict_value
-    return
+def uploadToBlobStorage(file_path, file_name, testName, uploadQueue, deleteAfter=False):
+    # Queues the file for upload to azure storage container e2esharkuserartifacts
+    # by the ArtifactUploader of the main process (see tools/artifactupload.py)
+    # and returns at once. With deleteAfter the file is removed once uploaded.
+    uploadQueue.put((file_path, file_name, testName, deleteAfter))
 
 
 def unzipONNXFile(testName, abs_directory, unzipped_file_name):
@@ -1,4 +1,4 @@
-import numpy, torch, sys
+import numpy, torch, sys, os
 import onnxruntime
 import onnx
 from onnxruntime.tools.onnx_model_utils import make_dim_param_fixed, fix_output_shapes
@@ -48,7 +48,10 @@ def run(run_as_static: bool, logfile: str, verbose: bool):
 
         fix_output_shapes(model)
         logger.info("Overwriting file contents of model.onnx...")
-        onnx.save(model, "model.onnx")
+        # model.onnx links to the shared model store, replace the link rather
+        # than writing through it
+        onnx.save(model, "model.onnx.tmp")
+        os.replace("model.onnx.tmp", "model.onnx")
         logger.info("\t model.onnx is now a static model.")
     if not run_as_static and not is_dynamic:
         logger.info(
@@ -59,7 +62,8 @@ def run(run_as_static: bool, logfile: str, verbose: bool):
             logger.info(
                 "\t dynamic model found! \nSaving dynamic model as model.onnx..."
             )
-            onnx.save(model, "model.onnx")
+            onnx.save(model, "model.onnx.tmp")
+            os.replace("model.onnx.tmp", "model.onnx")
             logger.info("\t dynamic model saved as model.onnx.")
         except Exception as e:
             logger.warning(
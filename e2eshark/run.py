@@ -17,7 +17,15 @@ import datetime
 import simplejson
 import json
 from multiprocessing import Manager
-from tools.aztestsetup import pre_test_onnx_models_azure_download
+from tools.aztestsetup import ModelPrefetcher
+from tools.artifactupload import ArtifactUploader
+from tools.storagebackend import MIRROR_DIR_ENV
+from tools.profileutil import (
+    HarnessSampler,
+    HARNESS_PROFILE_FILE,
+    runProfiled,
+    mergeHarnessProfiles,
+)
 from zipfile import ZipFile
 from _run_helper import (
     getTestsList,
@@ -65,7 +73,7 @@ def logAndReturn(
     uploadtestsList,
     cleanup,
     testName,
-    uploadDict,
+    uploadQueue,
     dateAndTime,
 ):
 
@@ -79,10 +87,12 @@ def logAndReturn(
             file_type = item.split(".")[-1]
             if testName in uploadtestsList and file_type in upload_list:
                 identifier = testName.replace("/", "_") + "/" + dateAndTime + "/" + item
+                # The upload runs in the background, with cleanup the file is
+                # removed once it has been uploaded
                 uploadToBlobStorage(
-                    os.path.abspath(item), identifier, testName, uploadDict
+                    os.path.abspath(item), identifier, testName, uploadQueue, cleanup
                 )
-            if cleanup:
+            elif cleanup:
                 if file_type in delete_list:  # If it isn't in the list for retaining
                     os.remove(item)  # Remove the item
 
@@ -106,7 +116,7 @@ def runOnnxToTorchMLIRGeneration(
     resultdict,
     uploadtestsList,
     cleanup,
-    uploadDict,
+    uploadQueue,
     dateAndTime,
     torch_mlir_pythonpath,
 ):
@@ -141,7 +151,7 @@ def runOnnxToTorchMLIRGeneration(
                 uploadtestsList,
                 cleanup,
                 testName,
-                uploadDict,
+                uploadQueue,
                 dateAndTime,
             )
         end = time.time()
@@ -188,7 +198,7 @@ def runOnnxToTorchMLIRGeneration(
                 uploadtestsList,
                 cleanup,
                 testName,
-                uploadDict,
+                uploadQueue,
                 dateAndTime,
             )
         end = time.time()
@@ -225,7 +235,7 @@ def runOnnxToTorchMLIRGeneration(
                 uploadtestsList,
                 cleanup,
                 testName,
-                uploadDict,
+                uploadQueue,
                 dateAndTime,
             )
         end = time.time()
@@ -248,7 +258,7 @@ def runTorchMLIRGeneration(
     resultdict,
     uploadtestsList,
     cleanup,
-    uploadDict,
+    uploadQueue,
     dateAndTime,
 ):
     if args.verbose:
@@ -274,7 +284,7 @@ def runTorchMLIRGeneration(
             uploadtestsList,
             cleanup,
             testName,
-            uploadDict,
+            uploadQueue,
             dateAndTime,
         )
     end = time.time()
@@ -294,7 +304,7 @@ def runTorchMLIRGeneration(
             resultdict,
             uploadtestsList,
             cleanup,
-            uploadDict,
+            uploadQueue,
             dateAndTime,
             torch_mlir_pythonpath,
         )
@@ -313,7 +323,7 @@ def runCodeGeneration(
     resultdict,
     uploadtestsList,
     cleanup,
-    uploadDict,
+    uploadQueue,
     dateAndTime,
 ):
     if args.verbose:
@@ -359,7 +369,7 @@ def runCodeGeneration(
             uploadtestsList,
             cleanup,
             testName,
-            uploadDict,
+            uploadQueue,
             dateAndTime,
         )
     end = time.time()
@@ -414,7 +424,7 @@ def runInference(
     resultdict,
     uploadtestsList,
     cleanup,
-    uploadDict,
+    uploadQueue,
     dateAndTime,
 ):
     if args.verbose:
@@ -496,7 +506,7 @@ def runInference(
             uploadtestsList,
             cleanup,
             testName,
-            uploadDict,
+            uploadQueue,
             dateAndTime,
         )
     end = time.time()
@@ -581,7 +591,7 @@ def runInference(
                 uploadtestsList,
                 cleanup,
                 testName,
-                uploadDict,
+                uploadQueue,
                 dateAndTime,
             )
 
@@ -634,7 +644,7 @@ def runTestUsingClassicalFlow(args_tuple):
         modelinputptfilename,
         goldoutputptfilename,
         uploadtestsList,
-        uploadDict,
+        uploadQueue,
         dateAndTime,
     ) = args_tuple
     stubrunmodelpy = toolsDirAbsPath + "/stubs/pytorchmodel.py"
@@ -732,7 +742,7 @@ def runTestUsingClassicalFlow(args_tuple):
             resultdict,
             uploadtestsList,
             args.cleanup,
-            uploadDict,
+            uploadQueue,
             dateAndTime,
         ):
             return 1
@@ -747,7 +757,7 @@ def runTestUsingClassicalFlow(args_tuple):
             uploadtestsList,
             args.cleanup,
             testName,
-            uploadDict,
+            uploadQueue,
             dateAndTime,
         )
 
@@ -764,7 +774,7 @@ def runTestUsingClassicalFlow(args_tuple):
             resultdict,
             uploadtestsList,
             args.cleanup,
-            uploadDict,
+            uploadQueue,
             dateAndTime,
         ):
             return 1
@@ -778,7 +788,7 @@ def runTestUsingClassicalFlow(args_tuple):
             uploadtestsList,
             args.cleanup,
             testName,
-            uploadDict,
+            uploadQueue,
             dateAndTime,
         )
 
@@ -801,7 +811,7 @@ def runTestUsingClassicalFlow(args_tuple):
             resultdict,
             uploadtestsList,
             args.cleanup,
-            uploadDict,
+            uploadQueue,
             dateAndTime,
         ):
             return 1
@@ -815,20 +825,48 @@ def runTestUsingClassicalFlow(args_tuple):
         uploadtestsList,
         args.cleanup,
         testName,
-        uploadDict,
+        uploadQueue,
         dateAndTime,
     )
     return 0
 
 
 def runTest(aTuple):
+    (
+        frameworkname,
+        testName,
+        args,
+        script_dir,
+        run_dir,
+        uploadQueue,
+        dateAndTime,
+        downloadStatus,
+    ) = aTuple
+    if args.profile_harness:
+        # launchCommand blocks in os.system while a child tool runs, so samples
+        # ending there are tool time rather than harness overhead
+        profilefile = run_dir + "/" + testName + "/" + HARNESS_PROFILE_FILE
+        return runProfiled(
+            runSingleTest, aTuple, profilefile, toolfunctions=["launchCommand"]
+        )
+    return runSingleTest(aTuple)
+
+
+def runSingleTest(aTuple):
     curdir = os.getcwd()
     # Do not construct absolute path here as this will run
     # in a new process and cur dir may change over time giving
     # unpredicatble results
-    (frameworkname, testName, args, script_dir, run_dir, uploadDict, dateAndTime) = (
-        aTuple
-    )
+    (
+        frameworkname,
+        testName,
+        args,
+        script_dir,
+        run_dir,
+        uploadQueue,
+        dateAndTime,
+        downloadStatus,
+    ) = aTuple
     testRunDir = run_dir + "/" + testName
     modelname = os.path.basename(testName)
     modelinputptfilename = (
@@ -842,6 +880,10 @@ def runTest(aTuple):
     for phase in phases:
         # Put status and time taken for each phase
         resultdict[phase] = ["notrun", 0.0]
+    # download is reported separately from phases as it is done by the
+    # ModelPrefetcher before the test is scheduled. It comes last so that the
+    # columns of the phases keep their indices (e.g. for reportutil.py --columns)
+    resultdict["download"] = downloadStatus
 
     testAbsPath = script_dir + "/" + testName
 
@@ -890,10 +932,23 @@ def runTest(aTuple):
         modelinputptfilename,
         goldoutputptfilename,
         uploadtestsList,
-        uploadDict,
+        uploadQueue,
         dateAndTime,
     )
-    if args.mode == "vaiml":
+    if downloadStatus[0] == "failed":
+        print("Test", testName, "failed [download]")
+        retStatus = logAndReturn(
+            commandslog,
+            timelog,
+            resultdict,
+            1,
+            uploadtestsList,
+            False,
+            testName,
+            uploadQueue,
+            dateAndTime,
+        )
+    elif args.mode == "vaiml":
         runTestUsingVAIML(args_tuple)
     else:
         retStatus = runTestUsingClassicalFlow(args_tuple)
@@ -911,8 +966,25 @@ def initializer(tm_path, iree_path):
     SHARED_IREE_BUILD = iree_path
 
 
+def iterReadyTests(testsList, prefetcher):
+    # Yields (test, download status) as tests become ready to be run
+    if prefetcher is None:
+        for test in testsList:
+            yield test, ["notrun", 0.0]
+        return
+    prefetcher.submit(testsList)
+    yield from prefetcher.ready(testsList)
+
+
 def runFrameworkTests(
-    frameworkname, testsList, args, script_dir, run_dir, TORCH_MLIR_BUILD, IREE_BUILD
+    frameworkname,
+    testsList,
+    args,
+    script_dir,
+    run_dir,
+    TORCH_MLIR_BUILD,
+    IREE_BUILD,
+    prefetcher=None,
 ):
     # print(f"In runFrameworkTests - torch mlir build - {TORCH_MLIR_BUILD}")
     if len(testsList) == 0:
@@ -929,35 +1001,63 @@ def runFrameworkTests(
     if args.ci:
         if "pytorch/models/vicuna-13b-v1.3" in uniqueTestList:
             uniqueTestList.remove("pytorch/models/vicuna-13b-v1.3")
-    uploadDict = Manager().dict({})
-    dateAndTime = str(datetime.datetime.now(datetime.timezone.utc))
-    tupleOfListArg = []
-    # Create list of tuple(test, arg, run_dir) to allow launching tests in parallel
-    [
-        tupleOfListArg.append(
-            (frameworkname, test, args, script_dir, run_dir, uploadDict, dateAndTime)
+    # Test workers queue their artifacts for upload and move on, the uploads
+    # run on the threads of one ArtifactUploader in this process
+    uploadQueue = None
+    uploader = None
+    if args.uploadtestsfile:
+        uploadQueue = Manager().Queue()
+        uploader = ArtifactUploader(
+            uploadQueue,
+            os.getenv("AZURE_CONNECTION_STRING"),
+            jobs=args.upload_jobs,
         )
-        for test in uniqueTestList
-    ]
+    dateAndTime = str(datetime.datetime.now(datetime.timezone.utc))
+    # Create tuple(test, arg, run_dir, ...) to allow launching tests in parallel
+    makeTuple = lambda test, downloadStatus: (
+        frameworkname,
+        test,
+        args,
+        script_dir,
+        run_dir,
+        uploadQueue,
+        dateAndTime,
+        downloadStatus,
+    )
     if args.verbose:
         print("Following tests will be run:", uniqueTestList)
 
     if args.ci:
-        for i in range(0, len(tupleOfListArg)):
+        if uploader:
+            uploader.start()
+        for test, downloadStatus in iterReadyTests(uniqueTestList, prefetcher):
             initializer(TORCH_MLIR_BUILD, IREE_BUILD)
-            runTest(tupleOfListArg[i])
+            runTest(makeTuple(test, downloadStatus))
     else:
+        # The pool must be created before the prefetcher starts its threads,
+        # as forking a process with running threads is not safe
         with Pool(poolSize, initializer, (TORCH_MLIR_BUILD, IREE_BUILD)) as p:
-            result = p.map_async(runTest, tupleOfListArg)
-            result.wait()
+            if uploader:
+                uploader.start()
+            results = []
+            # Tests are submitted as soon as their model is available
+            for test, downloadStatus in iterReadyTests(uniqueTestList, prefetcher):
+                results += [p.apply_async(runTest, (makeTuple(test, downloadStatus),))]
+            for result in results:
+                result.wait()
             if args.verbose:
                 print("All tasks submitted to process pool completed")
+    if prefetcher:
+        prefetcher.shutdown()
+    uploadUrls = {}
+    if uploader:
+        print("Waiting for artifact uploads to finish")
+        uploadUrls = uploader.shutdown()
 
     with open("upload_urls.json", "w") as convert_file:
-        # convert_file.write(json.dumps(uploadDict._getvalue()))
         convert_file.write(
             simplejson.dumps(
-                simplejson.loads(json.dumps(uploadDict._getvalue())),
+                simplejson.loads(json.dumps(uploadUrls)),
                 indent=4,
                 sort_keys=True,
             )
@@ -1094,6 +1194,42 @@ def generateReport(run_dir, testsList, args):
             print(items, file=f)
 
 
+class NoSampler:
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def generateHarnessProfile(run_dir, testsList, args, mainsampler):
+    mainprofile = run_dir + "/harness.main.collapsed"
+    mainsampler.write(mainprofile)
+    profilefiles = [("run.py", mainprofile)]
+    profilefiles += [
+        (test, run_dir + "/" + test + "/" + HARNESS_PROFILE_FILE) for test in testsList
+    ]
+    mergedprofile = run_dir + "/harness-profile.collapsed"
+    rows = mergeHarnessProfiles(profilefiles, mergedprofile)
+    tableheader = ["tests", "sampled-time", "harness-time", "harness-percent"]
+    harnesstable = tabulate.tabulate(
+        [tableheader] + rows, headers="firstrow", tablefmt=args.reportformat
+    )
+    suffix = "txt"
+    if args.reportformat == "html":
+        suffix = "html"
+    elif args.reportformat == "pipe" or args.reportformat == "github":
+        suffix = "md"
+    harnesstablefile = run_dir + "/harnessreport." + suffix
+    with open(harnesstablefile, "w") as harnessf:
+        print(
+            f"Harness overhead (time in seconds) for run: {os.path.basename(run_dir)}\n",
+            file=harnessf,
+        )
+        print(harnesstable, file=harnessf)
+    print(f"Generated harness profile {mergedprofile} and report {harnesstablefile}")
+
+
 def checkBuild(run_dir, args):
     IREE_BUILD = ""
     TORCH_MLIR_BUILD = ""
@@ -1176,6 +1312,17 @@ def main():
         default=4,
         help="Number of parallel processes to use per machine for running tests",
     )
+    parser.add_argument(
+        "--download-jobs",
+        type=int,
+        default=4,
+        help="Number of concurrent model downloads, done in the background while tests run",
+    )
+    parser.add_argument(
+        "--download-bandwidth",
+        type=float,
+        help="Optional cap on the combined model download bandwidth in MiB/s",
+    )
     parser.add_argument(
         "-c",
         "--torchmlirbuild",
@@ -1246,6 +1393,12 @@ def main():
         "--uploadtestsfile",
         help="A file with lists of tests that should be uploaded",
     )
+    parser.add_argument(
+        "--upload-jobs",
+        type=int,
+        default=4,
+        help="Number of artifacts of --uploadtestsfile tests to upload concurrently, in the background",
+    )
     parser.add_argument(
         "-t",
         "--tests",
@@ -1287,6 +1440,22 @@ def main():
         help="Please select a dir with large free space to cache all torch, hf, turbine_tank model data",
         required=True,
     )
+    parser.add_argument(
+        "--cache-budget",
+        type=float,
+        help="Size budget in GB for downloaded model zips in the cache directory. Least recently used models are evicted when it is exceeded",
+    )
+    parser.add_argument(
+        "--no-cache-revalidate",
+        action="store_true",
+        default=False,
+        help="Use cached model zips without checking them against the remote blob metadata",
+    )
+    parser.add_argument(
+        "--mirror-dir",
+        help="Download onnx model zips from this local/NFS mirror instead of Azure Storage (sets SHARK_MIRROR_DIR). "
+        "Populate it with tools/aztestsetup.py --sync-mirror",
+    )
     parser.add_argument(
         "--cleanup",
         help="Space efficient testing (removing the large mlir, vmfb files during the model runs)",
@@ -1305,6 +1474,12 @@ def main():
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "--profile-harness",
+        action="store_true",
+        default=False,
+        help="Sample the python stacks of run.py itself (not the child tools) per test and merge them into a flamegraph compatible harness-profile.collapsed in the run directory",
+    )
 
     args = parser.parse_args()
     cache_dir = args.cachedir
@@ -1319,15 +1494,17 @@ def main():
     # get the amount of GB available
     _, _, free = shutil.disk_usage(cache_dir)
     space_available = float(free) / pow(1024, 3)
-    if space_available < 20:
+    if space_available < 20 and not args.cache_budget:
         warnings.warn(
             "WARNING: Less than 20 GB of space available in selected cache directory. "
-            + "Please choose directory with more space to avoid disk storage issues when running models."
+            + "Please choose directory with more space or set --cache-budget to avoid disk storage issues when running models."
         )
 
     os.environ["TORCH_HOME"] = cache_dir
     os.environ["HF_HOME"] = cache_dir
     os.environ["TURBINE_TANK_CACHE_DIR"] = cache_dir
+    if args.mirror_dir:
+        os.environ[MIRROR_DIR_ENV] = os.path.abspath(os.path.expanduser(args.mirror_dir))
 
     if args.skiptestsfile and args.testsfile:
         print(f"ERROR: Only one of --skiptestsfile or --testsfile can be used")
@@ -1382,6 +1559,8 @@ def main():
                 sys.exit(1)
 
     print("Test run directory:", run_dir)
+    # samples harness work done in this process, outside of the test workers
+    mainsampler = HarnessSampler() if args.profile_harness else NoSampler()
     totalTestList = []
     skiptestslist = []
     # if args.tests used, that means run given specific tests, the --frameworks options will be
@@ -1418,8 +1597,16 @@ def main():
             testsList = frameworktotests_dict[framework]
             testsList = [test for test in testsList if not test in skiptestslist]
             totalTestList += testsList
+            prefetcher = None
             if framework == "onnx":
-                pre_test_onnx_models_azure_download(testsList, cache_dir, script_dir)
+                prefetcher = ModelPrefetcher(
+                    cache_dir,
+                    script_dir,
+                    args.download_jobs,
+                    args.download_bandwidth,
+                    args.cache_budget,
+                    not args.no_cache_revalidate,
+                )
             if not args.norun:
                 runFrameworkTests(
                     framework,
@@ -1429,14 +1616,27 @@ def main():
                     run_dir,
                     TORCH_MLIR_BUILD,
                     IREE_BUILD,
+                    prefetcher,
                 )
+            elif prefetcher:
+                for _ in iterReadyTests(testsList, prefetcher):
+                    pass
+                prefetcher.shutdown()
     else:
         for framework in frameworks:
             testsList = getTestsList(framework, args.groups)
             testsList = [test for test in testsList if not test in skiptestslist]
             totalTestList += testsList
+            prefetcher = None
             if framework == "onnx":
-                pre_test_onnx_models_azure_download(testsList, cache_dir, script_dir)
+                prefetcher = ModelPrefetcher(
+                    cache_dir,
+                    script_dir,
+                    args.download_jobs,
+                    args.download_bandwidth,
+                    args.cache_budget,
+                    not args.no_cache_revalidate,
+                )
             if not args.norun:
                 runFrameworkTests(
                     framework,
@@ -1446,11 +1646,21 @@ def main():
                     run_dir,
                     TORCH_MLIR_BUILD,
                     IREE_BUILD,
+                    prefetcher,
                 )
+            elif prefetcher:
+                for _ in iterReadyTests(testsList, prefetcher):
+                    pass
+                prefetcher.shutdown()
 
     # report generation
     if args.report:
+        mainsampler.start()
         generateReport(run_dir, totalTestList, args)
+        mainsampler.stop()
+
+    if args.profile_harness:
+        generateHarnessProfile(run_dir, totalTestList, args, mainsampler)
 
     if args.ci:
         today = datetime.date.today()
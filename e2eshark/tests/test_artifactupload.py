@@ -0,0 +1,129 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+# Tests of the ArtifactUploader pool against a fake blob service client. Run
+# with:
+#   pytest e2eshark/tests
+
+import queue, sys, threading, time
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("azure.storage.blob")
+from azure.core.exceptions import ResourceExistsError
+
+# allow importing from the e2eshark dir, like run.py
+sys.path.append(str(Path(__file__).parents[1]))
+
+from tools import artifactupload
+from tools.artifactupload import ArtifactUploader
+
+
+class FakeBlobService:
+    # Stands in for BlobServiceClient: keeps uploaded blobs in memory, and
+    # records how many uploads run at once
+    def __init__(self, upload_seconds=0.05):
+        self.blobs = {}
+        self.upload_seconds = upload_seconds
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def get_container_client(self, container_name):
+        return FakeContainer(self, container_name)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeContainer:
+    def __init__(self, service, name):
+        self.service = service
+        self.name = name
+
+    def get_blob_client(self, blob_name):
+        return FakeBlob(self.service, self.name, blob_name)
+
+
+class FakeBlob:
+    def __init__(self, service, container_name, blob_name):
+        self.service = service
+        self.blob_name = blob_name
+        self.url = f"https://fake/{container_name}/{blob_name}"
+
+    def upload_blob(self, data, overwrite=False, max_concurrency=1):
+        service = self.service
+        with service.lock:
+            service.active += 1
+            service.max_active = max(service.max_active, service.active)
+        try:
+            time.sleep(service.upload_seconds)
+            contents = data.read()
+            with service.lock:
+                if not overwrite and self.blob_name in service.blobs:
+                    raise ResourceExistsError("blob exists")
+                service.blobs[self.blob_name] = contents
+        finally:
+            with service.lock:
+                service.active -= 1
+
+
+@pytest.fixture
+def service(monkeypatch):
+    service = FakeBlobService()
+    monkeypatch.setattr(
+        artifactupload.BlobServiceClient,
+        "from_connection_string",
+        lambda connection_string, **kwargs: service,
+    )
+    return service
+
+
+def write_file(path, contents):
+    path.write_bytes(contents)
+    return str(path)
+
+
+def test_uploads_queued_artifacts_in_parallel(service, tmp_path):
+    requests = queue.Queue()
+    uploader = ArtifactUploader(requests, "UseDevelopmentStorage=true", jobs=4)
+    uploader.start()
+    for i in range(8):
+        test = f"test{i % 2}"
+        file_path = write_file(tmp_path / f"{i}.mlir", f"mlir {i}".encode())
+        requests.put((file_path, f"{test}/{i}.mlir", test, False))
+    urls = uploader.shutdown()
+
+    assert service.closed
+    assert sorted(service.blobs) == sorted(f"test{i % 2}/{i}.mlir" for i in range(8))
+    assert service.blobs["test1/3.mlir"] == b"mlir 3"
+    assert sorted(urls["test0"]) == [
+        f"https://fake/{artifactupload.ARTIFACTS_CONTAINER}/test0/{i}.mlir"
+        for i in (0, 2, 4, 6)
+    ]
+    assert 1 < service.max_active <= 4
+
+
+def test_existing_blobs_and_deleted_files(service, tmp_path):
+    service.blobs["test/model.mlir"] = b"uploaded by an earlier run"
+    requests = queue.Queue()
+    uploader = ArtifactUploader(requests, "UseDevelopmentStorage=true", jobs=2)
+    uploader.start()
+    existing = write_file(tmp_path / "model.mlir", b"new")
+    deleted = write_file(tmp_path / "model.onnx", b"onnx")
+    requests.put((existing, "test/model.mlir", "test", False))
+    requests.put((deleted, "test/model.onnx", "test", True))
+    urls = uploader.shutdown()
+
+    # the existing blob isn't overwritten, nor reported as uploaded by this run
+    assert service.blobs["test/model.mlir"] == b"uploaded by an earlier run"
+    assert urls == {
+        "test": [f"https://fake/{artifactupload.ARTIFACTS_CONTAINER}/test/model.onnx"]
+    }
+    assert not Path(deleted).exists()
+    assert Path(existing).exists()
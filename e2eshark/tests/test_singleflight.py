@@ -0,0 +1,62 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+# Tests of the single flight lock shared by e2eshark, alt_e2eshark and
+# iree_tests. Run with:
+#   pytest e2eshark/tests
+
+import fcntl, multiprocessing, os, sys, time
+from pathlib import Path
+
+# allow importing from the e2eshark dir, like run.py
+sys.path.append(str(Path(__file__).parents[1]))
+
+from tools import singleflight
+from tools.singleflight import single_flight
+
+
+def fill_entry(lock_file, entry_file, fills_file):
+    # Fills the entry unless another process already did, recording each fill
+    with single_flight(lock_file):
+        if not os.path.exists(entry_file):
+            with open(fills_file, "a") as f:
+                f.write(f"{os.getpid()}\n")
+            time.sleep(0.2)
+            with open(entry_file, "w") as f:
+                f.write("filled")
+
+
+def test_one_process_fills_the_entry(tmp_path):
+    lock_file = str(tmp_path / "entry.lock")
+    entry_file = str(tmp_path / "entry")
+    fills_file = str(tmp_path / "fills")
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=fill_entry, args=(lock_file, entry_file, fills_file))
+        for _ in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    assert len(Path(fills_file).read_text().split()) == 1
+
+
+def test_stale_lock_is_broken(tmp_path, monkeypatch):
+    # A lock whose holder stopped refreshing it (e.g. its host died while the
+    # flock is still held on NFS) is broken once it is older than
+    # STALE_LOCK_SECONDS
+    monkeypatch.setattr(singleflight, "STALE_LOCK_SECONDS", 1)
+    monkeypatch.setattr(singleflight, "POLL_SECONDS", 0.1)
+    lock_file = tmp_path / "entry.lock"
+    with open(lock_file, "a+") as held:
+        fcntl.flock(held, fcntl.LOCK_EX)
+        os.utime(lock_file, (time.time() - 10, time.time() - 10))
+        start = time.time()
+        with single_flight(str(lock_file)):
+            assert os.stat(lock_file).st_ino != os.fstat(held.fileno()).st_ino
+        assert time.time() - start < 5
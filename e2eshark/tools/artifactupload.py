@@ -0,0 +1,99 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+# Uploads test artifacts (e.g. the generated mlir of tests in the upload list)
+# to Azure Storage from the main run.py process. Test workers only put
+# (file, blob name, test name, delete after upload) requests on a queue, so a
+# worker moves on to its next test at once, while the uploader reuses a single
+# blob client (and its connection pool) for all uploads and runs a bounded
+# number of them in parallel. Large files are uploaded as blocks in parallel.
+#
+# The storage account comes from a connection string, so the uploader can be
+# pointed at a local emulator such as Azurite with
+# AZURE_CONNECTION_STRING="UseDevelopmentStorage=true".
+
+import os, threading
+from concurrent.futures import ThreadPoolExecutor
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import BlobServiceClient
+
+ARTIFACTS_CONTAINER = "e2esharkuserartifacts"
+# Files larger than this are split into blocks which are uploaded in parallel
+MAX_SINGLE_PUT_SIZE = 1024 * 1024 * 32  # 32 MiB
+BLOCK_SIZE = 1024 * 1024 * 8  # 8 MiB
+
+
+class ArtifactUploader:
+    # Threads are only started by start(), so create any process pool first.
+    def __init__(
+        self,
+        queue,
+        connection_string,
+        container_name=ARTIFACTS_CONTAINER,
+        jobs=4,
+        block_jobs=4,
+    ):
+        self.queue = queue
+        self.block_jobs = block_jobs
+        self.jobs = jobs
+        self.client = BlobServiceClient.from_connection_string(
+            connection_string,
+            max_single_put_size=MAX_SINGLE_PUT_SIZE,
+            max_block_size=BLOCK_SIZE,
+        )
+        self.container = self.client.get_container_client(container_name)
+        # test name -> urls of its uploaded artifacts
+        self.urls = {}
+        self.urls_lock = threading.Lock()
+        self.executor = None
+        self.dispatcher = None
+
+    def start(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.jobs)
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def dispatch(self):
+        # Hands queued requests to the upload threads until shutdown() puts None
+        while True:
+            request = self.queue.get()
+            if request is None:
+                return
+            self.executor.submit(self.upload, *request)
+
+    def upload(self, file_path, blob_name, testName, deleteAfter=False):
+        blob_client = self.container.get_blob_client(blob_name)
+        try:
+            with open(file_path, "rb") as data:
+                # overwrite=False fails if the blob exists, which saves a
+                # separate exists() request before every upload
+                blob_client.upload_blob(
+                    data, overwrite=False, max_concurrency=self.block_jobs
+                )
+        except ResourceExistsError:
+            print(f"model artifacts have already been uploaded for {blob_name}")
+            return
+        except Exception as e:
+            print(f"Unable to upload {file_path} to {blob_name}.\nError - {type(e).__name__}")
+            return
+        finally:
+            if deleteAfter and os.path.exists(file_path):
+                os.remove(file_path)
+        with self.urls_lock:
+            self.urls.setdefault(testName, []).append(blob_client.url)
+
+    def shutdown(self):
+        # Waits for all queued uploads and returns the urls of the uploaded
+        # artifacts of each test
+        if self.dispatcher is not None:
+            self.queue.put(None)
+            self.dispatcher.join()
+            self.dispatcher = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self.client.close()
+        return self.urls
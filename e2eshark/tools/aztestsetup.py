@@ -4,14 +4,28 @@
 # See https://llvm.org/LICENSE.txt for license information.
 # SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
 
-import os, sys, argparse, shutil, zipfile
+import os, sys, argparse, shutil, zipfile, threading, time, tempfile, hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from azure.storage.blob import ContainerClient
 from azure.core.exceptions import ResourceNotFoundError
 from pathlib import Path
 from zipfile import ZipFile
 
+# Allow running this file as a script as well as importing it from run.py
+sys.path.append(str(Path(__file__).parents[1]))
+from tools.modelcache import ModelCache
+from tools.modelstore import ModelStore, STORE_DIR
+from tools.singleflight import single_flight
+from tools.storagebackend import (
+    StorageBackend,
+    MirrorBackend,
+    select_backends,
+    set_new_file_mode,
+)
+
 PRIVATE_CONN_STRING = os.environ.get("AZ_PRIVATE_CONNECTION", default="")
 priv_container_name = "onnxprivatestorage"
+EXTRACT_CHUNK_SIZE = 1024 * 1024 * 8  # 8 MiB
 
 def getTestsListFromFile(testlistfile):
     testlist = []
@@ -41,7 +55,101 @@ def cleanup_e2eshark_test(testList, e2eshark_test_dir):
             os.remove(onnxmodelzip)
 
 
-def download_azure_blob(account_url, container_name, blob_name, dest_file):
+class BandwidthThrottle:
+    # Limits the combined rate of all threads writing downloaded chunks.
+    # Each call reserves a time slot proportional to its chunk size and sleeps
+    # until that slot has passed.
+    def __init__(self, bytes_per_sec):
+        self.bytes_per_sec = bytes_per_sec
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def consume(self, num_bytes):
+        with self.lock:
+            now = time.monotonic()
+            self.next_slot = max(now, self.next_slot) + num_bytes / self.bytes_per_sec
+            delay = self.next_slot - now
+        time.sleep(delay)
+
+
+def verify_download(properties, size, md5, dest_file):
+    # Compares what was received against the blob properties reported by azure
+    if properties.size is not None and size != properties.size:
+        raise IOError(
+            f"Downloaded {size} bytes for {dest_file}, expected {properties.size}"
+        )
+    content_settings = properties.content_settings
+    expected_md5 = content_settings.content_md5 if content_settings else None
+    if expected_md5 and bytes(expected_md5) != md5:
+        raise IOError(f"MD5 mismatch for downloaded {dest_file}")
+
+
+def write_download_stream(download_stream, dest_file, throttle=None):
+    # Streams the blob chunk by chunk into a temporary file next to dest_file,
+    # so only one chunk is held in memory at a time, checks its size and MD5
+    # and then renames it into place. An interrupted download never leaves a
+    # partial dest_file behind that would later look like a cache hit.
+    fd, temp_file = tempfile.mkstemp(
+        dir=os.path.dirname(dest_file) or ".",
+        prefix=os.path.basename(dest_file) + ".",
+        suffix=".part",
+    )
+    set_new_file_mode(fd)
+    md5 = hashlib.md5()
+    size = 0
+    try:
+        with os.fdopen(fd, mode="wb") as local_blob:
+            for chunk in download_stream.chunks():
+                if throttle is not None:
+                    throttle.consume(len(chunk))
+                local_blob.write(chunk)
+                md5.update(chunk)
+                size += len(chunk)
+            local_blob.flush()
+            os.fsync(local_blob.fileno())
+        verify_download(download_stream.properties, size, md5.digest(), dest_file)
+        os.replace(temp_file, dest_file)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    return blob_metadata(download_stream.properties)
+
+
+def blob_metadata(properties):
+    # The subset of azure BlobProperties recorded in the model cache manifest
+    content_settings = properties.content_settings
+    md5 = content_settings.content_md5 if content_settings else None
+    return {
+        "size": properties.size,
+        "etag": properties.etag,
+        "md5": bytes(md5).hex() if md5 else None,
+    }
+
+
+def get_azure_blob_metadata(account_url, container_name, blob_name):
+    # Returns the blob_metadata of a remote blob, or None if it can't be
+    # reached (e.g. when offline)
+    try:
+        if container_name == priv_container_name:
+            if PRIVATE_CONN_STRING == "":
+                return None
+            container_client = ContainerClient.from_connection_string(
+                conn_str=PRIVATE_CONN_STRING,
+                container_name=container_name,
+            )
+        else:
+            container_client = ContainerClient(account_url, container_name)
+        with container_client:
+            properties = container_client.get_blob_client(
+                blob_name
+            ).get_blob_properties()
+        return blob_metadata(properties)
+    except Exception:
+        return None
+
+
+def download_azure_blob(account_url, container_name, blob_name, dest_file, throttle=None):
     if container_name == priv_container_name:
         if PRIVATE_CONN_STRING == "":
             print("Please set AZ_PRIVATE_CONNECTION environment variable with connection string for private azure storage account")
@@ -52,8 +160,7 @@ def download_azure_blob(account_url, container_name, blob_name, dest_file):
                 download_stream = container_client.download_blob(
                     blob_name
                 )
-                with open(dest_file, mode="wb") as local_blob:
-                    local_blob.write(download_stream.readall())
+                return write_download_stream(download_stream, dest_file, throttle)
     else:
         with ContainerClient(
                 account_url,
@@ -64,58 +171,158 @@ def download_azure_blob(account_url, container_name, blob_name, dest_file):
                 download_stream = container_client.download_blob(
                         blob_name, max_concurrency=4
                     )
-                with open(dest_file, mode="wb") as local_blob:
-                    local_blob.write(download_stream.readall())
+                return write_download_stream(download_stream, dest_file, throttle)
 
 
-def download_and_setup_onnxmodels(cache_dir, testList):
-    # Utility to download specified models (zip files) to cache dir
-    # testList : expected to contain list of test names of the format `onnx/model/testName`
-    # Download failure should not stop tests running entirely.
-    # So downloads will be allowed to fail and corressponding
-    # tests will fail with No model.onnx file found error
+class AzureBlobBackend(StorageBackend):
+    name = "azure"
 
-    # Azure Storage Creds for Public Onnx Models
-    account_url = "https://onnxstorage.blob.core.windows.net"
-    container_name = "onnxstorage"
+    def __init__(self, account_url, container_name):
+        self.account_url = account_url
+        self.container_name = container_name
 
-    # Azure Storage Creds for Private Onnx Models - AZURE Login Required for access
-    priv_account_url = "https://onnxprivatestorage.blob.core.windows.net"
-    priv_container_name = "onnxprivatestorage"
+    def url(self, key):
+        return self.account_url + "/" + self.container_name + "/" + key
 
-    for model in testList:
-        blob_dir =  "e2eshark/" + model
-        blob_name = blob_dir + "/model.onnx.zip"
-        dest_file = cache_dir + "/" + blob_name
-        if os.path.exists(dest_file):
-            # model already in cache dir, skip download.
-            # TODO: skip model downloading based on some comparison / update flag
-            continue
-        if not os.path.exists(cache_dir):
-            print(f"ERROR : cache_dir path: {cache_dir}, does not exist!")
-            sys.exit(1)
-        if not os.path.isdir(cache_dir + "/" + blob_dir):
-            print(f"DIR not found creating new {blob_dir}")
-            os.makedirs(cache_dir + "/" + blob_dir, exist_ok=True)
+    def get_metadata(self, key):
+        return get_azure_blob_metadata(self.account_url, self.container_name, key)
 
-        # TODO: better organisation of models in tank and cache
-        print(
-            f"Begin download for {blob_name} to {dest_file}"
+    def download(self, key, dest_file, throttle=None):
+        return download_azure_blob(
+            self.account_url, self.container_name, key, dest_file, throttle
         )
 
-        try_private = False
+
+# Azure Storage for Public Onnx Models
+PUBLIC_ONNX_STORAGE = AzureBlobBackend(
+    "https://onnxstorage.blob.core.windows.net", "onnxstorage"
+)
+# Azure Storage for Private Onnx Models - AZURE Login Required for access
+PRIVATE_ONNX_STORAGE = AzureBlobBackend(
+    "https://onnxprivatestorage.blob.core.windows.net", priv_container_name
+)
+
+
+def onnxmodel_backends():
+    # The backends to try in order for onnx model zips, public storage first
+    return select_backends([PUBLIC_ONNX_STORAGE, PRIVATE_ONNX_STORAGE])
+
+
+def onnxmodel_blob_name(model):
+    # model : expected to be a test name of the format `onnx/model/testName`
+    return "e2eshark/" + model + "/model.onnx.zip"
+
+
+def download_and_setup_onnxmodel(
+    cache_dir, model, throttle=None, model_cache=None, revalidate=True, backends=None
+):
+    # Utility to download one model (zip file) to cache dir
+    # model : expected to be a test name of the format `onnx/model/testName`
+    # Returns "cached" if an up to date model zip was already in the cache dir,
+    # "downloaded" if it was downloaded and "failed" otherwise
+    if backends is None:
+        backends = onnxmodel_backends()
+    if model_cache is None:
+        model_cache = ModelCache(cache_dir)
+    blob_name = onnxmodel_blob_name(model)
+    blob_dir = os.path.dirname(blob_name)
+    dest_file = model_cache.path(blob_name)
+    remote = None
+    if revalidate and model_cache.contains(blob_name):
+        # model already in cache dir, check it against the remote blob if we
+        # can reach it, otherwise trust the cached copy
+        for backend in backends:
+            remote = backend.get_metadata(blob_name)
+            if remote is not None:
+                break
+    if not os.path.exists(cache_dir):
+        print(f"ERROR : cache_dir path: {cache_dir}, does not exist!")
+        sys.exit(1)
+    if not os.path.isdir(cache_dir + "/" + blob_dir):
+        print(f"DIR not found creating new {blob_dir}")
+        os.makedirs(cache_dir + "/" + blob_dir, exist_ok=True)
+
+    # Only one thread / process / host downloads the zip, the others wait for
+    # it and then find it in the cache. The lookup is under the lock too, so
+    # that it can't remove a zip that is being recorded.
+    with single_flight(dest_file + ".lock"):
+        if model_cache.lookup(blob_name, remote):
+            return "cached"
+        return download_onnxmodel(model, blob_name, dest_file, model_cache, backends, throttle)
+
+
+def download_onnxmodel(model, blob_name, dest_file, model_cache, backends, throttle):
+    # TODO: better organisation of models in tank and cache
+    print(
+        f"Begin download for {blob_name} to {dest_file}"
+    )
+
+    for backend in backends:
         try:
-            download_azure_blob(account_url, container_name, blob_name, dest_file)
+            metadata = backend.download(blob_name, dest_file, throttle)
+            break
         except Exception as e:
-            try_private = True
-            print(f"Unable to download model from public for {model}.\nError - {type(e).__name__}")
+            print(f"Unable to download model for {model} from {backend.url(blob_name)}.\nError - {type(e).__name__}")
+    else:
+        return "failed"
+    model_cache.record(blob_name, etag=metadata["etag"], md5=metadata["md5"])
+    return "downloaded"
 
-        if try_private:
-            print("Trying download from private storage")
-            try:
-                download_azure_blob(priv_account_url, priv_container_name, blob_name, dest_file)
-            except Exception as e:
-                print(f"Unable to download model for {model}.\nError - {type(e).__name__}")
+
+def sync_onnxmodels_mirror(mirror_dir, testList, throttle=None):
+    # Copies the model zips of testList from azure storage into mirror_dir,
+    # skipping the ones which are already up to date
+    counts = {"synced": 0, "uptodate": 0, "failed": 0}
+    for model in testList:
+        blob_name = onnxmodel_blob_name(model)
+        for remote in [PUBLIC_ONNX_STORAGE, PRIVATE_ONNX_STORAGE]:
+            result = MirrorBackend(mirror_dir, remote).sync(blob_name, throttle)
+            if result != "failed":
+                break
+        counts[result] += 1
+    print(
+        f"Mirror {mirror_dir}: {counts['synced']} synced, "
+        f"{counts['uptodate']} up to date, {counts['failed']} failed"
+    )
+    return counts["failed"] == 0
+
+
+def download_and_setup_onnxmodels(cache_dir, testList):
+    # Utility to download specified models (zip files) to cache dir
+    # testList : expected to contain list of test names of the format `onnx/model/testName`
+    # Download failure should not stop tests running entirely.
+    # So downloads will be allowed to fail and corressponding
+    # tests will fail with No model.onnx file found error
+    model_cache = ModelCache(cache_dir)
+    for model in testList:
+        download_and_setup_onnxmodel(cache_dir, model, model_cache=model_cache)
+
+
+def unzip_onnxmodel(test_name, cache_path, script_dir, model_store=None):
+    # Links the model.onnx of the test into the test dir from the extracted
+    # model store, first extracting it from the cached zip if the store doesn't
+    # have it or the zip has changed since it was extracted.
+    # Returns True if the model.onnx exists in the test dir afterwards
+    model_file_path_test = script_dir + '/' + test_name + '/model.onnx'
+    model_file_path_cache = cache_path + '/e2eshark/' + test_name + '/model.onnx.zip'
+    # model_file_path_cache may not exist for models which were not correctly
+    # downloaded or were set up locally, keep whatever is in the test dir then
+    if not os.path.exists(model_file_path_cache):
+        return os.path.exists(model_file_path_test)
+    if model_store is None:
+        model_store = ModelStore(os.path.join(cache_path, STORE_DIR))
+    files = model_store.lookup(test_name, model_file_path_cache)
+    if files is None:
+        with single_flight(model_store.index_path(test_name) + ".lock"):
+            files = model_store.lookup(test_name, model_file_path_cache)
+            if files is None:
+                print(f"Unzipping - {model_file_path_cache}")
+                # onnx/model/testname already present in the zip file structure
+                files = model_store.add_zip(
+                    test_name, model_file_path_cache, [test_name + '/model.onnx']
+                )
+    model_store.materialize(files, script_dir)
+    return os.path.exists(model_file_path_test)
 
 
 def pre_test_onnx_models_azure_download(testsList, cache_path, script_dir):
@@ -127,20 +334,93 @@ def pre_test_onnx_models_azure_download(testsList, cache_path, script_dir):
     model_tests_list = [test for test in testsList if 'models' in test]
     download_and_setup_onnxmodels(cache_path, model_tests_list)
 
-    # if the the model exists for the test in the test dir, do nothing.
-    # if it doesn't exist in the test directory but exists in cache dir, simply unzip cached model
     for test_name in model_tests_list:
-        model_file_path_test = script_dir + '/' + test_name + '/model.onnx'
-        model_file_path_cache = cache_path + '/e2eshark/' + test_name + '/model.onnx.zip'
-        if not os.path.exists(model_file_path_test):
-            print(f"Unzipping - {model_file_path_cache}")
-            # model_file_path_cache may not exist for models which were not correctly downloaded,
-            # skip unzipping such model files, only extract existing models
-            if os.path.exists(model_file_path_cache):
-                # Unzip the model in the model test dir
-                with ZipFile(model_file_path_cache, 'r') as zf:
-                    # onnx/model/testname already present in the zip file structure
-                    zf.extract(test_name + '/model.onnx', path=script_dir)
+        unzip_onnxmodel(test_name, cache_path, script_dir)
+
+
+class ModelPrefetcher:
+    # Downloads and unzips the models of onnx/models tests on a bounded pool of
+    # background threads so that tests can be scheduled as soon as their own
+    # model is in place instead of after the whole test list is downloaded.
+    # Threads are only started by submit(), so create any process pool first.
+    def __init__(
+        self,
+        cache_path,
+        script_dir,
+        jobs=4,
+        bandwidth_mib=None,
+        budget_gib=None,
+        revalidate=True,
+    ):
+        self.cache_path = cache_path
+        self.script_dir = script_dir
+        self.jobs = jobs
+        self.throttle = None
+        if bandwidth_mib:
+            self.throttle = BandwidthThrottle(bandwidth_mib * 1024 * 1024)
+        budget_bytes = None
+        if budget_gib:
+            budget_bytes = int(budget_gib * 1024 * 1024 * 1024)
+        self.model_cache = ModelCache(cache_path, budget_bytes)
+        self.model_store = ModelStore(os.path.join(cache_path, STORE_DIR))
+        self.revalidate = revalidate
+        self.executor = None
+        self.futures = {}
+
+    def submit(self, testsList):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.jobs)
+        for test_name in testsList:
+            if 'models' in test_name and test_name not in self.futures:
+                self.futures[test_name] = self.executor.submit(
+                    self.prefetch, test_name
+                )
+
+    def prefetch(self, test_name):
+        # Returns the [status, time] entry for the download phase of the test
+        start = time.time()
+        try:
+            model_file_path_test = self.script_dir + '/' + test_name + '/model.onnx'
+            extracted = os.path.exists(model_file_path_test)
+            # an extracted model without a cached zip can't be revalidated
+            if not extracted or self.model_cache.contains(onnxmodel_blob_name(test_name)):
+                download_and_setup_onnxmodel(
+                    self.cache_path,
+                    test_name,
+                    self.throttle,
+                    self.model_cache,
+                    self.revalidate,
+                )
+            unzipped = unzip_onnxmodel(
+                test_name, self.cache_path, self.script_dir, self.model_store
+            )
+            status = "passed" if unzipped else "failed"
+        except Exception as e:
+            print(f"Unable to set up model for {test_name}.\nError - {type(e).__name__}")
+            status = "failed"
+        return [status, time.time() - start]
+
+    def ready(self, testsList):
+        # Yields (test, download phase status) for each test in testsList, tests
+        # which need no download first and the rest as their models become ready
+        pending = {}
+        for test_name in testsList:
+            if test_name in self.futures:
+                pending[self.futures[test_name]] = test_name
+            else:
+                yield test_name, ["notrun", 0.0]
+        for future in as_completed(pending):
+            yield pending[future], future.result()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.model_cache.budget_bytes is not None:
+            # drop extracted models whose zips were evicted from the cache
+            freed = self.model_store.prune()
+            if freed:
+                print(f"Pruned {freed / (1024 * 1024):.1f} MiB of extracted models")
 
 
 def setup_e2eshark_test(modelpy, testList, sourcedir, model_root_dir):
@@ -237,6 +517,11 @@ if __name__ == "__main__":
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "--sync-mirror",
+        help="Copy the model zips of the test(s) from Azure Storage into the given mirror directory. "
+        "Point SHARK_MIRROR_DIR at it to run tests without network access",
+    )
     account_url = "https://onnxstorage.blob.core.windows.net"
     container_name = "onnxstorage"
     azure_storage_url = account_url + "/" + container_name
@@ -289,3 +574,7 @@ if __name__ == "__main__":
             sys.exit(1)
 
         download_and_setup_onnxmodels(cachedir, testList)
+
+    if args.sync_mirror:
+        if not sync_onnxmodels_mirror(args.sync_mirror, testList):
+            sys.exit(1)
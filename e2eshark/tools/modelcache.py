@@ -0,0 +1,132 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+# Managed cache of downloaded model files. Every file in the cache has an entry
+# in a json manifest at the root of the cache directory recording its size, the
+# ETag / MD5 of the remote blob it was downloaded from and when it was last
+# used. Entries can be revalidated against remote metadata, and the least
+# recently used entries are evicted when the cache grows past a size budget.
+# Files are expected to be written with a temporary file followed by a rename
+# (see write_download_stream in aztestsetup.py) so that an interrupted download
+# is never recorded.
+
+import os, json, time, threading, fcntl, tempfile
+from contextlib import contextmanager
+
+MANIFEST_NAME = "cache_manifest.json"
+
+
+def same_remote(entry, remote):
+    # Compares a manifest entry with remote metadata using the strongest
+    # identifier both of them have
+    if entry.get("md5") and remote.get("md5"):
+        return entry["md5"] == remote["md5"]
+    if entry.get("etag") and remote.get("etag"):
+        return entry["etag"] == remote["etag"]
+    if remote.get("size") is not None:
+        return entry["size"] == remote["size"]
+    return True
+
+
+class ModelCache:
+    def __init__(self, cache_dir, budget_bytes=None):
+        self.cache_dir = cache_dir
+        self.budget_bytes = budget_bytes
+        self.manifest_file = os.path.join(cache_dir, MANIFEST_NAME)
+        self.lock_file = self.manifest_file + ".lock"
+        self.thread_lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    @contextmanager
+    def locked_manifest(self):
+        # Yields the manifest dict while holding both a thread lock and an
+        # advisory file lock, since the cache directory can be shared between
+        # processes. The manifest is written back atomically on exit.
+        with self.thread_lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self.lock_file, "w") as lockf:
+                fcntl.flock(lockf, fcntl.LOCK_EX)
+                try:
+                    manifest = self.load_manifest()
+                    yield manifest
+                    self.save_manifest(manifest)
+                finally:
+                    fcntl.flock(lockf, fcntl.LOCK_UN)
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_file):
+            return {}
+        try:
+            with open(self.manifest_file, "r") as f:
+                return json.load(f)
+        except ValueError:
+            print(f"WARNING: ignoring corrupt cache manifest {self.manifest_file}")
+            return {}
+
+    def save_manifest(self, manifest):
+        fd, temp_file = tempfile.mkstemp(
+            dir=self.cache_dir, prefix=MANIFEST_NAME + ".", suffix=".part"
+        )
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(temp_file, self.manifest_file)
+
+    def contains(self, key):
+        return os.path.exists(self.path(key))
+
+    def lookup(self, key, remote=None):
+        # Returns True if key is in the cache and, when remote metadata is
+        # given, still matches it. Stale or damaged entries are removed.
+        # Files without a manifest entry (e.g. from older runs) are adopted.
+        cached_file = self.path(key)
+        with self.locked_manifest() as manifest:
+            entry = manifest.get(key)
+            if not os.path.exists(cached_file):
+                manifest.pop(key, None)
+                return False
+            size = os.path.getsize(cached_file)
+            if entry is None:
+                entry = {"size": size, "etag": None, "md5": None}
+            if entry["size"] != size or (
+                remote is not None and not same_remote(entry, remote)
+            ):
+                print(f"Cached {key} is out of date, removing it")
+                os.remove(cached_file)
+                manifest.pop(key, None)
+                return False
+            entry["last_access"] = time.time()
+            manifest[key] = entry
+            return True
+
+    def record(self, key, etag=None, md5=None):
+        # Adds a freshly written file to the manifest and enforces the budget
+        with self.locked_manifest() as manifest:
+            manifest[key] = {
+                "size": os.path.getsize(self.path(key)),
+                "etag": etag,
+                "md5": md5,
+                "last_access": time.time(),
+            }
+            self.evict(manifest, keep=[key])
+
+    def evict(self, manifest, keep=()):
+        # Removes least recently used entries until the cache fits the budget
+        if self.budget_bytes is None:
+            return
+        total = sum(entry["size"] for entry in manifest.values())
+        candidates = sorted(
+            (key for key in manifest if key not in keep),
+            key=lambda key: manifest[key].get("last_access", 0),
+        )
+        for key in candidates:
+            if total <= self.budget_bytes:
+                break
+            print(f"Evicting {key} from model cache")
+            if os.path.exists(self.path(key)):
+                os.remove(self.path(key))
+            total -= manifest.pop(key)["size"]
@@ -0,0 +1,211 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+# Content addressed store of extracted model files. Each unique file is
+# decompressed once into objects/<sha256[:2]>/<sha256> and is then linked
+# (reflink, else hardlink, else symlink) into every test dir and run dir that
+# needs it. index/<name>.json maps a model name to the files extracted from its
+# zip, together with the size and mtime of that zip, so that finding the files
+# of a model is a single lookup and a re-downloaded zip invalidates the entry.
+#
+# Objects are read-only and shared: never write to a linked model in place,
+# write a new file and os.replace it over the link instead.
+#
+# The layout is shared with alt_e2eshark/e2e_testing/model_store.py so both
+# test suites can use the same store when they share a cache directory.
+
+import os, sys, json, hashlib, tempfile, threading, fcntl, errno, time
+from zipfile import ZipFile
+
+STORE_DIR = "extracted"
+COPY_CHUNK_SIZE = 1024 * 1024 * 8  # 8 MiB
+# ioctl from linux/fs.h, makes a copy on write clone of a file (btrfs, xfs)
+FICLONE = 0x40049409
+# Objects added this recently are never pruned: they may belong to a zip which
+# another process is still extracting and hasn't indexed yet
+PRUNE_GRACE_SECONDS = 60 * 60
+
+
+def temp_file_next_to(dest_file):
+    dest_dir = os.path.dirname(dest_file)
+    os.makedirs(dest_dir, exist_ok=True)
+    return tempfile.mkstemp(
+        dir=dest_dir, prefix=os.path.basename(dest_file) + ".", suffix=".part"
+    )
+
+
+def reflink_file(src, dest):
+    # Returns False if the filesystem doesn't support reflinks
+    if not sys.platform.startswith("linux"):
+        return False
+    fd, temp_file = temp_file_next_to(dest)
+    try:
+        with open(src, "rb") as srcf, os.fdopen(fd, "wb") as destf:
+            fcntl.ioctl(destf.fileno(), FICLONE, srcf.fileno())
+        os.replace(temp_file, dest)
+        return True
+    except OSError as e:
+        os.remove(temp_file)
+        if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL):
+            return False
+        raise
+
+
+def link_file(src, dest):
+    # Makes dest refer to the contents of src without copying them. Prefers a
+    # copy on write reflink, which can't be used to modify src, then a
+    # hardlink, then a symlink. Returns the kind of link which was made.
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        return "existing"
+    if reflink_file(src, dest):
+        return "reflink"
+    temp_file = f"{dest}.{os.getpid()}.{threading.get_ident()}.link"
+    try:
+        os.link(src, temp_file)
+        kind = "hardlink"
+    except OSError:
+        os.symlink(os.path.abspath(src), temp_file)
+        kind = "symlink"
+    os.replace(temp_file, dest)
+    return kind
+
+
+def touch_object(object_file):
+    # Marks an existing object as just added, so prune leaves it alone until
+    # the zip reusing it is indexed. Another user's objects in a shared store
+    # can't be touched, and are only kept by their index entries and links
+    try:
+        os.utime(object_file)
+    except OSError:
+        pass
+
+
+def source_stamp(zip_file):
+    stat = os.stat(zip_file)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class ModelStore:
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.objects_dir = os.path.join(store_dir, "objects")
+        self.index_dir = os.path.join(store_dir, "index")
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def index_path(self, name):
+        return os.path.join(self.index_dir, name + ".json")
+
+    def lookup(self, name, zip_file):
+        # Returns {relative path: object path} for the files extracted from
+        # zip_file for name, or None if they aren't in the store or the zip
+        # has changed since they were extracted
+        index_file = self.index_path(name)
+        try:
+            with open(index_file, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(zip_file) or entry["source"] != source_stamp(zip_file):
+            return None
+        files = {}
+        for relpath, digest in entry["files"].items():
+            files[relpath] = self.object_path(digest)
+            if not os.path.exists(files[relpath]):
+                return None
+        return files
+
+    def add_object(self, src):
+        # Copies the file object src into the store, hashing it on the way,
+        # and returns its digest. Identical files are only stored once.
+        fd, temp_file = temp_file_next_to(os.path.join(self.objects_dir, "new"))
+        sha = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as dest:
+                while True:
+                    chunk = src.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha.update(chunk)
+                    dest.write(chunk)
+            digest = sha.hexdigest()
+            object_file = self.object_path(digest)
+            if os.path.exists(object_file):
+                os.remove(temp_file)
+                touch_object(object_file)
+            else:
+                os.chmod(temp_file, 0o444)
+                os.makedirs(os.path.dirname(object_file), exist_ok=True)
+                os.replace(temp_file, object_file)
+            return digest
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+    def add_zip(self, name, zip_file, members=None):
+        # Extracts members (default: every file) of zip_file into the store,
+        # records them in the index under name and returns them as in lookup
+        stamp = source_stamp(zip_file)
+        digests = {}
+        with ZipFile(zip_file, "r") as zf:
+            for info in zf.infolist():
+                if info.is_dir() or (members is not None and info.filename not in members):
+                    continue
+                if os.path.isabs(info.filename) or ".." in info.filename.split("/"):
+                    raise ValueError(f"Refusing to extract {info.filename} from {zip_file}")
+                with zf.open(info) as src:
+                    digests[info.filename] = self.add_object(src)
+        fd, temp_file = temp_file_next_to(self.index_path(name))
+        with os.fdopen(fd, "w") as f:
+            json.dump({"zip": os.path.abspath(zip_file), "source": stamp, "files": digests}, f, indent=1)
+        os.replace(temp_file, self.index_path(name))
+        return {relpath: self.object_path(digest) for relpath, digest in digests.items()}
+
+    def materialize(self, files, dest_dir):
+        # Links the files returned by lookup or add_zip into dest_dir
+        for relpath, object_file in files.items():
+            link_file(object_file, os.path.join(dest_dir, relpath))
+
+    def prune(self):
+        # Removes objects which aren't hardlinked anywhere else and whose
+        # zip is no longer cached (e.g. it was evicted), returns bytes freed.
+        # Objects added in the last PRUNE_GRACE_SECONDS are kept, since the
+        # zip they were extracted from may not be indexed yet. Symlinks to
+        # removed objects will dangle.
+        referenced = set()
+        for root, dirs, filenames in os.walk(self.index_dir):
+            for filename in filenames:
+                if not filename.endswith(".json"):
+                    # e.g. the lock files of single_flight
+                    continue
+                try:
+                    with open(os.path.join(root, filename), "r") as f:
+                        entry = json.load(f)
+                    if entry["source"] == source_stamp(entry["zip"]):
+                        referenced.update(entry["files"].values())
+                except (OSError, ValueError, KeyError):
+                    continue
+        freed = 0
+        for root, dirs, filenames in os.walk(self.objects_dir):
+            for digest in filenames:
+                object_file = os.path.join(root, digest)
+                try:
+                    stat = os.stat(object_file)
+                    if (
+                        digest in referenced
+                        or digest.endswith(".part")
+                        or stat.st_nlink > 1
+                        or time.time() - stat.st_mtime < PRUNE_GRACE_SECONDS
+                    ):
+                        continue
+                    os.remove(object_file)
+                except FileNotFoundError:
+                    # pruned by another process
+                    continue
+                freed += stat.st_size
+        return freed
@@ -0,0 +1,149 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+# Sampling profiler for the test harness itself (run.py and _run_helper.py).
+# Child tools launched through os.system are not profiled. Samples taken while
+# a child tool is running are tagged with TOOL_FRAME so that they can be
+# separated from time spent in our own python code.
+
+import os, sys, threading, time
+from collections import Counter
+
+SAMPLE_INTERVAL = 0.005  # seconds
+# Samples are weighted by the time elapsed since the previous sample, in units
+# of SAMPLE_UNIT seconds, since the sampler thread may be delayed by the GIL
+SAMPLE_UNIT = 0.001
+TOOL_FRAME = "[tool]"
+HARNESS_PROFILE_FILE = "harness.collapsed"
+
+
+class HarnessSampler:
+    # Periodically walks the python stack of the thread that called start() and
+    # counts identical stacks. Stacks whose innermost frame is one of
+    # toolfunctions are treated as waiting on a child tool.
+    def __init__(self, toolfunctions=(), interval=SAMPLE_INTERVAL):
+        self.toolfunctions = set(toolfunctions)
+        self.interval = interval
+        self.stacks = Counter()
+        self._target = None
+        self._thread = None
+        self._stopevent = threading.Event()
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._stopevent.clear()
+        self._thread = threading.Thread(target=self._sampleLoop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopevent.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _sampleLoop(self):
+        last = time.time()
+        while not self._stopevent.wait(self.interval):
+            now = time.time()
+            weight = max(1, round((now - last) / SAMPLE_UNIT))
+            last = now
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            self.stacks[self._collapse(frame)] += weight
+
+    def _collapse(self, frame):
+        istool = frame.f_code.co_name in self.toolfunctions
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(
+                f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            )
+            frame = frame.f_back
+        names.reverse()
+        if istool:
+            names.append(TOOL_FRAME)
+        return ";".join(names)
+
+    def write(self, filename):
+        writeCollapsed(self.stacks, filename)
+
+
+def writeCollapsed(stacks, filename):
+    # One "frame;frame;...;frame count" line per unique stack, the format
+    # consumed by flamegraph.pl, speedscope and inferno
+    with open(filename, "w") as f:
+        for stack, count in sorted(stacks.items()):
+            print(f"{stack} {count}", file=f)
+
+
+def readCollapsed(filename):
+    stacks = Counter()
+    if not os.path.exists(filename):
+        return stacks
+    with open(filename, "r") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            stack, _, count = line.rpartition(" ")
+            stacks[stack] += int(count)
+    return stacks
+
+
+def splitSamples(stacks):
+    # Returns (harness samples, tool samples)
+    tool = sum(c for s, c in stacks.items() if s.endswith(";" + TOOL_FRAME))
+    return sum(stacks.values()) - tool, tool
+
+
+def runProfiled(func, arg, filename, toolfunctions=()):
+    # Runs func(arg) under a HarnessSampler and writes the collapsed stacks
+    # to filename, even if func raises
+    sampler = HarnessSampler(toolfunctions)
+    sampler.start()
+    try:
+        return func(arg)
+    finally:
+        sampler.stop()
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        sampler.write(filename)
+
+
+def mergeHarnessProfiles(profilefiles, outfile):
+    # Merges per test collapsed stack files into outfile and returns rows of
+    # [name, sampled seconds, harness seconds, harness percentage]
+    merged = Counter()
+    rows = []
+    for name, filename in profilefiles:
+        stacks = readCollapsed(filename)
+        if not stacks:
+            continue
+        merged.update(stacks)
+        harness, tool = splitSamples(stacks)
+        total = harness + tool
+        rows += [
+            [
+                name,
+                f"{total * SAMPLE_UNIT:.3f}",
+                f"{harness * SAMPLE_UNIT:.3f}",
+                f"{100.0 * harness / total:.1f}",
+            ]
+        ]
+    writeCollapsed(merged, outfile)
+    harness, tool = splitSamples(merged)
+    total = harness + tool
+    if total > 0:
+        rows += [
+            [
+                "total",
+                f"{total * SAMPLE_UNIT:.3f}",
+                f"{harness * SAMPLE_UNIT:.3f}",
+                f"{100.0 * harness / total:.1f}",
+            ]
+        ]
+    return rows
@@ -0,0 +1,125 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+# Single flight locking for filling a shared cache. When several threads,
+# processes or hosts (e.g. CI jobs sharing an NFS cache) need the same cache
+# entry, the first one to take the lock fills it while the others wait, then
+# find the entry already there. Callers must check the cache again after
+# taking the lock:
+#
+#   with single_flight(dest_file + ".lock"):
+#       if not up_to_date(dest_file):
+#           download(dest_file)
+#
+# The lock is an flock on a lock file next to the entry, which the kernel
+# drops if the holder dies. For a host that dies while holding a lock on NFS,
+# the holder refreshes the mtime of the lock file while it runs, and a lock
+# file which hasn't been refreshed for STALE_LOCK_SECONDS is broken.
+#
+# This is the lock of all the suites: alt_e2eshark/e2e_testing/single_flight.py
+# re-exports it and iree_tests/download_remote_files.py imports it, so the
+# suites can share a cache or mirror.
+
+import os, json, time, socket, threading, fcntl
+from contextlib import contextmanager
+
+HEARTBEAT_SECONDS = 30
+STALE_LOCK_SECONDS = 300
+POLL_SECONDS = 1
+
+# flock doesn't exclude threads of one process on every filesystem, so
+# threads also take a per lock file thread lock
+thread_locks = {}
+thread_locks_lock = threading.Lock()
+
+
+def thread_lock_for(lock_file):
+    with thread_locks_lock:
+        return thread_locks.setdefault(os.path.abspath(lock_file), threading.Lock())
+
+
+def lock_owner(lock_file):
+    try:
+        with open(lock_file, "r") as f:
+            owner = json.load(f)
+        return f"{owner['host']} (pid {owner['pid']})"
+    except (OSError, ValueError, KeyError):
+        return "another process"
+
+
+def break_if_stale(lock_file, lockf):
+    # Removes lock_file if it is the file we opened and hasn't been refreshed
+    # by its holder recently. Returns True if it was removed.
+    try:
+        stat = os.stat(lock_file)
+    except FileNotFoundError:
+        return True
+    if stat.st_ino != os.fstat(lockf.fileno()).st_ino:
+        # someone else already replaced it
+        return True
+    if time.time() - stat.st_mtime < STALE_LOCK_SECONDS:
+        return False
+    print(f"Breaking stale lock {lock_file} held by {lock_owner(lock_file)}")
+    try:
+        os.remove(lock_file)
+    except FileNotFoundError:
+        pass
+    return True
+
+
+def heartbeat(lock_file, stop):
+    while not stop.wait(HEARTBEAT_SECONDS):
+        try:
+            os.utime(lock_file)
+        except OSError:
+            return
+
+
+@contextmanager
+def single_flight(lock_file):
+    # Holds an exclusive lock on lock_file for the duration of the with block
+    os.makedirs(os.path.dirname(lock_file) or ".", exist_ok=True)
+    with thread_lock_for(lock_file):
+        waiting = False
+        while True:
+            lockf = open(lock_file, "a+")
+            try:
+                fcntl.flock(lockf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if not waiting:
+                    print(f"Waiting for {lock_owner(lock_file)} to finish with {lock_file}")
+                    waiting = True
+                broken = break_if_stale(lock_file, lockf)
+                lockf.close()
+                if not broken:
+                    time.sleep(POLL_SECONDS)
+                continue
+            try:
+                same_file = os.stat(lock_file).st_ino == os.fstat(lockf.fileno()).st_ino
+            except FileNotFoundError:
+                same_file = False
+            if same_file:
+                break
+            # the file was removed as stale after we opened it, start over
+            lockf.close()
+
+        stop = threading.Event()
+        try:
+            lockf.seek(0)
+            lockf.truncate()
+            json.dump(
+                {"host": socket.gethostname(), "pid": os.getpid(), "time": time.time()},
+                lockf,
+            )
+            lockf.flush()
+            threading.Thread(
+                target=heartbeat, args=(lock_file, stop), daemon=True
+            ).start()
+            yield
+        finally:
+            stop.set()
+            fcntl.flock(lockf, fcntl.LOCK_UN)
+            lockf.close()
@@ -0,0 +1,261 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+# Storage backends that model downloads go through. A backend names files by
+# key (e.g. an azure blob name) and provides get_metadata(key), returning a
+# {"size", "etag", "md5"} dict or None if the file can't be reached, and
+# download(key, dest_file, throttle) which writes the file atomically and
+# returns its metadata. The azure backend lives in aztestsetup.py.
+# iree_tests and turbine_tank also resolve their downloads through
+# select_backends, with the http and Hugging Face backends below.
+#
+# A mirror is a local (or NFS) directory laid out by remote url:
+#   <mirror>/<host>/<path of the url>
+# with a <file>.meta.json next to each file holding the remote metadata it
+# was synced from. The same layout is used by alt_e2eshark and
+# iree_tests/download_remote_files.py so one mirror can serve all of them.
+#
+# Backend selection is controlled by environment variables, so it is
+# inherited by test processes:
+#   SHARK_MIRROR_DIR       the mirror directory
+#   SHARK_STORAGE_BACKEND  "remote", "mirror" (default if SHARK_MIRROR_DIR is
+#                          set, never touches the network) or "mirror-first"
+
+import os, json, base64, hashlib, tempfile
+import urllib.request
+from urllib.parse import urlparse
+from tools.singleflight import single_flight
+
+MIRROR_DIR_ENV = "SHARK_MIRROR_DIR"
+BACKEND_ENV = "SHARK_STORAGE_BACKEND"
+METADATA_SUFFIX = ".meta.json"
+COPY_CHUNK_SIZE = 1024 * 1024 * 8  # 8 MiB
+# Read once at import, before any download threads start: reading the umask
+# means setting it, which would race with files created by other threads
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+
+
+def mirror_path(mirror_dir, url):
+    parsed = urlparse(url)
+    return os.path.join(mirror_dir, parsed.netloc, parsed.path.lstrip("/"))
+
+
+def set_new_file_mode(fd):
+    # mkstemp creates files only their owner can read. Give a temporary file
+    # that will be renamed into place the mode of a newly created file, so
+    # shared caches and mirrors stay readable by other users
+    os.fchmod(fd, 0o666 & ~UMASK)
+
+
+def copy_stream(chunks, dest_file, expected=None, throttle=None):
+    # Writes an iterable of byte chunks to a temporary file next to dest_file,
+    # checks it against the expected metadata and renames it into place.
+    # Returns the metadata of what was written.
+    os.makedirs(os.path.dirname(dest_file) or ".", exist_ok=True)
+    fd, temp_file = tempfile.mkstemp(
+        dir=os.path.dirname(dest_file) or ".",
+        prefix=os.path.basename(dest_file) + ".",
+        suffix=".part",
+    )
+    set_new_file_mode(fd)
+    md5 = hashlib.md5()
+    size = 0
+    try:
+        with os.fdopen(fd, mode="wb") as f:
+            for chunk in chunks:
+                if throttle is not None:
+                    throttle.consume(len(chunk))
+                f.write(chunk)
+                md5.update(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        expected = expected or {}
+        if expected.get("size") is not None and size != expected["size"]:
+            raise IOError(
+                f"Received {size} bytes for {dest_file}, expected {expected['size']}"
+            )
+        if expected.get("md5") and expected["md5"] != md5.hexdigest():
+            raise IOError(f"MD5 mismatch for {dest_file}")
+        os.replace(temp_file, dest_file)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    return {"size": size, "etag": expected.get("etag"), "md5": md5.hexdigest()}
+
+
+def read_chunks(f, chunk_size=COPY_CHUNK_SIZE):
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+class StorageBackend:
+    name = "base"
+
+    def url(self, key):
+        raise NotImplementedError
+
+    def get_metadata(self, key):
+        raise NotImplementedError
+
+    def download(self, key, dest_file, throttle=None):
+        raise NotImplementedError
+
+
+class HttpBackend(StorageBackend):
+    # Plain http(s) server, e.g. a web server in front of a mirror directory
+    name = "http"
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def url(self, key):
+        return self.base_url + "/" + key
+
+    def headers(self):
+        return {}
+
+    def get_metadata(self, key):
+        request = urllib.request.Request(
+            self.url(key), headers=self.headers(), method="HEAD"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                headers = response.headers
+        except OSError:
+            return None
+        content_md5 = headers.get("Content-MD5")
+        size = headers.get("Content-Length")
+        return {
+            "size": int(size) if size is not None else None,
+            "etag": headers.get("ETag"),
+            "md5": base64.b64decode(content_md5).hex() if content_md5 else None,
+        }
+
+    def download(self, key, dest_file, throttle=None):
+        expected = self.get_metadata(key)
+        request = urllib.request.Request(self.url(key), headers=self.headers())
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return copy_stream(read_chunks(response), dest_file, expected, throttle)
+
+
+class HfBackend(HttpBackend):
+    # A Hugging Face model repository, with files keyed by their path in the
+    # repository. Files are served from the resolve urls of the hub, so they
+    # are mirrored in <mirror>/huggingface.co/<repo id>/resolve/<revision>,
+    # the layout of a snapshot_download(local_dir=...) of the repository.
+    name = "huggingface"
+
+    def __init__(self, repo_id, revision="main", endpoint="https://huggingface.co"):
+        super().__init__(f"{endpoint}/{repo_id}/resolve/{revision}")
+        self.repo_id = repo_id
+        self.revision = revision
+
+    def headers(self):
+        # huggingface_hub is only needed for Hugging Face files. Its headers
+        # carry the token of a logged in user, for gated models
+        from huggingface_hub.utils import build_hf_headers
+
+        return build_hf_headers()
+
+    def get_metadata(self, key):
+        # The hub redirects large files to a CDN, so use huggingface_hub to
+        # get the size and etag of the file rather than of the redirect
+        from huggingface_hub import get_hf_file_metadata
+
+        try:
+            metadata = get_hf_file_metadata(self.url(key))
+        except Exception:
+            # connection errors of the http client of huggingface_hub aren't
+            # OSErrors
+            return None
+        return {"size": metadata.size, "etag": metadata.etag, "md5": None}
+
+
+class MirrorBackend(StorageBackend):
+    # Serves the files of a remote backend from a mirror directory
+    name = "mirror"
+
+    def __init__(self, mirror_dir, remote):
+        self.mirror_dir = mirror_dir
+        self.remote = remote
+
+    def url(self, key):
+        return self.remote.url(key)
+
+    def path(self, key):
+        return mirror_path(self.mirror_dir, self.url(key))
+
+    def get_metadata(self, key):
+        mirrored_file = self.path(key)
+        if not os.path.exists(mirrored_file):
+            return None
+        size = os.path.getsize(mirrored_file)
+        try:
+            with open(mirrored_file + METADATA_SUFFIX, "r") as f:
+                metadata = json.load(f)
+            if metadata.get("size") == size:
+                return metadata
+        except (OSError, ValueError):
+            pass
+        return {"size": size, "etag": None, "md5": None}
+
+    def download(self, key, dest_file, throttle=None):
+        expected = self.get_metadata(key)
+        if expected is None:
+            raise FileNotFoundError(f"{self.url(key)} is not in mirror {self.mirror_dir}")
+        with open(self.path(key), "rb") as f:
+            return copy_stream(read_chunks(f), dest_file, expected, throttle)
+
+    def sync(self, key, throttle=None):
+        # Copies key from the remote backend into the mirror unless the mirror
+        # already has the same version. Returns "synced", "uptodate" or "failed".
+        remote_metadata = self.remote.get_metadata(key)
+        if remote_metadata is None:
+            print(f"Unable to reach {self.url(key)}")
+            return "failed"
+        # several hosts may sync the same (shared) mirror at once
+        with single_flight(self.path(key) + ".lock"):
+            return self.sync_locked(key, remote_metadata, throttle)
+
+    def sync_locked(self, key, remote_metadata, throttle):
+        mirrored = self.get_metadata(key)
+        if mirrored is not None and (
+            (mirrored["md5"] and mirrored["md5"] == remote_metadata["md5"])
+            or (mirrored["etag"] and mirrored["etag"] == remote_metadata["etag"])
+        ):
+            return "uptodate"
+        print(f"Mirroring {self.url(key)}")
+        try:
+            metadata = self.remote.download(key, self.path(key), throttle)
+        except Exception as e:
+            print(f"Unable to mirror {self.url(key)}.\nError - {type(e).__name__}")
+            return "failed"
+        with open(self.path(key) + METADATA_SUFFIX, "w") as f:
+            json.dump(metadata, f, indent=1)
+        return "synced"
+
+
+def select_backends(remotes):
+    # Returns the backends to try in order for files of the given remote
+    # backends, according to SHARK_MIRROR_DIR and SHARK_STORAGE_BACKEND
+    mirror_dir = os.environ.get(MIRROR_DIR_ENV, "")
+    mode = os.environ.get(BACKEND_ENV, "mirror" if mirror_dir else "remote")
+    if mode == "remote":
+        return list(remotes)
+    if not mirror_dir:
+        raise ValueError(f"{BACKEND_ENV}={mode} requires {MIRROR_DIR_ENV} to be set")
+    mirrors = [MirrorBackend(mirror_dir, remote) for remote in remotes]
+    if mode == "mirror":
+        return mirrors
+    if mode == "mirror-first":
+        return mirrors + list(remotes)
+    raise ValueError(f"Unknown {BACKEND_ENV} '{mode}'")
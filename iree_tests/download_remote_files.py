@@ -4,23 +4,62 @@
 # See https://llvm.org/LICENSE.txt for license information.
 # SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
 
+from azure.core import MatchConditions
 from azure.storage.blob import BlobClient, BlobProperties
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from huggingface_hub import hf_hub_download
+from huggingface_hub import (
+    get_hf_file_metadata,
+    hf_hub_download,
+    hf_hub_url,
+    try_to_load_from_cache,
+)
+from huggingface_hub.constants import HF_HUB_CACHE
 from multiprocessing import Pool
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse
 import argparse
 import hashlib
+import json
 import logging
 import mmap
 import os
 import pyjson5
 import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
 
 REPO_ROOT = Path(__file__).parent.parent
 logger = logging.getLogger(__name__)
 
+# Files are looked up in the storage backends of e2eshark, selected by
+# SHARK_MIRROR_DIR and SHARK_STORAGE_BACKEND ("remote", "mirror" or
+# "mirror-first"). A mirror directory holds copies of remote files laid out as
+# <mirror>/<host>/<url path>, shared with e2eshark and alt_e2eshark.
+sys.path.append(str(REPO_ROOT / "e2eshark"))
+from tools.storagebackend import (
+    BACKEND_ENV,
+    MIRROR_DIR_ENV,
+    HfBackend,
+    HttpBackend,
+    MirrorBackend,
+    StorageBackend,
+    select_backends,
+    set_new_file_mode,
+)
+from tools.singleflight import single_flight
+
+# Large files are downloaded as byte ranges of this size, several at a time,
+# with the completed ranges persisted so that a failed download resumes.
+RANGE_SIZE = 1024 * 1024 * 64  # 64 MiB
+RANGE_RETRIES = 4
+READ_CHUNK_SIZE = 1024 * 1024 * 8  # 8 MiB
+
 
 def human_readable_size(size, decimal_places=2):
     for unit in ["B", "KiB", "MiB", "GiB", "TiB", "PiB"]:
@@ -68,22 +107,207 @@ def get_azure_md5(remote_file: str, azure_blob_properties: BlobProperties):
     return azure_md5
 
 
+def get_hash_sidecar_path(file_path: Path) -> Path:
+    """Gets the path of the file caching the MD5 hash of file_path."""
+    return file_path.parent / f".{file_path.name}.md5.json"
+
+
+def get_hash_key(stat: os.stat_result) -> dict:
+    """The file attributes a cached hash is valid for."""
+    return {"inode": stat.st_ino, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def write_json_file(file_path: Path, data: dict):
+    """Writes data to file_path, replacing it atomically."""
+    fd, temp_file = tempfile.mkstemp(
+        dir=file_path.parent, prefix=file_path.name + ".", suffix=".part"
+    )
+    set_new_file_mode(fd)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_file, file_path)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+
+def write_hash_sidecar(file_path: Path, md5: bytes):
+    """Caches the MD5 hash of file_path, if its directory is writeable."""
+    try:
+        write_json_file(
+            get_hash_sidecar_path(file_path),
+            {**get_hash_key(file_path.stat()), "md5": md5.hex()},
+        )
+    except OSError as e:
+        logger.debug(f"  Unable to cache the MD5 hash of '{file_path}': {e}")
+
+
 def get_local_md5(local_file_path: Path):
-    """Gets the content_md5 hash for a lolca file, if it exists."""
+    """
+    Gets the content_md5 hash for a local file, if it exists.
+
+    The hash is cached in a sidecar file next to the (symlink resolved) file
+    and reused for as long as the inode, size and mtime of the file match.
+    """
     if not local_file_path.exists() or local_file_path.stat().st_size == 0:
         return None
 
-    with open(local_file_path) as file, mmap.mmap(
+    real_file_path = local_file_path.resolve()
+    hash_key = get_hash_key(real_file_path.stat())
+    try:
+        with open(get_hash_sidecar_path(real_file_path)) as f:
+            cached = json.load(f)
+        if {k: cached[k] for k in hash_key} == hash_key:
+            return bytes.fromhex(cached["md5"])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    md5 = compute_md5(real_file_path)
+    write_hash_sidecar(real_file_path, md5)
+    return md5
+
+
+def compute_md5(file_path: Path) -> bytes:
+    if file_path.stat().st_size == 0:
+        return hashlib.md5().digest()
+    with open(file_path) as file, mmap.mmap(
         file.fileno(), 0, access=mmap.ACCESS_READ
     ) as file:
         return hashlib.md5(file).digest()
 
 
+def get_partial_paths(local_file_path: Path) -> Tuple[Path, Path]:
+    """Gets the paths of the data and state files of a ranged download."""
+    partial_path = local_file_path.with_name(local_file_path.name + ".partial")
+    return partial_path, partial_path.with_name(partial_path.name + ".json")
+
+
+def download_ranges(
+    fetch_range: Callable[[int, int], Iterable[bytes]],
+    local_file_path: Path,
+    size: int,
+    version: Optional[str],
+    expected_md5: Optional[bytes] = None,
+    range_jobs: int = 4,
+) -> bytes:
+    """
+    Downloads a file of known size to local_file_path as byte ranges fetched
+    in parallel, and returns its MD5 hash.
+
+    fetch_range(start, end) must return the bytes [start, end) of the file
+    as an iterable of chunks. Each range is retried on failure. Data is
+    written to '<file>.partial' and completed ranges are recorded in
+    '<file>.partial.json' along with the size and version (e.g. ETag) of the
+    remote file, so a download that fails or is interrupted resumes from the
+    completed ranges the next time it is run, unless the remote file changed.
+    """
+    partial_path, state_path = get_partial_paths(local_file_path)
+    state = {"size": size, "version": version, "range_size": RANGE_SIZE}
+    completed = set()
+    try:
+        with open(state_path) as f:
+            saved_state = json.load(f)
+        if partial_path.exists() and {k: saved_state[k] for k in state} == state:
+            completed = set(saved_state["completed"])
+    except (OSError, ValueError, KeyError):
+        pass
+    if completed:
+        logger.info(
+            f"  Resuming '{local_file_path.name}' download, "
+            f"{len(completed)} of {-(-size // RANGE_SIZE)} ranges already complete"
+        )
+    elif partial_path.exists():
+        os.remove(partial_path)
+
+    state_lock = threading.Lock()
+    fd = os.open(partial_path, os.O_RDWR | os.O_CREAT, 0o666)
+
+    def download_range(start: int):
+        end = min(start + RANGE_SIZE, size)
+        for attempt in range(RANGE_RETRIES):
+            try:
+                offset = start
+                for chunk in fetch_range(start, end):
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+                if offset != end:
+                    raise IOError(f"Received {offset - start} of {end - start} bytes")
+                break
+            except Exception as e:
+                if attempt + 1 == RANGE_RETRIES:
+                    raise
+                logger.warning(
+                    f"  Retrying range {start}-{end} of '{local_file_path.name}': {e}"
+                )
+                time.sleep(2**attempt)
+        with state_lock:
+            completed.add(start)
+            write_json_file(state_path, {**state, "completed": sorted(completed)})
+
+    try:
+        # Sparse until written, so ranges can be filled in any order.
+        os.ftruncate(fd, size)
+        remaining = [s for s in range(0, size, RANGE_SIZE) if s not in completed]
+        with ThreadPoolExecutor(max(1, range_jobs)) as executor:
+            # list() re-raises the first range that ran out of retries.
+            list(executor.map(download_range, remaining))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    md5 = compute_md5(partial_path)
+    # Empty files have no ranges, so no state was written for them.
+    state_path.unlink(missing_ok=True)
+    if expected_md5 and md5 != expected_md5:
+        os.remove(partial_path)
+        raise IOError(
+            f"Downloaded '{local_file_path.name}' does not match its MD5 hash"
+        )
+    os.replace(partial_path, local_file_path)
+    write_hash_sidecar(local_file_path, md5)
+    return md5
+
+
+def parse_azure_url(remote_file: str) -> Tuple[str, str, str]:
+    """
+    Extracts path components from an Azure URL to use with the Azure Storage
+    Blobs client library for Python (https://pypi.org/project/azure-storage-blob/).
+
+    For example:
+      https://sharkpublic.blob.core.windows.net/sharkpublic/path/to/blob.txt
+                                               ^           ^
+      account_url:    https://sharkpublic.blob.core.windows.net
+      container_name: sharkpublic
+      blob_name:      path/to/blob.txt
+    """
+    result = re.search(r"(https.+\.net)/([^/]+)/(.+)", remote_file)
+    return result.groups()
+
+
+def parse_huggingface_url(remote_file: str) -> Tuple[str, str, str]:
+    """
+    Extracts path components from a Hugging Face URL to use with huggingface_hub
+    (https://pypi.org/project/huggingface-hub/).
+
+    For example:
+      https://huggingface.co/SlyEcho/open_llama_3b_v2_gguf/resolve/main/open-llama-3b-v2-q4_0.gguf
+                             ^---------------------------^         ^    ^
+      repo_id:  SlyEcho/open_llama_3b_v2_gguf
+      revision: main
+      filename: open-llama-3b-v2-q4_0.gguf
+    """
+    result = re.search(
+        r"https://huggingface.co/(.+)/resolve/([^\/]+)/(.+)", remote_file
+    )
+    return result.groups()
+
+
 def download_azure_remote_file(
-    remote_file: str, test_dir: Path, cache_dir: Optional[Path]
+    remote_file: str, test_dir: Path, cache_dir: Optional[Path], range_jobs: int = 4
 ):
     """
-    Downloads a file from Azure into test_dir.
+    Downloads a file from Azure into test_dir, in resumable parallel ranges.
 
     If cache_dir is set, downloads there instead, creating a symlink from
     test_dir/file_name to cache_dir/file_name.
@@ -91,19 +315,7 @@ def download_azure_remote_file(
     remote_file_name = remote_file.rsplit("/", 1)[-1]
     relative_dir = test_dir.relative_to(REPO_ROOT)
 
-    # Extract path components from Azure URL to use with the Azure Storage Blobs
-    # client library for Python (https://pypi.org/project/azure-storage-blob/).
-    #
-    # For example:
-    #   https://sharkpublic.blob.core.windows.net/sharkpublic/path/to/blob.txt
-    #                                            ^           ^
-    #   account_url:    https://sharkpublic.blob.core.windows.net
-    #   container_name: sharkpublic
-    #   blob_name:      path/to/blob.txt
-    result = re.search(r"(https.+\.net)/([^/]+)/(.+)", remote_file)
-    account_url = result.groups()[0]
-    container_name = result.groups()[1]
-    blob_name = result.groups()[2]
+    account_url, container_name, blob_name = parse_azure_url(remote_file)
 
     with BlobClient(
         account_url,
@@ -141,9 +353,23 @@ def download_azure_remote_file(
                 f"to '{relative_dir}' (local MD5 does not match)"
             )
 
-        with open(local_file_path, mode="wb") as local_blob:
-            download_stream = blob_client.download_blob(max_concurrency=4)
-            local_blob.write(download_stream.readall())
+        def fetch_range(start: int, end: int):
+            # Fails instead of mixing in bytes from a newer version of the blob.
+            return blob_client.download_blob(
+                offset=start,
+                length=end - start,
+                etag=blob_properties.etag,
+                match_condition=MatchConditions.IfNotModified,
+            ).chunks()
+
+        download_ranges(
+            fetch_range,
+            local_file_path,
+            blob_properties.size,
+            blob_properties.etag,
+            azure_md5,
+            range_jobs,
+        )
         setup_cache_symlink_if_needed(cache_dir, test_dir, remote_file_name)
 
 
@@ -165,21 +391,7 @@ def download_huggingface_remote_file(
     remote_file_name = remote_file.rsplit("/", 1)[-1]
     relative_dir = test_dir.relative_to(REPO_ROOT)
 
-    # Extract path components from Hugging Face URL to use with huggingface_hub.
-    # (https://pypi.org/project/huggingface-hub/).
-    #
-    # For example:
-    #   https://huggingface.co/SlyEcho/open_llama_3b_v2_gguf/resolve/main/open-llama-3b-v2-q4_0.gguf
-    #                          ^---------------------------^         ^    ^
-    #   repo_id:  SlyEcho/open_llama_3b_v2_gguf
-    #   revision: main
-    #   filename: open-llama-3b-v2-q4_0.gguf
-    result = re.search(
-        r"https://huggingface.co/(.+)/resolve/([^\/]+)/(.+)", remote_file
-    )
-    repo_id = result.groups()[0]
-    revision = result.groups()[1]
-    filename = result.groups()[2]
+    repo_id, revision, filename = parse_huggingface_url(remote_file)
 
     logger.info(
         f"  Downloading '{remote_file_name}' from '{repo_id}' to '{relative_dir}'"
@@ -199,57 +411,378 @@ def download_huggingface_remote_file(
     )
 
 
+def fetch_http_range(remote_file: str, etag: Optional[str], start: int, end: int):
+    """Yields the bytes [start, end) of remote_file from an HTTP server."""
+    headers = {"Range": f"bytes={start}-{end - 1}"}
+    if etag:
+        # The server sends the whole (new) file instead if it has changed.
+        headers["If-Range"] = etag
+    request = urllib.request.Request(remote_file, headers=headers)
+    with urllib.request.urlopen(request, timeout=60) as response:
+        if response.status != 206:
+            raise IOError(
+                f"Server did not return the requested range of '{remote_file}'"
+            )
+        yield from iter(lambda: response.read(READ_CHUNK_SIZE), b"")
+
+
 def download_generic_remote_file(
-    remote_file: str, test_dir: Path, cache_dir: Optional[Path]
+    remote_file: str, test_dir: Path, cache_dir: Optional[Path], range_jobs: int = 4
 ):
     """
     Downloads a file from a generic URL into test_dir.
 
+    Servers that accept range requests are downloaded from in resumable
+    parallel ranges, other servers in a single stream.
+
     If cache_dir is set, downloads there instead, creating a symlink from
     test_dir/file_name to cache_dir/file_name.
     """
+    remote_file_name = remote_file.rsplit("/", 1)[-1]
+    relative_dir = test_dir.relative_to(REPO_ROOT)
+    local_dir = cache_dir if cache_dir else test_dir
+    local_file_path = local_dir / remote_file_name
+
+    request = urllib.request.Request(remote_file, method="HEAD")
+    with urllib.request.urlopen(request, timeout=60) as response:
+        headers = response.headers
+    remote_size = headers.get("Content-Length")
+    if (
+        remote_size is not None
+        and local_file_path.exists()
+        and local_file_path.stat().st_size == int(remote_size)
+    ):
+        logger.info(
+            f"  Skipping '{remote_file_name}' download "
+            f"({human_readable_size(int(remote_size))}) - local size matches"
+        )
+        setup_cache_symlink_if_needed(cache_dir, test_dir, remote_file_name)
+        return
 
-    # TODO(scotttodd): use https://pypi.org/project/requests/
-    raise NotImplementedError("generic remote file downloads not implemented yet")
+    logger.info(f"  Downloading '{remote_file_name}' to '{relative_dir}'")
+    if remote_size is not None and headers.get("Accept-Ranges") == "bytes":
+        etag = headers.get("ETag")
+        download_ranges(
+            partial(fetch_http_range, remote_file, etag),
+            local_file_path,
+            int(remote_size),
+            etag or headers.get("Last-Modified"),
+            range_jobs=range_jobs,
+        )
+        setup_cache_symlink_if_needed(cache_dir, test_dir, remote_file_name)
+        return
 
+    # Write to a temporary file first so an interrupted download is never
+    # mistaken for a complete one.
+    fd, temp_file = tempfile.mkstemp(
+        dir=local_dir, prefix=remote_file_name + ".", suffix=".part"
+    )
+    set_new_file_mode(fd)
+    try:
+        with urllib.request.urlopen(remote_file, timeout=60) as response, os.fdopen(
+            fd, mode="wb"
+        ) as local_file:
+            shutil.copyfileobj(response, local_file, READ_CHUNK_SIZE)
+        os.replace(temp_file, local_file_path)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+    setup_cache_symlink_if_needed(cache_dir, test_dir, remote_file_name)
+
+
+def get_remote_backend(remote_file: str) -> Tuple[StorageBackend, str]:
+    """
+    Gets the storage backend serving remote_file and the key of the file in it.
 
-def download_file(remote_file: str, test_dir: Path, cache_dir: Optional[Path]):
+    The backend determines the location of the file in a mirror. Files are
+    still downloaded from their remote by the download functions above, which
+    resume interrupted downloads and share the Hugging Face cache.
+    """
+    if "huggingface" in remote_file:
+        repo_id, revision, filename = parse_huggingface_url(remote_file)
+        return HfBackend(repo_id, revision), filename
+    parsed_url = urlparse(remote_file)
+    base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
+    return HttpBackend(base_url), parsed_url.path.lstrip("/")
+
+
+def get_mirror_file_path(mirror_dir: Path, remote_file: str) -> Path:
+    """Gets the location of remote_file in a mirror directory."""
+    remote, key = get_remote_backend(remote_file)
+    return Path(MirrorBackend(str(mirror_dir), remote).path(key))
+
+
+def find_mirrored_file(remote_file: str) -> Optional[Path]:
+    """
+    Gets the copy of remote_file to use from the selected mirror backend.
+
+    Returns None if the file should be downloaded from its remote instead, and
+    raises FileNotFoundError if no selected backend has it.
+    """
+    remote, key = get_remote_backend(remote_file)
+    for backend in select_backends([remote]):
+        if not isinstance(backend, MirrorBackend):
+            return None
+        if os.path.exists(backend.path(key)):
+            return Path(backend.path(key))
+    raise FileNotFoundError(
+        f"'{remote_file}' is not in mirror '{os.getenv(MIRROR_DIR_ENV)}'"
+    )
+
+
+def link_mirrored_file(mirror_file_path: Path, test_dir: Path):
+    """Creates a symlink from test_dir/file_name to a file in a mirror."""
+    setup_cache_symlink_if_needed(
+        cache_dir=mirror_file_path.parent,
+        local_dir=test_dir,
+        file_name=mirror_file_path.name,
+    )
+
+
+def sync_remote_file_to_mirror(
+    remote_file: str, test_dir: Path, mirror_dir: Path, range_jobs: int = 4
+):
+    """
+    Downloads remote_file into its location in mirror_dir, creating a symlink
+    from test_dir/file_name to it.
+    """
+    mirror_file_path = get_mirror_file_path(mirror_dir, remote_file)
+    os.makedirs(mirror_file_path.parent, exist_ok=True)
+    if "huggingface" in remote_file:
+        # The mirror path is <mirror>/huggingface.co/<repo_id>/resolve/<revision>/<filename>,
+        # so the file goes to local_dir/filename rather than to a Hugging Face cache.
+        repo_id, revision, filename = parse_huggingface_url(remote_file)
+        logger.info(f"  Mirroring '{filename}' from '{repo_id}'")
+        hf_hub_download(
+            repo_id=repo_id,
+            filename=filename,
+            revision=revision,
+            local_dir=mirror_dir / "huggingface.co" / repo_id / "resolve" / revision,
+        )
+        setup_cache_symlink_if_needed(
+            mirror_file_path.parent, test_dir, mirror_file_path.name
+        )
+    else:
+        # Azure and generic downloads already check the local copy before
+        # downloading, so an up to date mirror is not downloaded again.
+        download_remote_file(
+            remote_file, test_dir, mirror_file_path.parent, range_jobs=range_jobs
+        )
+
+
+def download_file(
+    remote_file: str,
+    test_dir: Path,
+    cache_dir: Optional[Path],
+    range_jobs: int = 4,
+):
     """
     Downloads a file from URL into test_dir, if the URL schema is supported.
 
     If cache_dir is set, downloads there instead, creating a symlink from
     test_dir/file_name to cache_dir/file_name.
+
+    If the selected storage backends start with a mirror, the file is linked
+    from the mirror instead. With "mirror-first", files that are missing from
+    the mirror are downloaded.
+
+    Azure and generic HTTP downloads fetch range_jobs byte ranges of the file
+    at a time and resume if they were interrupted.
     """
-    if "blob.core.windows.net" in remote_file:
-        download_azure_remote_file(remote_file, test_dir, cache_dir)
-    elif "huggingface" in remote_file:
-        download_huggingface_remote_file(remote_file, test_dir, cache_dir)
+    try:
+        mirror_file_path = find_mirrored_file(remote_file)
+    except FileNotFoundError as e:
+        logger.error(f"  {e}")
+        return
+    if mirror_file_path is not None:
+        link_mirrored_file(mirror_file_path, test_dir)
     else:
-        download_generic_remote_file(remote_file, test_dir, cache_dir)
+        download_remote_file(remote_file, test_dir, cache_dir, range_jobs)
 
 
-def download_files_for_test_case(
-    test_case_json: dict, test_dir: Path, jobs: int, cache_dir: Optional[Path]
+def download_remote_file(
+    remote_file: str,
+    test_dir: Path,
+    cache_dir: Optional[Path],
+    range_jobs: int = 4,
 ):
-    if "remote_files" not in test_case_json:
+    """Downloads a file from its remote, see download_file."""
+    if "huggingface" in remote_file:
+        # hf_hub_download locks its cache and resumes interrupted downloads.
+        download_huggingface_remote_file(remote_file, test_dir, cache_dir)
         return
 
-    # This is naive for now. We could further optimize with batching:
-    #   * Iterate over all files (across all included paths), building a list
-    #     of files to download (checking hashes / local references before
-    #     adding to the list)
-    #   * (Optionally) Determine disk space needed/available and ask before
-    #     continuing
-    #   * Group files based on source (e.g. Azure container)
+    remote_file_name = remote_file.rsplit("/", 1)[-1]
+    local_dir = cache_dir if cache_dir else test_dir
+    with single_flight(local_dir / f".{remote_file_name}.lock"):
+        if "blob.core.windows.net" in remote_file:
+            download_azure_remote_file(remote_file, test_dir, cache_dir, range_jobs)
+        else:
+            download_generic_remote_file(remote_file, test_dir, cache_dir, range_jobs)
 
-    with Pool(jobs) as pool:
-        pool.map(
-            partial(
-                download_file,
-                test_dir=test_dir,
-                cache_dir=cache_dir,
-            ),
-            test_case_json["remote_files"],
+
+class RemoteFile(NamedTuple):
+    """A remote file needed by the test cases in test_dir."""
+
+    remote_file: str
+    test_dir: Path
+    cache_dir: Optional[Path]
+
+
+class PlannedDownload(NamedTuple):
+    """A remote file with its size and whether it needs to be downloaded."""
+
+    remote: RemoteFile
+    size: int
+    needs_download: bool
+    # Where the downloaded bytes will be written, for the disk space check.
+    dest_dir: Path
+    # The copy of the file in the mirror, if it is linked from there.
+    mirror_file_path: Optional[Path] = None
+
+
+def collect_remote_files(root_dir: Path, cache_dir: Optional[Path]) -> List[RemoteFile]:
+    """Finds the remote files of all test cases under root_dir, deduplicated."""
+    remote_files = {}
+    for test_cases_path in root_dir.rglob("*.json"):
+        with open(test_cases_path) as f:
+            test_cases_json = pyjson5.load(f)
+        if test_cases_json.get("file_format", "") != "test_cases_v0":
+            continue
+
+        test_dir = test_cases_path.parent
+        relative_dir = test_dir.relative_to(REPO_ROOT)
+
+        # Expand directory structure in the cache matching the test tree.
+        if cache_dir:
+            cache_dir_for_test = cache_dir / relative_dir
+            os.makedirs(cache_dir_for_test, exist_ok=True)
+        else:
+            cache_dir_for_test = None
+
+        for test_case_json in test_cases_json["test_cases"]:
+            for remote_file in test_case_json.get("remote_files", []):
+                remote_files[(remote_file, test_dir)] = RemoteFile(
+                    remote_file, test_dir, cache_dir_for_test
+                )
+    return list(remote_files.values())
+
+
+def plan_download(
+    remote: RemoteFile,
+    mirror_dir: Optional[Path],
+    sync_mirror: bool,
+) -> PlannedDownload:
+    """Checks the size of a remote file and whether the local copy is current."""
+    remote_file = remote.remote_file
+    remote_file_name = remote_file.rsplit("/", 1)[-1]
+    if sync_mirror:
+        local_file_path = get_mirror_file_path(mirror_dir, remote_file)
+    else:
+        try:
+            mirror_file_path = find_mirrored_file(remote_file)
+        except FileNotFoundError as e:
+            logger.warning(f"  {e}")
+            return PlannedDownload(remote, 0, True, remote.test_dir)
+        if mirror_file_path is not None:
+            return PlannedDownload(
+                remote, 0, False, mirror_file_path.parent, mirror_file_path
+            )
+        local_dir = remote.cache_dir if remote.cache_dir else remote.test_dir
+        local_file_path = local_dir / remote_file_name
+
+    try:
+        if "blob.core.windows.net" in remote_file:
+            with BlobClient(*parse_azure_url(remote_file)) as blob_client:
+                blob_properties = blob_client.get_blob_properties()
+            size = blob_properties.size
+            azure_md5 = get_azure_md5(remote_file, blob_properties)
+            up_to_date = azure_md5 and azure_md5 == get_local_md5(local_file_path)
+        elif "huggingface" in remote_file:
+            repo_id, revision, filename = parse_huggingface_url(remote_file)
+            size = get_hf_file_metadata(
+                hf_hub_url(repo_id, filename, revision=revision)
+            ).size
+            if sync_mirror:
+                up_to_date = (
+                    local_file_path.exists() and local_file_path.stat().st_size == size
+                )
+            else:
+                # Downloads go to the Hugging Face cache, not to local_file_path.
+                hf_cache_dir = remote.cache_dir if remote.cache_dir else HF_HUB_CACHE
+                cached_path = try_to_load_from_cache(
+                    repo_id, filename, cache_dir=hf_cache_dir, revision=revision
+                )
+                up_to_date = isinstance(cached_path, str)
+                local_file_path = Path(hf_cache_dir) / remote_file_name
+        else:
+            request = urllib.request.Request(remote_file, method="HEAD")
+            with urllib.request.urlopen(request, timeout=60) as response:
+                size = int(response.headers.get("Content-Length", 0))
+            up_to_date = (
+                size > 0
+                and local_file_path.exists()
+                and local_file_path.stat().st_size == size
+            )
+    except Exception as e:
+        logger.warning(f"  Unable to check '{remote_file}': {e}")
+        return PlannedDownload(remote, 0, True, local_file_path.parent)
+    return PlannedDownload(remote, size or 0, not up_to_date, local_file_path.parent)
+
+
+def check_disk_space(plan: List[PlannedDownload]) -> bool:
+    """Reports the space needed for the planned downloads on each filesystem."""
+    needed = {}
+    for planned in plan:
+        if not planned.needs_download:
+            continue
+        dest_dir = planned.dest_dir
+        while not dest_dir.exists():
+            dest_dir = dest_dir.parent
+        device = os.stat(dest_dir).st_dev
+        first_dir, size = needed.get(device, (dest_dir, 0))
+        needed[device] = (first_dir, size + planned.size)
+
+    enough_space = True
+    for dest_dir, size in needed.values():
+        available = shutil.disk_usage(dest_dir).free
+        logger.info(
+            f"Need {human_readable_size(size)} on the disk of '{dest_dir}', "
+            f"{human_readable_size(available)} available"
+        )
+        if size > available:
+            logger.error(f"Not enough disk space for downloads to '{dest_dir}'")
+            enough_space = False
+    return enough_space
+
+
+def execute_download(
+    planned: PlannedDownload,
+    mirror_dir: Optional[Path],
+    sync_mirror: bool,
+    range_jobs: int,
+):
+    remote = planned.remote
+    remote_file_name = remote.remote_file.rsplit("/", 1)[-1]
+    if sync_mirror:
+        if planned.needs_download:
+            sync_remote_file_to_mirror(
+                remote.remote_file, remote.test_dir, mirror_dir, range_jobs
+            )
+        else:
+            setup_cache_symlink_if_needed(
+                planned.dest_dir, remote.test_dir, remote_file_name
+            )
+    elif planned.mirror_file_path is not None:
+        link_mirrored_file(planned.mirror_file_path, remote.test_dir)
+    elif planned.needs_download or "huggingface" in remote.remote_file:
+        # Cached Hugging Face files still need their location in the cache
+        # resolved.
+        download_file(remote.remote_file, remote.test_dir, remote.cache_dir, range_jobs)
+    else:
+        logger.info(f"  Skipping '{remote_file_name}' download - local copy matches")
+        setup_cache_symlink_if_needed(
+            remote.cache_dir, remote.test_dir, remote_file_name
         )
 
 
@@ -266,6 +799,31 @@ if __name__ == "__main__":
         help="Local cache directory to download into. If set, symlinks will be created pointing to "
         "this location",
     )
+    parser.add_argument(
+        "--mirror-dir",
+        default=os.getenv(MIRROR_DIR_ENV, default=""),
+        help="Mirror directory holding copies of the remote files (see --sync-mirror). If set, "
+        "symlinks will be created pointing to the mirror instead of downloading files. Set "
+        f"{BACKEND_ENV}=mirror-first to download files missing from the mirror",
+    )
+    parser.add_argument(
+        "--sync-mirror",
+        action="store_true",
+        default=False,
+        help="Download the remote files into --mirror-dir, for use on hosts without network access",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        default=False,
+        help="List the files that would be downloaded and their sizes, then exit",
+    )
+    parser.add_argument(
+        "--ignore-disk-space",
+        action="store_true",
+        default=False,
+        help="Download even if the disk space check fails",
+    )
     parser.add_argument(
         "-j",
         "--jobs",
@@ -273,6 +831,12 @@ if __name__ == "__main__":
         default=8,
         help="Number of parallel processes to use when downloading files",
     )
+    parser.add_argument(
+        "--range-jobs",
+        type=int,
+        default=4,
+        help="Number of byte ranges of each file to download in parallel",
+    )
     args = parser.parse_args()
 
     # Adjust logging levels.
@@ -284,33 +848,40 @@ if __name__ == "__main__":
     # Resolve cache location.
     if args.cache_dir:
         args.cache_dir = Path(os.path.expanduser(args.cache_dir)).resolve()
-
-    # TODO(scotttodd): build list of files _then_ download
-    # TODO(scotttodd): report size needed for requested files and size available on disk
-
-    for test_cases_path in (REPO_ROOT / args.root_dir).rglob("*.json"):
-        with open(test_cases_path) as f:
-            test_cases_json = pyjson5.load(f)
-            if test_cases_json.get("file_format", "") != "test_cases_v0":
-                continue
-
-            logger.info(f"Processing {test_cases_path.relative_to(REPO_ROOT)}")
-
-            test_dir = test_cases_path.parent
-            relative_dir = test_dir.relative_to(REPO_ROOT)
-
-            # Expand directory structure in the cache matching the test tree.
-            if args.cache_dir:
-                cache_dir_for_test = args.cache_dir / relative_dir
-                if not os.path.isdir(cache_dir_for_test):
-                    os.makedirs(cache_dir_for_test)
-            else:
-                cache_dir_for_test = None
-
-            for test_case_json in test_cases_json["test_cases"]:
-                download_files_for_test_case(
-                    test_case_json=test_case_json,
-                    test_dir=test_dir,
-                    jobs=args.jobs,
-                    cache_dir=cache_dir_for_test,
+    if args.mirror_dir:
+        args.mirror_dir = Path(os.path.expanduser(args.mirror_dir)).resolve()
+        # The backends are selected from the environment, in the workers too.
+        os.environ[MIRROR_DIR_ENV] = str(args.mirror_dir)
+    elif args.sync_mirror:
+        parser.error("--sync-mirror requires --mirror-dir")
+    try:
+        select_backends([])
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Plan: find all remote files, then check which need downloading and how
+    # much space that takes. Execute: download on the same pool of workers.
+    remote_files = collect_remote_files(REPO_ROOT / args.root_dir, args.cache_dir)
+    options = dict(mirror_dir=args.mirror_dir, sync_mirror=args.sync_mirror)
+    with Pool(args.jobs) as pool:
+        plan = pool.map(partial(plan_download, **options), remote_files)
+        to_download = [planned for planned in plan if planned.needs_download]
+        logger.info(
+            f"{len(plan)} remote files, {len(to_download)} to download "
+            f"({human_readable_size(sum(planned.size for planned in to_download))})"
+        )
+        if args.dry_run:
+            for planned in to_download:
+                logger.info(
+                    f"  {planned.remote.remote_file} ({human_readable_size(planned.size)})"
                 )
+            sys.exit(0)
+        if not check_disk_space(plan) and not args.ignore_disk_space:
+            sys.exit(1)
+        # Start the largest downloads first so they overlap with the rest.
+        plan.sort(key=lambda planned: planned.size, reverse=True)
+        pool.map(
+            partial(execute_download, range_jobs=args.range_jobs, **options),
+            plan,
+            chunksize=1,
+        )
@@ -0,0 +1,159 @@
+# Copyright 2024 Advanced Micro Devices, Inc.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+# Tests of the resumable range downloads of download_remote_files.py against a
+# local HTTP server. Run with:
+#   pytest iree_tests/test_download_remote_files.py
+
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import json
+import os
+import stat
+import threading
+
+import pytest
+
+pytest.importorskip("azure.storage.blob")
+pytest.importorskip("huggingface_hub")
+
+import download_remote_files
+from tools.storagebackend import UMASK
+from download_remote_files import (
+    download_ranges,
+    fetch_http_range,
+    find_mirrored_file,
+    get_mirror_file_path,
+    get_partial_paths,
+)
+
+RANGE_SIZE = 1024
+FILE_SIZE = 5 * RANGE_SIZE + 100
+ETAG = '"v1"'
+
+
+class RangeServer(ThreadingHTTPServer):
+    """Serves one file with support for single byte range requests."""
+
+    def __init__(self, data: bytes):
+        super().__init__(("127.0.0.1", 0), RangeRequestHandler)
+        self.data = data
+        # start offsets of the requested ranges, and the ranges to fail
+        self.requested = []
+        self.failing = set()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/model.bin"
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        start, end = self.headers["Range"].removeprefix("bytes=").split("-")
+        start, end = int(start), int(end) + 1
+        with self.server.lock:
+            self.server.requested.append(start)
+        if start in self.server.failing:
+            self.send_error(500)
+            return
+        self.send_response(206)
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("ETag", ETAG)
+        self.end_headers()
+        self.wfile.write(self.server.data[start:end])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(download_remote_files, "RANGE_SIZE", RANGE_SIZE)
+    # fail a range at once instead of backing off between retries
+    monkeypatch.setattr(download_remote_files, "RANGE_RETRIES", 1)
+    server = RangeServer(os.urandom(FILE_SIZE))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_interrupted_download_resumes_from_partial(server, tmp_path):
+    local_file_path = tmp_path / "model.bin"
+    partial_path, state_path = get_partial_paths(local_file_path)
+    fetch_range = partial(fetch_http_range, server.url, ETAG)
+    expected_md5 = hashlib.md5(server.data).digest()
+
+    server.failing = {2 * RANGE_SIZE}
+    with pytest.raises(OSError):
+        download_ranges(fetch_range, local_file_path, FILE_SIZE, ETAG, expected_md5)
+    assert not local_file_path.exists()
+    assert partial_path.exists()
+    with open(state_path) as f:
+        completed = json.load(f)["completed"]
+    # other users of a shared cache can read the state, unlike mkstemp's 0600
+    assert stat.S_IMODE(state_path.stat().st_mode) == 0o666 & ~UMASK
+    assert completed == [0, RANGE_SIZE, 3 * RANGE_SIZE, 4 * RANGE_SIZE, 5 * RANGE_SIZE]
+
+    server.failing = set()
+    server.requested = []
+    md5 = download_ranges(fetch_range, local_file_path, FILE_SIZE, ETAG, expected_md5)
+    assert server.requested == [2 * RANGE_SIZE]
+    assert md5 == expected_md5
+    assert local_file_path.read_bytes() == server.data
+    assert not partial_path.exists() and not state_path.exists()
+
+
+def test_changed_remote_file_restarts_download(server, tmp_path):
+    local_file_path = tmp_path / "model.bin"
+    fetch_range = partial(fetch_http_range, server.url, ETAG)
+
+    server.failing = {0}
+    with pytest.raises(OSError):
+        download_ranges(fetch_range, local_file_path, FILE_SIZE, ETAG)
+
+    # the completed ranges belong to the previous version and are fetched again
+    server.failing = set()
+    server.requested = []
+    download_ranges(fetch_range, local_file_path, FILE_SIZE, '"v2"')
+    assert sorted(server.requested) == list(range(0, FILE_SIZE, RANGE_SIZE))
+    assert local_file_path.read_bytes() == server.data
+
+
+def test_mirror_backend_selection(monkeypatch, tmp_path):
+    mirrored = "https://huggingface.co/org/model/resolve/main/model.gguf"
+    missing = "https://sharkpublic.blob.core.windows.net/sharkpublic/model.bin"
+    mirrored_path = tmp_path / "huggingface.co/org/model/resolve/main/model.gguf"
+    assert get_mirror_file_path(tmp_path, mirrored) == mirrored_path
+    mirrored_path.parent.mkdir(parents=True)
+    mirrored_path.write_bytes(b"gguf")
+
+    monkeypatch.setenv("SHARK_MIRROR_DIR", str(tmp_path))
+    assert find_mirrored_file(mirrored) == mirrored_path
+    with pytest.raises(FileNotFoundError):
+        find_mirrored_file(missing)
+
+    monkeypatch.setenv("SHARK_STORAGE_BACKEND", "mirror-first")
+    assert find_mirrored_file(mirrored) == mirrored_path
+    assert find_mirrored_file(missing) is None
+
+    monkeypatch.setenv("SHARK_STORAGE_BACKEND", "remote")
+    assert find_mirrored_file(mirrored) is None
+
+
+def test_empty_file(tmp_path):
+    local_file_path = tmp_path / "empty.bin"
+
+    def fetch_range(start, end):
+        raise AssertionError("an empty file has no ranges to fetch")
+
+    md5 = download_ranges(fetch_range, local_file_path, 0, ETAG, hashlib.md5().digest())
+    assert md5 == hashlib.md5().digest()
+    assert local_file_path.read_bytes() == b""
+    assert not any(path.exists() for path in get_partial_paths(local_file_path))
@@ -4,12 +4,31 @@
 # See https://llvm.org/LICENSE.txt for license information.
 # SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
 
+import os
+import sys
 import torch
+from pathlib import Path
+
+# the storage backends of e2eshark, which also serve its model downloads
+sys.path.append(str(Path(__file__).parents[1] / "e2eshark"))
+from tools.storagebackend import (
+    MIRROR_DIR_ENV,
+    HfBackend,
+    HttpBackend,
+    MirrorBackend,
+    select_backends,
+)
 
 torch.manual_seed(0)
 
 BATCH_SIZE = 1
 
+# Hugging Face models and the test image are loaded from the backends chosen
+# by SHARK_MIRROR_DIR and SHARK_STORAGE_BACKEND, as for the model downloads of
+# e2eshark, alt_e2eshark and iree_tests (see e2eshark/tools/storagebackend.py).
+# Hugging Face models are mirrored as a snapshot in
+# <mirror>/huggingface.co/<model>/resolve/main.
+
 model_list = [
     ("microsoft/resnet-50", "hf_img_cls"),
     ("bert-large-uncased", "hf"),
@@ -45,6 +64,30 @@ model_list = [
 ]
 
 
+def hf_mirror_dir(mirror_dir, model_name):
+    # The key "" of a Hugging Face backend is the snapshot of the whole model
+    return MirrorBackend(mirror_dir, HfBackend(model_name)).path("")
+
+
+def mirrored_source(remote, key, remote_source):
+    # Where to load key of the remote backend from: its copy in the mirror or
+    # remote_source (e.g. a Hugging Face model name), for the first of the
+    # selected backends which has it
+    for backend in select_backends([remote]):
+        if not isinstance(backend, MirrorBackend):
+            return remote_source
+        if os.path.exists(backend.path(key)):
+            return backend.path(key)
+    raise FileNotFoundError(
+        f"{remote.url(key)} is not in mirror {os.getenv(MIRROR_DIR_ENV)}"
+    )
+
+
+def hf_model_source(model_name):
+    # The name or path to pass to from_pretrained
+    return mirrored_source(HfBackend(model_name), "", model_name)
+
+
 ##################### Hugging Face Image Classification Models ###################################
 from transformers import AutoModelForImageClassification
 from transformers import AutoFeatureExtractor
@@ -52,18 +95,26 @@ from PIL import Image
 import requests
 
 
+TEST_IMAGE_STORAGE = HttpBackend("http://images.cocodataset.org")
+TEST_IMAGE_KEY = "val2017/000000039769.jpg"
+TEST_IMAGE_URL = TEST_IMAGE_STORAGE.url(TEST_IMAGE_KEY)
+
+
 def preprocess_input_image(model_name):
     # from datasets import load_dataset
     # dataset = load_dataset("huggingface/cats-image")
     # image1 = dataset["test"]["image"][0]
     # # print("image1: ", image1) # <PIL.JpegImagePlugin.JpegImageFile image mode=RGB size=640x480 at 0x7FA0B86BB6D0>
-    url = "http://images.cocodataset.org/val2017/000000039769.jpg"
+    url = mirrored_source(TEST_IMAGE_STORAGE, TEST_IMAGE_KEY, TEST_IMAGE_URL)
     # <PIL.JpegImagePlugin.JpegImageFile image mode=RGB size=640x480 at 0x7FA0B86BB6D0>
-    image = Image.open(requests.get(url, stream=True).raw)
+    if os.path.exists(url):
+        image = Image.open(url)
+    else:
+        image = Image.open(requests.get(url, stream=True).raw)
     # feature_extractor = img_models_fe_dict[model_name].from_pretrained(
     #     model_name
     # )
-    feature_extractor = AutoFeatureExtractor.from_pretrained(model_name)
+    feature_extractor = AutoFeatureExtractor.from_pretrained(hf_model_source(model_name))
     inputs = feature_extractor(images=image, return_tensors="pt")
     # inputs = {'pixel_values': tensor([[[[ 0.1137..., -0.2000, -0.4275, -0.5294]]]])}
     #           torch.Size([1, 3, 224, 224]), torch.FloatTensor
@@ -75,7 +126,7 @@ class HuggingFaceImageClassification(torch.nn.Module):
     def __init__(self, hf_model_name):
         super().__init__()
         self.model = AutoModelForImageClassification.from_pretrained(
-            hf_model_name,  # The pretrained model.
+            hf_model_source(hf_model_name),  # The pretrained model.
             output_attentions=False,  # Whether the model returns attentions weights.
             return_dict=False,  # https://github.com/huggingface/transformers/issues/9095
             torchscript=True,
@@ -110,7 +161,7 @@ class HuggingFaceLanguage(torch.nn.Module):
         transformers_path = trf.__path__[0]
         hf_model_path = f"{transformers_path}/models/{hf_model_name}"
         self.model = AutoModelForSequenceClassification.from_pretrained(
-            hf_model_name,  # The pretrained model.
+            hf_model_source(hf_model_name),  # The pretrained model.
             num_labels=2,  # The number of output labels--2 for binary classification.
             output_attentions=False,  # Whether the model returns attentions weights.
             output_hidden_states=False,  # Whether the model returns all hidden-states.
@@ -140,13 +191,13 @@ class HFSeq2SeqLanguageModel(torch.nn.Module):
         super().__init__()
         from transformers import AutoTokenizer, T5Model
 
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.tokenizer = AutoTokenizer.from_pretrained(hf_model_source(model_name))
         self.tokenization_kwargs = {
             "pad_to_multiple_of": T5_MAX_SEQUENCE_LENGTH,
             "padding": True,
             "return_tensors": "pt",
         }
-        self.model = T5Model.from_pretrained(model_name, return_dict=True)
+        self.model = T5Model.from_pretrained(hf_model_source(model_name), return_dict=True)
 
     def preprocess_input(self, text):
         return self.tokenizer(text, **self.tokenization_kwargs)
@@ -174,7 +225,7 @@ from transformers import AutoTokenizer, AutoModelForCausalLM
 
 def prepare_sentence_tokens(hf_model: str, sentence: str):
     tokenizer = AutoTokenizer.from_pretrained(
-        hf_model
+        hf_model_source(hf_model)
     )
     return torch.tensor([tokenizer.encode(sentence)])
 
@@ -183,7 +234,7 @@ class HFCausalLM(torch.nn.Module):
     def __init__(self, model_name: str):
         super().__init__()
         self.model = AutoModelForCausalLM.from_pretrained(
-            model_name,  # The pretrained model name.
+            hf_model_source(model_name),  # The pretrained model name.
             # The number of output labels--2 for binary classification.
             num_labels=2,
             # Whether the model returns attentions weights.
@@ -261,3 +312,32 @@ def get_vision_model(torch_model, import_args):
     test_input = torch.randn(int(import_args["batch_size"]), 3, *input_image_size)
     actual_out = model(test_input)
     return model, test_input, actual_out
+
+
+################################################################################
+
+
+def sync_mirror(mirror_dir):
+    # Downloads the Hugging Face models in model_list and the test image into
+    # mirror_dir. Torchvision weights are not mirrored, they come from TORCH_HOME.
+    from huggingface_hub import snapshot_download
+
+    for model_name, model_type in model_list:
+        if not model_type.startswith("hf"):
+            continue
+        print(f"Mirroring {model_name}")
+        snapshot_download(
+            repo_id=model_name, local_dir=hf_mirror_dir(mirror_dir, model_name)
+        )
+    MirrorBackend(mirror_dir, TEST_IMAGE_STORAGE).sync(TEST_IMAGE_KEY)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Populate a mirror directory with the turbine tank Hugging Face models. "
+        "Set SHARK_MIRROR_DIR to load the models from it."
+    )
+    parser.add_argument("mirror_dir")
+    sync_mirror(parser.parse_args().mirror_dir)